@@ -0,0 +1,286 @@
+#!/usr/bin/env python3
+"""
+Benchmarki OCR Tesseract Pro
+Mierzy czas i jakość wybranych etapów na danych syntetycznych (bez obrazów i bez Tesseracta)
+"""
+
+import io
+import sys
+import time
+import random
+import argparse
+import tracemalloc
+
+import cv2
+import numpy as np
+from PIL import Image
+
+import main as ocr
+
+VOCABULARY = (
+    "faktura vat numer data sprzedaży nabywca sprzedawca adres ulica miasto kod pocztowy nip regon "
+    "towar usługa ilość cena netto brutto stawka podatek razem do zapłaty termin płatności przelew "
+    "konto bankowe numer rachunku uwagi podpis osoba upoważniona wystawienia odbioru zamówienie "
+    "dostawa transport magazyn rabat waluta kurs korekta duplikat oryginał pozycja jednostka sztuka"
+).split()
+
+# Typowe pomyłki OCR: sklejanie/rozdzielanie liter, utrata znaków diakrytycznych, cyfry zamiast liter
+OCR_CONFUSIONS = [('m', 'rn'), ('rn', 'm'), ('l', '1'), ('o', '0'), ('e', 'c'), ('h', 'b'),
+                  ('ą', 'a'), ('ę', 'e'), ('ł', 'l'), ('ó', 'o'), ('ś', 's'), ('ż', 'z'), ('ć', 'c'), ('ń', 'n')]
+
+
+SYLLABLES = "ka ro wa mi sz cz ła ny to pe ko le du go ra ni że sk ow st".split()
+
+
+def make_document(rng, words=60, specific_share=0.4):
+    # Wspólne słownictwo formularzy + słowa i liczby charakterystyczne dla dokumentu (nazwy, kwoty, numery)
+    specific = ["".join(rng.choice(SYLLABLES) for _ in range(rng.randint(2, 4))) for _ in range(8)]
+    specific += [str(rng.randint(10, 99999)) for _ in range(4)]
+    return " ".join(rng.choice(specific) if rng.random() < specific_share else rng.choice(VOCABULARY)
+                    for _ in range(words))
+
+
+def add_ocr_noise(rng, text, rate):
+    for source, target in OCR_CONFUSIONS:
+        parts = text.split(source)
+        text = parts[0] + "".join((target if rng.random() < rate else source) + part for part in parts[1:])
+    chars = [ch for ch in text if rng.random() >= rate / 4]
+    return "".join(chars)
+
+
+def make_corpus(seed=7, documents=40, variants=5, noise=0.3):
+    rng = random.Random(seed)
+    references = [make_document(rng) for _ in range(documents)]
+    corpus = []
+    for doc_id, reference in enumerate(references):
+        for _ in range(variants):
+            corpus.append((doc_id, add_ocr_noise(rng, reference, noise)))
+    return references, corpus
+
+
+def score_corpus(scorer, texts):
+    scores = np.concatenate([scorer.score_batch(texts[i:i + ocr.SCORE_BATCH_SIZE],
+                                                keys=range(i, min(i + ocr.SCORE_BATCH_SIZE, len(texts))))
+                             for i in range(0, len(texts), ocr.SCORE_BATCH_SIZE)])
+    # Tryb fuzzy: k najlepszych według n-gramów oceniane ponownie odległością edycyjną
+    for i, (similarity, _) in scorer.rerank().items():
+        scores[i] = similarity
+    return scores
+
+
+def best_f1_threshold(score_rows, labels):
+    # Próg maksymalizujący F1 na wszystkich parach wzorzec-kandydat (siatka co 0.05)
+    best = (0.0, 0.0)
+    for threshold in np.arange(0.05, 0.96, 0.05):
+        true_positive = false_positive = 0
+        for doc_id, scores in enumerate(score_rows):
+            matched = scores >= threshold
+            true_positive += int(np.sum(matched & (labels == doc_id)))
+            false_positive += int(np.sum(matched & (labels != doc_id)))
+        recall = true_positive / len(labels)
+        precision = true_positive / (true_positive + false_positive) if true_positive + false_positive else 0.0
+        f1 = 2 * recall * precision / (recall + precision) if recall + precision else 0.0
+        best = max(best, (f1, round(float(threshold), 2)))
+    return best[1], best[0]
+
+
+def benchmark_similarity(threshold=None, noise=0.3):
+    """Porównaj tryby oceny podobieństwa: czułość, precyzja i czas oceny (próg domyślny trybu lub zadany)"""
+    references, corpus = make_corpus(noise=noise)
+    texts = [text for _, text in corpus]
+    labels = np.array([doc_id for doc_id, _ in corpus])
+    variants = int(np.sum(labels == 0))
+
+    print(f"\n🧮 Podobieństwo tekstu: {len(references)} wzorców x {len(texts)} kandydatów, szum OCR {noise:.0%}")
+    print(f"{'tryb':<8}{'próg':>7}{'czułość':>10}{'precyzja':>10}{'trafne@k':>10}{'czas [s]':>10}"
+          f"{'ocen/s':>12}{'próg F1':>9}{'F1':>8}")
+
+    for mode in ocr.SIMILARITY_MODES:
+        mode_threshold = ocr.SIMILARITY_THRESHOLDS[mode] if threshold is None else threshold
+        true_positive = false_positive = ranked_hits = 0
+        score_rows = []
+        start = time.perf_counter()
+        for doc_id, reference in enumerate(references):
+            scores = score_corpus(ocr.SimilarityScorer(reference, mode, mode_threshold), texts)
+            score_rows.append(scores)
+            matched = scores >= mode_threshold
+            true_positive += int(np.sum(matched & (labels == doc_id)))
+            false_positive += int(np.sum(matched & (labels != doc_id)))
+            # Ranking niezależny od progu: ile z k najlepszych to warianty tego wzorca
+            ranked_hits += int(np.sum(labels[np.argsort(-scores)[:variants]] == doc_id))
+        elapsed = time.perf_counter() - start
+
+        relevant = len(texts)
+        recall = true_positive / relevant
+        precision = true_positive / (true_positive + false_positive) if true_positive + false_positive else 0.0
+        pairs = len(references) * len(texts)
+        calibrated, f1 = best_f1_threshold(score_rows, labels)
+        print(f"{mode:<8}{mode_threshold:>7.2f}{recall:>10.1%}{precision:>10.1%}{ranked_hits / relevant:>10.1%}"
+              f"{elapsed:>10.2f}{pairs / elapsed:>12.0f}{calibrated:>9.2f}{f1:>8.1%}")
+
+
+def make_page(seed=7, width=2480, height=3508):
+    # Strona A4 w 300 dpi: jasne tło z ciemnymi "wierszami" tekstu
+    rng = np.random.default_rng(seed)
+    page = np.full((height, width, 3), 245, np.uint8)
+    for top in range(150, height - 150, 60):
+        left = 150
+        while left < width - 300:
+            word = int(rng.integers(40, 220))
+            page[top:top + 30, left:left + word] = rng.integers(0, 60, 3)
+            left += word + 25
+    return page
+
+
+def measure(func, repeats=3):
+    # Szczyt pamięci śledzonej przez tracemalloc (bufory NumPy/OpenCV i bytes) oraz najlepszy czas
+    best = float('inf')
+    tracemalloc.start()
+    for _ in range(repeats):
+        tracemalloc.reset_peak()
+        start = time.perf_counter()
+        func()
+        best = min(best, time.perf_counter() - start)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return peak, best
+
+
+def legacy_engine_handoff(page):
+    # Dawna ścieżka: BGR->RGB, Image.fromarray i plik PNG zapisywany przez pytesseract
+    pil_image = Image.fromarray(cv2.cvtColor(page, cv2.COLOR_BGR2RGB))
+    pil_image.save(io.BytesIO(), format='PNG')
+
+
+def buffer_engine_handoff(page):
+    pil_image = ocr.ImageBuffer(page).to_pil()
+    pil_image.save(io.BytesIO(), format=pil_image.format)
+
+
+def buffer_raw_handoff(page):
+    # Ścieżka tesserocr: SetImageBytes wymaga bytes, więc bufor jest kopiowany (tobytes)
+    ocr.ImageBuffer(page).array.tobytes()
+
+
+def legacy_thumbnail(page):
+    pil_image = Image.fromarray(cv2.cvtColor(page, cv2.COLOR_BGR2RGB))
+    pil_image.thumbnail((500, 350), Image.Resampling.LANCZOS)
+
+
+def buffer_thumbnail(page):
+    ocr.make_display_thumbnail(page, (500, 350))
+
+
+def benchmark_allocations():
+    """Porównaj alokacje i czas przekazania obrazu do silnika OCR oraz tworzenia podglądu"""
+    page = make_page()
+    print(f"\n🧠 Alokacje na jeden OCR: strona {page.shape[1]}x{page.shape[0]} BGR "
+          f"({page.nbytes / 1024 ** 2:.1f} MB)")
+    print(f"{'etap':<34}{'szczyt [MB]':>12}{'czas [ms]':>12}")
+
+    stages = [
+        ("silnik: RGB + PNG (dawniej)", legacy_engine_handoff),
+        ("silnik: bufor szary + BMP", buffer_engine_handoff),
+        ("silnik: kopia bytes (tesserocr)", buffer_raw_handoff),
+        ("podgląd: RGB + thumbnail (dawniej)", legacy_thumbnail),
+        ("podgląd: zmniejszenie + RGB", buffer_thumbnail),
+    ]
+    for label, func in stages:
+        peak, elapsed = measure(lambda: func(page))
+        print(f"{label:<34}{peak / 1024 ** 2:>12.1f}{elapsed * 1000:>12.1f}")
+
+
+def make_text_page(seed=7, width=1240, height=1754):
+    # Strona A4 w 150 dpi z prawdziwymi pociągnięciami pisma (przed powiększeniem do OCR)
+    rng = random.Random(seed)
+    page = np.full((height, width), 240, np.uint8)
+    for top in range(80, height - 60, 32):
+        line = " ".join(rng.choice(VOCABULARY) for _ in range(9))
+        cv2.putText(page, line, (60, top), cv2.FONT_HERSHEY_SIMPLEX, 0.8, 20, 2, cv2.LINE_AA)
+    return page
+
+
+def add_noise(page, sigma, salt_pepper=0.0, seed=7):
+    rng = np.random.default_rng(seed)
+    noisy = page.astype(np.float32) + rng.normal(0, sigma, page.shape)
+    if salt_pepper:
+        specks = rng.random(page.shape)
+        noisy[specks < salt_pepper / 2] = 0
+        noisy[specks > 1 - salt_pepper / 2] = 255
+    return np.clip(noisy, 0, 255).astype(np.uint8)
+
+
+def psnr(image, reference):
+    mse = np.mean((image.astype(np.float32) - reference.astype(np.float32)) ** 2)
+    return 99.0 if mse == 0 else 10 * np.log10(255 ** 2 / mse)
+
+
+def binarization_error(image, reference):
+    # Odsetek pikseli, które po progowaniu Otsu różnią się od czystej strony - bliższe temu, co widzi OCR
+    _, binary = cv2.threshold(image, 0, 255, cv2.THRESH_BINARY + cv2.THRESH_OTSU)
+    _, clean = cv2.threshold(reference, 0, 255, cv2.THRESH_BINARY + cv2.THRESH_OTSU)
+    return float(np.mean(binary != clean))
+
+
+def legacy_denoise(page, scale=2):
+    # Dawna ścieżka: powiększenie, potem fastNlMeansDenoising z domyślnymi parametrami
+    h, w = page.shape
+    return cv2.fastNlMeansDenoising(cv2.resize(page, (w * scale, h * scale), interpolation=cv2.INTER_CUBIC))
+
+
+def benchmark_denoise():
+    """Porównaj metody odszumiania: jakość (PSNR, błąd binaryzacji), czas i wybór automatyczny"""
+    clean = make_text_page()
+    upscaled_clean = cv2.resize(clean, (clean.shape[1] * 2, clean.shape[0] * 2), interpolation=cv2.INTER_CUBIC)
+    cases = [("czysta", 0, 0.0), ("szum σ=5", 5, 0.0), ("szum σ=12", 12, 0.0), ("szum σ=25", 25, 0.0),
+             ("sól i pieprz 2%", 3, 0.02)]
+    methods = [(None, "bez odszumiania")] + [(name, label) for name, (label, _, _) in ocr.DENOISE_METHODS.items()]
+
+    print(f"\n🧹 Odszumianie: strona {clean.shape[1]}x{clean.shape[0]}, wątki {ocr.DENOISE_WORKERS}")
+    print(f"{'przypadek':<18}{'metoda':<26}{'PSNR [dB]':>10}{'błąd bin.':>11}{'czas [ms]':>11}")
+    for case, sigma, salt_pepper in cases:
+        noisy = add_noise(clean, sigma, salt_pepper)
+        estimated = ocr.estimate_noise_sigma(noisy)
+        auto = ocr.choose_denoise_method(estimated, ocr.estimate_impulse_ratio(noisy))
+        for method, label in methods:
+            start = time.perf_counter()
+            if method is None:
+                result = noisy
+            else:
+                result, _, _ = ocr.fast_denoise(noisy, method)
+            elapsed = time.perf_counter() - start
+            marker = " ◀ auto" if method == auto else ""
+            print(f"{case:<18}{label:<26}{psnr(result, clean):>10.1f}{binarization_error(result, clean):>11.2%}"
+                  f"{elapsed * 1000:>11.1f}{marker}")
+
+        start = time.perf_counter()
+        result = legacy_denoise(noisy)
+        elapsed = time.perf_counter() - start
+        print(f"{case:<18}{'NL-means po powiększeniu':<26}{psnr(result, upscaled_clean):>10.1f}"
+              f"{binarization_error(result, upscaled_clean):>11.2%}{elapsed * 1000:>11.1f}  (dawniej)")
+        print(f"{'':<18}szacowana σ={estimated:.1f}")
+
+
+BENCHMARKS = {
+    'similarity': benchmark_similarity,
+    'allocations': benchmark_allocations,
+    'denoise': benchmark_denoise,
+}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmarki OCR Tesseract Pro")
+    parser.add_argument('names', nargs='*', metavar='NAZWA',
+                        help=f"Benchmarki do uruchomienia: {', '.join(BENCHMARKS)} (domyślnie wszystkie)")
+    args = parser.parse_args()
+
+    unknown = [name for name in args.names if name not in BENCHMARKS]
+    if unknown:
+        parser.error(f"Nieznane benchmarki: {', '.join(unknown)}")
+
+    for name in args.names or BENCHMARKS:
+        BENCHMARKS[name]()
+
+
+if __name__ == "__main__":
+    sys.exit(main())
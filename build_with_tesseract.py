@@ -2,15 +2,60 @@
 """
 Skrypt budowania EXE z lokalnym Tesseract-OCR
 Automatycznie kopiuje Tesseract-OCR obok EXE w dist/
+
+Domyślnie buduje katalog (--onedir) zamiast pojedynczego pliku: onefile przy każdym
+uruchomieniu rozpakowuje całą aplikację do katalogu tymczasowego. Do paczki trafiają
+tylko modele skonfigurowanych języków (opcjonalnie warianty "fast").
 """
 
 import os
+import ast
 import sys
+import time
 import shutil
+import pkgutil
+import argparse
 import subprocess
+import importlib.util
 from pathlib import Path
 
-def check_requirements():
+APP_NAME = 'OCR_Tesseract_Pro'
+
+# Moduły, których aplikacja nie używa, a które hooki PyInstallera wciągają przez zależności
+EXCLUDED_MODULES = [
+    'pandas',
+    'matplotlib',
+    'IPython',
+    'jupyter_client',
+    'notebook',
+    'pytest',
+    'setuptools',
+    'tkinter.test',
+    'pydoc_data',
+]
+
+# Opcjonalny tryb semantyczny (sentence-transformers + torch) to setki MB; bez niego aplikacja
+# używa wektorów haszowanych
+SEMANTIC_MODULES = ['sentence_transformers', 'transformers', 'torch', 'torchvision']
+
+# Kod, który wykonuje dokładnie te ścieżki sklearn/scipy, z których korzysta main.py
+SKLEARN_PROBE = """
+import sys
+from sklearn.feature_extraction.text import TfidfVectorizer, HashingVectorizer
+from sklearn.preprocessing import normalize
+from sklearn.metrics.pairwise import cosine_similarity
+import scipy.sparse as sparse
+matrix = TfidfVectorizer(ngram_range=(1, 2)).fit_transform(["faktura numer", "numer faktury"])
+cosine_similarity(matrix[0:1], matrix[1:2])
+normalize(HashingVectorizer(analyzer='char_wb', ngram_range=(2, 4), norm=None).transform(["tekst"]))
+for name in sorted(sys.modules):
+    print(name)
+"""
+
+# Pliki instalacji Tesseract zbędne do rozpoznawania (dokumentacja, narzędzia do trenowania, deinstalator)
+TESSERACT_IGNORE = shutil.ignore_patterns('doc', '*.html', '*.jar', 'unins*', 'tessdata', 'tessdata_*')
+
+def check_requirements(languages):
     """Sprawdź wymagania do budowania"""
     print("🔍 Sprawdzanie wymagań...")
     
@@ -39,20 +84,49 @@ def check_requirements():
         print(f"❌ Folder tessdata nie znaleziony: {tessdata_dir}")
         return False
     
-    eng_file = tessdata_dir / "eng.traineddata"
-    pol_file = tessdata_dir / "pol.traineddata"
+    for lang in languages:
+        model = tessdata_dir / f"{lang}.traineddata"
+        if model.exists():
+            print(f"✅ Model {lang}: {model}")
+        else:
+            print(f"⚠️ Brak modelu {lang}: {model}")
     
-    if eng_file.exists():
-        print(f"✅ Model angielski: {eng_file}")
-    else:
-        print(f"⚠️ Brak modelu angielskiego: {eng_file}")
+    return True
+
+def configured_languages():
+    """Języki z main.py (AUTO_LANG_CANDIDATES + model detekcji) oraz osd do wykrywania orientacji"""
+    tree = ast.parse((Path(__file__).parent / "main.py").read_text(encoding='utf-8'))
+    constants = {}
+    for node in tree.body:
+        if isinstance(node, ast.Assign) and len(node.targets) == 1 and isinstance(node.targets[0], ast.Name):
+            if node.targets[0].id in ('AUTO_LANG_CANDIDATES', 'LANG_DETECTION_MODEL'):
+                constants[node.targets[0].id] = ast.literal_eval(node.value)
     
-    if pol_file.exists():
-        print(f"✅ Model polski: {pol_file}")
-    else:
-        print(f"⚠️ Brak modelu polskiego: {pol_file}")
+    languages = list(constants.get('AUTO_LANG_CANDIDATES', ('pol', 'eng')))
+    detection = constants.get('LANG_DETECTION_MODEL')
+    if detection and detection not in languages:
+        languages.append(detection)
+    return languages + ['osd']
+
+def unused_sklearn_modules():
+    """Podpakiety sklearn/scipy, których nie importuje ścieżka kodu aplikacji"""
+    try:
+        result = subprocess.run([sys.executable, '-c', SKLEARN_PROBE], check=True, capture_output=True, text=True)
+    except (subprocess.CalledProcessError, OSError) as e:
+        print(f"⚠️ Nie można ustalić używanych modułów sklearn ({e}) - bez wykluczeń")
+        return []
     
-    return True
+    loaded = set(result.stdout.split())
+    excluded = []
+    for package in ('sklearn', 'scipy'):
+        spec = importlib.util.find_spec(package)
+        if spec is None or not spec.submodule_search_locations:
+            continue
+        for module in pkgutil.iter_modules(spec.submodule_search_locations):
+            name = f"{package}.{module.name}"
+            if name not in loaded and not module.name.startswith('_'):
+                excluded.append(name)
+    return excluded
 
 def clean_build():
     print("\n🧹 Czyszczenie poprzednich builds...")
@@ -63,14 +137,19 @@ def clean_build():
             shutil.rmtree(dir_name)
             print(f"✅ Usunięto: {dir_name}")
 
-def build_exe():
-    print("\n🔨 Budowanie EXE...")
+def build_exe(onefile=False, with_semantic=False):
+    print(f"\n🔨 Budowanie EXE ({'onefile' if onefile else 'onedir'})...")
+    
+    excluded = EXCLUDED_MODULES + unused_sklearn_modules()
+    if not with_semantic:
+        excluded += SEMANTIC_MODULES
+    print(f"✂️ Wykluczone moduły: {len(excluded)}")
     
     pyinstaller_cmd = [
         'pyinstaller',
-        '--onefile',           
+        '--onefile' if onefile else '--onedir',
         '--noconsole',          
-        '--name=OCR_Tesseract_Pro',  
+        f'--name={APP_NAME}',
         '--icon=NONE',        
 
         '--hidden-import=PIL._tkinter_finder',
@@ -82,14 +161,12 @@ def build_exe():
         '--hidden-import=pytesseract',
         '--hidden-import=cv2',
         '--hidden-import=numpy',
-        '--hidden-import=pandas',
 
-        '--collect-all=tkinter',
         '--copy-metadata=pillow',
         '--copy-metadata=opencv-python',
-        
-        'main.py'
     ]
+    pyinstaller_cmd += [f'--exclude-module={name}' for name in excluded]
+    pyinstaller_cmd.append('main.py')
     
     try:
         result = subprocess.run(pyinstaller_cmd, check=True, capture_output=True, text=True)
@@ -101,22 +178,68 @@ def build_exe():
         print(f"Stderr: {e.stderr}")
         return False
 
-def copy_tesseract():
+def app_dir(onefile):
+    # Tesseract-OCR musi leżeć obok pliku wykonywalnego (setup_tesseract w main.py)
+    dist = Path(__file__).parent / "dist"
+    return dist if onefile else dist / APP_NAME
+
+def app_executable(onefile):
+    return app_dir(onefile) / (f"{APP_NAME}.exe" if os.name == 'nt' else APP_NAME)
+
+def copy_tessdata(source_tessdata, dest_tessdata, languages, fast_tessdata=None):
+    # Konfiguracje (configs/, tessconfigs/ - m.in. "tsv" dla image_to_data) kopiowane w całości,
+    # modele .traineddata tylko dla wybranych języków
+    shutil.copytree(source_tessdata, dest_tessdata,
+                    ignore=shutil.ignore_patterns('*.traineddata', 'script'))
+    
+    for lang in languages:
+        model = source_tessdata / f"{lang}.traineddata"
+        # osd istnieje tylko w wersji standardowej
+        if fast_tessdata is not None and lang != 'osd':
+            fast_model = fast_tessdata / f"{lang}.traineddata"
+            if fast_model.exists():
+                model = fast_model
+            else:
+                print(f"⚠️ Brak wariantu fast dla {lang} - używam {model.parent.name}")
+        if not model.exists():
+            print(f"⚠️ Pomijam brakujący model: {model}")
+            continue
+        shutil.copy2(model, dest_tessdata / model.name)
+
+def copy_tesseract(languages, onefile=False, fast=False, tiers=False):
     print("\n📁 Kopiowanie Tesseract-OCR do dist/...")
     
     script_dir = Path(__file__).parent
     source_tesseract = script_dir / "Tesseract-OCR"
-    dest_tesseract = script_dir / "dist" / "Tesseract-OCR"
+    dest_tesseract = app_dir(onefile) / "Tesseract-OCR"
     
     if not source_tesseract.exists():
         print(f"❌ Źródłowy folder Tesseract nie istnieje: {source_tesseract}")
         return False
     
+    fast_tessdata = None
+    if fast or tiers:
+        fast_tessdata = source_tesseract / "tessdata_fast"
+        if not fast_tessdata.exists():
+            print(f"⚠️ Brak folderu {fast_tessdata} (modele z github.com/tesseract-ocr/tessdata_fast) - używam tessdata")
+            fast_tessdata = None
+    
     try:
         if dest_tesseract.exists():
             shutil.rmtree(dest_tesseract)
 
-        shutil.copytree(source_tesseract, dest_tesseract)
+        shutil.copytree(source_tesseract, dest_tesseract, ignore=TESSERACT_IGNORE)
+        # Narzędzia do trenowania modeli nie są potrzebne - zostaje tylko tesseract.exe i biblioteki
+        for tool in dest_tesseract.glob("*.exe"):
+            if tool.name.lower() != "tesseract.exe":
+                tool.unlink()
+        if tiers and fast_tessdata is not None:
+            # Dwa poziomy modeli: tessdata (best) do weryfikacji i tessdata_fast do przesiewu w main.py
+            copy_tessdata(source_tesseract / "tessdata", dest_tesseract / "tessdata", languages)
+            copy_tessdata(source_tesseract / "tessdata", dest_tesseract / "tessdata_fast",
+                          [lang for lang in languages if lang != 'osd'], fast_tessdata)
+        else:
+            copy_tessdata(source_tesseract / "tessdata", dest_tesseract / "tessdata", languages, fast_tessdata)
         print(f"✅ Skopiowano Tesseract-OCR do: {dest_tesseract}")
 
         tesseract_exe = dest_tesseract / "tesseract.exe"
@@ -142,7 +265,43 @@ def copy_tesseract():
         print(f"❌ Błąd podczas kopiowania: {e}")
         return False
 
-def create_test_script():
+def directory_size(path):
+    return sum(f.stat().st_size for f in Path(path).rglob('*') if f.is_file())
+
+def report_bundle_size(onefile):
+    print("\n📦 Rozmiar paczki:")
+    tesseract_dir = app_dir(onefile) / "Tesseract-OCR"
+    tessdata = sum(directory_size(path) for path in tesseract_dir.glob("tessdata*"))
+    tesseract = directory_size(tesseract_dir) - tessdata
+    application = (app_executable(onefile).stat().st_size if onefile
+                   else directory_size(app_dir(onefile)) - tessdata - tesseract)
+    
+    for label, size in (("Aplikacja", application), ("Tesseract", tesseract), ("tessdata", tessdata),
+                        ("Razem", application + tesseract + tessdata)):
+        print(f"   {label:<10} {size / 1024 ** 2:8.1f} MB")
+
+def measure_cold_start(onefile, runs=3):
+    # Start aplikacji aż do wykonania kodu main.py: komenda "check" importuje wszystko i kończy działanie.
+    # Pierwszy pomiar zaraz po budowie jest najbliższy zimnemu startowi (onefile rozpakowuje się za każdym razem)
+    print("\n⏱️ Pomiar czasu startu...")
+    executable = app_executable(onefile)
+    timings = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        try:
+            subprocess.run([str(executable), 'check'], capture_output=True, timeout=300)
+        except (OSError, subprocess.TimeoutExpired) as e:
+            print(f"⚠️ Nie można uruchomić {executable}: {e}")
+            return None
+        timings.append(time.perf_counter() - start)
+    
+    print(f"   Pierwsze uruchomienie: {timings[0]:.2f}s")
+    if len(timings) > 1:
+        warm = sorted(timings[1:])
+        print(f"   Kolejne (mediana):     {warm[len(warm) // 2]:.2f}s")
+    return timings
+
+def create_test_script(onefile=False):
     print("\n📝 Tworzenie skryptu testowego...")
     
     test_script = '''@echo off
@@ -193,7 +352,7 @@ pause
 :end
 '''
     
-    test_file = Path(__file__).parent / "dist" / "test_app.bat"
+    test_file = app_dir(onefile) / "test_app.bat"
     try:
         with open(test_file, 'w', encoding='cp1250') as f:
             f.write(test_script)
@@ -203,42 +362,61 @@ pause
         print(f"❌ Błąd tworzenia skryptu testowego: {e}")
         return False
 
+def parse_args():
+    parser = argparse.ArgumentParser(description="Budowanie OCR Tesseract Pro z lokalnym Tesseract-OCR")
+    parser.add_argument('--onefile', action='store_true', help="Pojedynczy plik EXE (wolniejszy start)")
+    parser.add_argument('--langs', help="Języki do spakowania, np. pol,eng (domyślnie z main.py + osd)")
+    parser.add_argument('--fast', action='store_true', help="Modele tessdata_fast zamiast domyślnych")
+    parser.add_argument('--tiers', action='store_true', help="Dołącz tessdata_fast obok tessdata (przesiew + weryfikacja)")
+    parser.add_argument('--with-semantic', action='store_true', help="Dołącz sentence-transformers/torch")
+    parser.add_argument('--no-measure', action='store_true', help="Bez pomiaru czasu startu")
+    parser.add_argument('--no-pause', action='store_true', help="Nie czekaj na Enter na końcu")
+    return parser.parse_args()
+
 def main():
+    args = parse_args()
+    languages = args.langs.split(',') if args.langs else configured_languages()
+    pause = (lambda message: None) if args.no_pause else input
+    
     print("🚀 Budowanie OCR Tesseract Pro z lokalnym Tesseract-OCR")
     print("=" * 60)
+    print(f"🌍 Języki: {', '.join(languages)}{' (fast)' if args.fast else ''}")
     
-    if not check_requirements():
+    if not check_requirements(languages):
         print("\n❌ Nie można kontynuować - brak wymagań")
-        input("Naciśnij Enter aby zakończyć...")
+        pause("Naciśnij Enter aby zakończyć...")
         return
 
     clean_build()
 
-    if not build_exe():
+    if not build_exe(args.onefile, args.with_semantic):
         print("\n❌ Budowanie EXE nie powiodło się")
-        input("Naciśnij Enter aby zakończyć...")
+        pause("Naciśnij Enter aby zakończyć...")
         return
 
-    if not copy_tesseract():
+    if not copy_tesseract(languages, args.onefile, args.fast, args.tiers):
         print("\n❌ Kopiowanie Tesseract nie powiodło się")
-        input("Naciśnij Enter aby zakończyć...")
+        pause("Naciśnij Enter aby zakończyć...")
         return
 
-    create_test_script()
+    create_test_script(args.onefile)
+    report_bundle_size(args.onefile)
+    if not args.no_measure:
+        measure_cold_start(args.onefile)
     
     print("\n" + "=" * 60)
     print("🎉 BUDOWANIE ZAKOŃCZONE POMYŚLNIE!")
     print("=" * 60)
-    print(f"📁 Lokalizacja: {Path(__file__).parent / 'dist'}")
-    print("📱 Plik EXE: OCR_Tesseract_Pro.exe")
+    print(f"📁 Lokalizacja: {app_dir(args.onefile)}")
+    print(f"📱 Plik EXE: {APP_NAME}.exe")
     print("🔧 Tesseract: Tesseract-OCR/")
     print("🧪 Test: test_app.bat")
     print("\n💡 Aby przetestować aplikację:")
-    print("   1. Przejdź do folderu dist/")
+    print(f"   1. Przejdź do folderu {app_dir(args.onefile)}")
     print("   2. Uruchom test_app.bat")
     print("   3. Lub uruchom bezpośrednio OCR_Tesseract_Pro.exe")
     
-    input("\nNaciśnij Enter aby zakończyć...")
+    pause("\nNaciśnij Enter aby zakończyć...")
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
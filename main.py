@@ -12,64 +12,367 @@ from difflib import SequenceMatcher
 from collections import Counter
 import json
 import time
+import hashlib
+import zlib
+import csv
+import queue
+import sqlite3
+import argparse
+import unicodedata
+import shutil
+import heapq
+import shlex
+import logging
+import multiprocessing
+from collections import OrderedDict
+from collections.abc import Mapping
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, as_completed, wait, FIRST_COMPLETED
+from bisect import bisect_left, bisect_right
+from xml.sax.saxutils import escape, quoteattr
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+LOG_LEVEL = os.environ.get('OCR_LOG_LEVEL', 'INFO').upper()
+LOG_FORMAT = os.environ.get('OCR_LOG_FORMAT', 'text')
+METRICS_FILE = os.environ.get('OCR_METRICS_FILE')
+METRICS_PORT = os.environ.get('OCR_METRICS_PORT')
+
+# W pracy wsadowej równoległość zapewniają pule wątków - OpenMP wewnątrz każdego procesu tesseract tylko by
+# z nimi konkurował. Pojedynczy OCR (GUI, wzorzec) zostaje bez limitu; jawnie podany OMP_THREAD_LIMIT ma pierwszeństwo
+TESSERACT_THREADS = os.environ.get('OMP_THREAD_LIMIT') or os.environ.get('OCR_TESSERACT_THREADS', '1')
+BATCH_TESSERACT_ENV = {'OMP_THREAD_LIMIT': TESSERACT_THREADS}
+
+class ThreadEnviron(Mapping):
+    # os.environ z nadpisaniami ustawionymi w bieżącym wątku; pytesseract przekazuje je jako env= procesu tesseract
+    def __init__(self):
+        self._local = threading.local()
+    
+    def overrides(self):
+        return getattr(self._local, 'overrides', {})
+    
+    def set_overrides(self, overrides):
+        self._local.overrides = dict(overrides)
+    
+    def __getitem__(self, key):
+        overrides = self.overrides()
+        return overrides[key] if key in overrides else os.environ[key]
+    
+    def __iter__(self):
+        overrides = self.overrides()
+        yield from overrides
+        yield from (key for key in os.environ if key not in overrides)
+    
+    def __len__(self):
+        return len(set(os.environ) | set(self.overrides()))
+
+tesseract_environ = ThreadEnviron()
+pytesseract.pytesseract.environ = tesseract_environ
+
+def batch_tesseract_env():
+    # initializer pul wątków OCR wsadowego
+    tesseract_environ.set_overrides(BATCH_TESSERACT_ENV)
+
+log = logging.getLogger('ocr_tesseract')
+
+class JsonLogFormatter(logging.Formatter):
+    # Jeden obiekt JSON na linię; pola strukturalne przekazywane przez extra={'fields': {...}}
+    def format(self, record):
+        entry = {
+            'ts': round(record.created, 3),
+            'level': record.levelname.lower(),
+            'msg': record.getMessage(),
+        }
+        entry.update(getattr(record, 'fields', {}))
+        if record.exc_info:
+            entry['exc'] = self.formatException(record.exc_info)
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+def configure_logging(level=LOG_LEVEL, fmt=LOG_FORMAT):
+    # Poziom OFF wyłącza wszystko; komunikaty per obraz są na poziomie DEBUG i z leniwym formatowaniem,
+    # więc przy INFO pętle OCR nie płacą za budowanie napisów
+    if sys.stderr is None:
+        # Aplikacja okienkowa bez konsoli (--noconsole)
+        handler = logging.NullHandler()
+    else:
+        handler = logging.StreamHandler()
+        handler.setFormatter(JsonLogFormatter() if fmt == 'json' else logging.Formatter('%(message)s'))
+    log.handlers[:] = [handler]
+    log.propagate = False
+    log.setLevel(logging.CRITICAL + 1 if level == 'OFF' else getattr(logging, level, logging.INFO))
+
+configure_logging()
+
+def _metric_labels(names, values):
+    if not names:
+        return ""
+    escaped = (str(v).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for v in values)
+    return "{" + ",".join(f'{name}="{value}"' for name, value in zip(names, escaped)) + "}"
+
+class MetricCounter:
+    kind = 'counter'
+    
+    def __init__(self, name, help_text, labels=(), function=None):
+        self.name = name
+        self.help = help_text
+        self.labels = tuple(labels)
+        self.function = function
+        self.values = {}
+        self._lock = threading.Lock()
+    
+    def _key(self, labels):
+        return tuple(labels.get(name, '') for name in self.labels)
+    
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self.values[key] = self.values.get(key, 0) + amount
+    
+    def get(self, **labels):
+        if self.function is not None:
+            return self.function()
+        return self.values.get(self._key(labels), 0)
+    
+    def render(self):
+        if self.function is not None:
+            yield f"{self.name} {self.function()}"
+            return
+        with self._lock:
+            values = list(self.values.items())
+        for key, value in values:
+            yield f"{self.name}{_metric_labels(self.labels, key)} {value}"
+
+class MetricGauge(MetricCounter):
+    kind = 'gauge'
+    
+    def set(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self.values[key] = value
+
+class MetricHistogram:
+    kind = 'histogram'
+    
+    def __init__(self, name, help_text, buckets, labels=()):
+        self.name = name
+        self.help = help_text
+        self.buckets = tuple(sorted(buckets))
+        self.labels = tuple(labels)
+        self.series = {}
+        self._lock = threading.Lock()
+    
+    def observe(self, value, **labels):
+        key = tuple(labels.get(name, '') for name in self.labels)
+        with self._lock:
+            series = self.series.get(key)
+            if series is None:
+                # Liczniki kubełków nieskumulowane; suma narastająca liczona przy eksporcie
+                series = self.series[key] = [[0] * (len(self.buckets) + 1), 0.0]
+            series[0][bisect_left(self.buckets, value)] += 1
+            series[1] += value
+    
+    def render(self):
+        with self._lock:
+            series = [(key, list(counts), total) for key, (counts, total) in self.series.items()]
+        for key, counts, total in series:
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float('inf'),), counts):
+                cumulative += count
+                le = "+Inf" if bound == float('inf') else f"{bound:g}"
+                yield f"{self.name}_bucket{_metric_labels(self.labels + ('le',), key + (le,))} {cumulative}"
+            yield f"{self.name}_sum{_metric_labels(self.labels, key)} {total:.6f}"
+            yield f"{self.name}_count{_metric_labels(self.labels, key)} {cumulative}"
+
+class MetricsRegistry:
+    def __init__(self, prefix='ocr_tesseract_'):
+        self.prefix = prefix
+        self.metrics = OrderedDict()
+    
+    def _register(self, metric):
+        metric.name = self.prefix + metric.name
+        self.metrics[metric.name] = metric
+        return metric
+    
+    def counter(self, name, help_text, labels=(), function=None):
+        return self._register(MetricCounter(name, help_text, labels, function))
+    
+    def gauge(self, name, help_text, labels=(), function=None):
+        return self._register(MetricGauge(name, help_text, labels, function))
+    
+    def histogram(self, name, help_text, buckets, labels=()):
+        return self._register(MetricHistogram(name, help_text, buckets, labels))
+    
+    def render(self):
+        # Format tekstowy Prometheusa (text/plain; version=0.0.4)
+        lines = []
+        for metric in self.metrics.values():
+            lines.append(f"# HELP {metric.name} {metric.help}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+    
+    def write_textfile(self, path):
+        # Zapis atomowy - kolektor plików tekstowych nie zobaczy połowy pliku
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        temp_path = f"{path}.{os.getpid()}.tmp"
+        with open(temp_path, 'w', encoding='utf-8') as f:
+            f.write(self.render())
+        os.replace(temp_path, path)
+
+metrics = MetricsRegistry()
+OCR_SECONDS = metrics.histogram('ocr_seconds', "Czas jednej próby OCR obrazu",
+                                (0.25, 0.5, 1, 2, 5, 10, 20, 30, 60, 120), labels=('strategy', 'tier', 'outcome'))
+OCR_IMAGES = metrics.counter('ocr_images_total', "Obrazy po OCR według wyniku (ok, fallback, failed)",
+                             labels=('result',))
+OCR_FAILURES = metrics.counter('ocr_failures_total', "Nieudane próby OCR według strategii i przyczyny",
+                               labels=('strategy', 'cause'))
+OCR_QUEUE_DEPTH = metrics.gauge('ocr_queue_depth', "Obrazy przekazane do puli OCR i jeszcze nieukończone")
+OCR_WORKERS = metrics.gauge('ocr_workers', "Bieżąca liczba wątków OCR")
+OCR_THROUGHPUT = metrics.gauge('ocr_images_per_second', "Przepustowość OCR w ostatnim oknie pomiarowym")
+SEARCH_FILES = metrics.counter('search_files_total', "Pliki wyszukiwań i indeksowania według sposobu obsłużenia",
+                               labels=('source',))
+SEARCH_SECONDS = metrics.histogram('search_seconds', "Czas całego wyszukiwania lub indeksowania",
+                                   (1, 5, 15, 60, 300, 900, 3600, 14400), labels=('operation',))
+
+def failure_cause(error):
+    if isinstance(error, RuntimeError) and 'timeout' in str(error).lower():
+        return 'timeout'
+    if isinstance(error, pytesseract.TesseractError):
+        return 'tesseract'
+    if isinstance(error, MemoryError):
+        return 'memory'
+    if isinstance(error, (OSError, ValueError)):
+        return 'image'
+    return type(error).__name__
+
+# Źródła plików w statystykach przebiegu -> etykieta source w search_files_total
+RUN_STAT_SOURCES = (
+    ('ocr_runs', 'ocr'),
+    ('resumed', 'checkpoint'),
+    ('already_indexed', 'text_index'),
+    ('embedding_cache_hits', 'embedding_cache'),
+    ('duplicates_skipped', 'duplicate'),
+    ('prefilter_rejected', 'visual_filter'),
+    ('quarantined', 'quarantine'),
+    ('forms', 'form_template'),
+    ('unclassified', 'form_unclassified'),
+)
+
+def record_run_metrics(stats, operation):
+    for key, source in RUN_STAT_SOURCES:
+        if stats.get(key):
+            SEARCH_FILES.inc(stats[key], source=source)
+    if 'elapsed' in stats:
+        SEARCH_SECONDS.observe(stats['elapsed'], operation=operation)
+    log.info("Podsumowanie: %s", format_run_summary(stats),
+             extra={'fields': {'event': 'run_summary', 'operation': operation,
+                               'stats': {k: v for k, v in stats.items() if k != 'ocr_workers_history'}}})
+    if METRICS_FILE:
+        try:
+            metrics.write_textfile(METRICS_FILE)
+        except OSError as e:
+            log.warning("⚠️ Nie można zapisać metryk do %s: %s", METRICS_FILE, e)
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split('?')[0] != '/metrics':
+            self.send_error(404)
+            return
+        body = metrics.render().encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+    
+    def log_message(self, format, *args):
+        log.debug("metrics: " + format, *args)
+
+def serve_metrics(port, host='127.0.0.1'):
+    # Lokalny endpoint /metrics w wątku w tle; działa tak długo jak aplikacja
+    server = ThreadingHTTPServer((host, int(port)), _MetricsHandler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    log.info("📈 Metryki: http://%s:%d/metrics", host, server.server_address[1])
+    return server
 
 try:
-    from sklearn.feature_extraction.text import TfidfVectorizer
+    from sklearn.feature_extraction.text import TfidfVectorizer, HashingVectorizer, CountVectorizer
+    from sklearn.preprocessing import normalize
     from sklearn.metrics.pairwise import cosine_similarity
+    import scipy.sparse as sparse
     SKLEARN_AVAILABLE = True
 except ImportError:
     SKLEARN_AVAILABLE = False
-    print("⚠️ Sklearn niedostępne - używam prostszych metod podobieństwa")
+    log.warning("⚠️ Sklearn niedostępne - używam prostszych metod podobieństwa")
+
+try:
+    from rapidfuzz.distance import Levenshtein as RapidLevenshtein
+    RAPIDFUZZ_AVAILABLE = True
+except ImportError:
+    RAPIDFUZZ_AVAILABLE = False
+
+try:
+    import tesserocr
+    TESSEROCR_AVAILABLE = True
+except ImportError:
+    TESSEROCR_AVAILABLE = False
+
+try:
+    import psutil
+    PSUTIL_AVAILABLE = True
+except ImportError:
+    PSUTIL_AVAILABLE = False
 
 def setup_tesseract():
     if getattr(sys, 'frozen', False):
-        print("Running as EXE")
+        log.info("Running as EXE")
         exe_dir = os.path.dirname(os.path.abspath(sys.executable))
         local_tesseract = os.path.join(exe_dir, 'Tesseract-OCR', 'tesseract.exe')
         
         if os.path.exists(local_tesseract):
-            print(f"Found local Tesseract: {local_tesseract}")
+            log.info("Found local Tesseract: %s", local_tesseract)
             pytesseract.pytesseract.tesseract_cmd = local_tesseract
             tessdata_path = os.path.join(exe_dir, 'Tesseract-OCR', 'tessdata')
             if os.path.exists(tessdata_path):
                 os.environ['TESSDATA_PREFIX'] = tessdata_path
-                print(f"Set TESSDATA_PREFIX to: {os.environ['TESSDATA_PREFIX']}")
+                log.info("Set TESSDATA_PREFIX to: %s", os.environ['TESSDATA_PREFIX'])
             return True
         else:
-            print(f"Local Tesseract not found at: {local_tesseract}")
+            log.warning("Local Tesseract not found at: %s", local_tesseract)
             return False
     else:
-        print("Running as Python script")
+        log.info("Running as Python script")
         script_dir = os.path.dirname(os.path.abspath(__file__))
         local_tesseract = os.path.join(script_dir, 'Tesseract-OCR', 'tesseract.exe')
         
         if os.path.exists(local_tesseract):
-            print(f"Found local Tesseract: {local_tesseract}")
+            log.info("Found local Tesseract: %s", local_tesseract)
             pytesseract.pytesseract.tesseract_cmd = local_tesseract
             tessdata_path = os.path.join(script_dir, 'Tesseract-OCR', 'tessdata')
             if os.path.exists(tessdata_path):
                 os.environ['TESSDATA_PREFIX'] = tessdata_path
-                print(f"Set TESSDATA_PREFIX to: {os.environ['TESSDATA_PREFIX']}")
+                log.info("Set TESSDATA_PREFIX to: %s", os.environ['TESSDATA_PREFIX'])
             return True
         else:
-            print("Local Tesseract not found, trying system installation")
+            log.info("Local Tesseract not found, trying system installation")
             system_tesseract = r'C:\Program Files\Tesseract-OCR\tesseract.exe'
             if os.path.exists(system_tesseract):
                 pytesseract.pytesseract.tesseract_cmd = system_tesseract
-                print(f"Using system Tesseract: {system_tesseract}")
+                log.info("Using system Tesseract: %s", system_tesseract)
                 return True
             else:
-                print("System Tesseract not found!")
+                log.error("System Tesseract not found!")
                 return False
 
+def normalize_text(text):
+    text_clean = re.sub(r'[^\w\s]', ' ', text.lower().strip())
+    return re.sub(r'\s+', ' ', text_clean)
+
 def calculate_text_similarity(text1, text2):
     if not text1.strip() or not text2.strip():
         return 0.0
     
-    text1_clean = re.sub(r'[^\w\s]', ' ', text1.lower().strip())
-    text2_clean = re.sub(r'[^\w\s]', ' ', text2.lower().strip())
-    text1_clean = re.sub(r'\s+', ' ', text1_clean)
-    text2_clean = re.sub(r'\s+', ' ', text2_clean)
+    text1_clean = normalize_text(text1)
+    text2_clean = normalize_text(text2)
     
     if SKLEARN_AVAILABLE:
         try:
@@ -88,7 +391,7 @@ def calculate_text_similarity(text1, text2):
             return float(cos_sim)
             
         except Exception as e:
-            print(f"Błąd sklearn: {e}, używam metody fallback")
+            log.warning("Błąd sklearn: %s, używam metody fallback", e)
             pass
     
     return calculate_cosine_similarity_manual(text1_clean, text2_clean)
@@ -138,88 +441,3323 @@ def calculate_cosine_similarity_manual(text1, text2):
         return min(max(final_similarity, 0.0), 1.0) 
         
     except Exception as e:
-        print(f"Błąd w obliczaniu podobieństwa: {e}")
+        log.warning("Błąd w obliczaniu podobieństwa: %s", e)
         return SequenceMatcher(None, text1, text2).ratio()
 
-def extract_text_from_image(image_path, lang="pol+eng"):
+OCR_CHAR_WHITELIST = "ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyzĄĆĘŁŃÓŚŹŻąćęłńóśźż0123456789 .,;:!?-"
+TSV_FIELDS = ('level', 'page_num', 'block_num', 'par_num', 'line_num', 'word_num',
+              'left', 'top', 'width', 'height', 'conf', 'text')
+
+_available_languages = {}
+
+def get_available_languages(tessdata_dir=None):
+    tessdata = tessdata_dir or os.environ.get('TESSDATA_PREFIX', '')
+    if tessdata not in _available_languages:
+        config = f"--tessdata-dir {tessdata_config_path(tessdata_dir)}" if tessdata_dir else ''
+        _available_languages[tessdata] = set(pytesseract.get_languages(config=config))
+    return _available_languages[tessdata]
+
+# Poziomy modeli: "fast" (tessdata_fast, LSTM całkowitoliczbowe) do przesiewu kandydatów,
+# "best" do weryfikacji i wyświetlania; każdy poziom to osobny katalog tessdata
+MODEL_TIERS = ('fast', 'best')
+SCREEN_TIER = 'fast'
+VERIFY_TIER = 'best'
+VERIFY_TOP_K = int(os.environ.get('OCR_VERIFY_TOP_K', '20'))
+VERIFY_MARGIN = 0.05
+
+def tessdata_dir(tier):
+    # OCR_TESSDATA_FAST / OCR_TESSDATA_BEST albo katalogi tessdata_fast / tessdata_best obok tessdata
+    configured = os.environ.get(f'OCR_TESSDATA_{tier.upper()}')
+    if configured:
+        return configured if os.path.isdir(configured) else None
+    base = os.environ.get('TESSDATA_PREFIX')
+    if not base and os.path.isabs(pytesseract.pytesseract.tesseract_cmd):
+        base = os.path.join(os.path.dirname(pytesseract.pytesseract.tesseract_cmd), 'tessdata')
+    if not base:
+        return None
+    candidate = os.path.join(os.path.dirname(os.path.normpath(base)), f'tessdata_{tier}')
+    return candidate if os.path.isdir(candidate) else None
+
+def tessdata_config_path(path):
+    # pytesseract dzieli config przez shlex (na Windows bez usuwania cudzysłowów) - tam ścieżka krótka 8.3
+    if ' ' not in path:
+        return path
+    if os.name == 'nt':
+        import ctypes
+        buffer = ctypes.create_unicode_buffer(1024)
+        if ctypes.windll.kernel32.GetShortPathNameW(path, buffer, len(buffer)):
+            return buffer.value
+        return path
+    return f'"{path}"'
+
+def tier_tessdata(tier, lang):
+    # Katalog modeli poziomu, o ile zawiera wszystkie języki; None = domyślny tessdata
+    if tier is None:
+        return None
+    if lang == AUTO_LANG:
+        lang = "+".join(dict.fromkeys(installed_candidates() + (LANG_DETECTION_MODEL,)))
+    directory = tessdata_dir(tier)
+    if directory is None:
+        return None
     try:
-        img = cv2.imread(image_path)
-        if img is None:
-            return ""
-        
-        gray = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
+        available = get_available_languages(directory)
+    except Exception as e:
+        log.warning("⚠️ Nie można odczytać modeli %s (%s): %s", tier, directory, e)
+        return None
+    return directory if all(code in available for code in lang.split('+')) else None
+
+def tier_config(tier, lang):
+    directory = tier_tessdata(tier, lang)
+    return f" --tessdata-dir {tessdata_config_path(directory)}" if directory else ""
+
+TESSERACT_CONFIGS_DIR = os.path.join(os.path.expanduser('~'), '.ocr_tesseract', 'configs')
+
+def tesseract_config_file(variables):
+    # Plik konfiguracyjny Tesseracta ("nazwa wartość" w linii, wartość może zawierać spacje);
+    # nazwa od skrótu treści, więc te same zmienne dają ten sam plik
+    content = "".join(f"{name} {value}\n" for name, value in sorted(variables.items()))
+    digest = hashlib.blake2b(content.encode('utf-8'), digest_size=8).hexdigest()
+    path = os.path.join(TESSERACT_CONFIGS_DIR, f"vars_{digest}")
+    if not os.path.exists(path):
+        os.makedirs(TESSERACT_CONFIGS_DIR, exist_ok=True)
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            f.write(content)
+        os.replace(tmp_path, path)
+    return path
+
+def tesseract_config(options, variables):
+    # pytesseract na Windows dzieli config przez shlex.split(posix=False), który zostawia cudzysłowy
+    # w argumencie - stąd "-c nazwa=wartość" bez cudzysłowów. Wartości ze spacją idą do pliku
+    # konfiguracyjnego, podanego na końcu (Tesseract czyta pliki konfiguracyjne po wszystkich opcjach)
+    parts = [options.strip()] if options.strip() else []
+    spaced = {}
+    for name, value in variables.items():
+        if any(char.isspace() for char in value):
+            spaced[name] = value
+        else:
+            parts.append(f"-c {name}={value}")
+    if spaced:
+        parts.append(tessdata_config_path(tesseract_config_file(spaced)))
+    return " ".join(parts)
+
+def config_split_problems(config, variables):
+    # Argumenty po podziale jak w pytesseract (posix i Windows) - każda zmienna musi dotrzeć bez cudzysłowów
+    problems = []
+    for posix in (True, False):
+        args = shlex.split(config, posix=posix)
+        passed = {}
+        for flag, value in zip(args, args[1:]):
+            if flag == '-c':
+                name, _, passed_value = value.partition('=')
+                passed[name] = passed_value
+        for name, value in variables.items():
+            if any(char.isspace() for char in value):
+                if not os.path.isfile(args[-1]):
+                    problems.append(f"{name}: brak pliku konfiguracyjnego {args[-1]!r} (posix={posix})")
+                    continue
+                with open(args[-1], encoding='utf-8') as f:
+                    if f"{name} {value}\n" not in f.read():
+                        problems.append(f"{name}: brak w pliku {args[-1]!r} (posix={posix})")
+            elif passed.get(name) != value:
+                problems.append(f"{name}: {passed.get(name)!r} zamiast {value!r} (posix={posix})")
+    return problems
+
+def validate_languages(lang):
+    available = get_available_languages()
+    if lang == AUTO_LANG:
+        # Tryb auto wymaga modelu detekcji i przynajmniej jednego kandydata
+        missing = [code for code in (LANG_DETECTION_MODEL,) if code not in available]
+        if not any(code in available for code in AUTO_LANG_CANDIDATES):
+            missing += list(AUTO_LANG_CANDIDATES)
+    else:
+        missing = [code for code in lang.split('+') if code not in available]
+    if missing:
+        location = os.environ.get('TESSDATA_PREFIX', 'domyślny katalog tessdata')
+        raise ValueError(f"Brak danych językowych: {', '.join(missing)} ({location}).\n"
+                         f"Dostępne języki: {', '.join(sorted(available)) or 'brak'}")
+
+def parse_tsv_data(tsv):
+    data = {field: [] for field in TSV_FIELDS}
+    for row in tsv.splitlines():
+        values = row.split('\t')
+        if len(values) < len(TSV_FIELDS) - 1 or values[0] == 'level':
+            continue
+        values += [''] * (len(TSV_FIELDS) - len(values))
+        for field, value in zip(TSV_FIELDS, values):
+            data[field].append(value if field == 'text' else float(value) if field == 'conf' else int(value))
+    return data
+
+ENGINE_IMAGE_FORMAT = 'BMP'
+
+class ImageBuffer:
+    # Jeden ciągły bufor uint8 w skali szarości przekazywany do silnika bez kodowania PNG
+    __slots__ = ('array',)
+    bytes_per_pixel = 1
+    
+    def __init__(self, img):
+        if img.ndim == 3:
+            img = cv2.cvtColor(img, cv2.COLOR_BGRA2GRAY if img.shape[2] == 4 else cv2.COLOR_BGR2GRAY)
+        if img.dtype != np.uint8:
+            img = cv2.convertScaleAbs(img)
+        self.array = np.ascontiguousarray(img)
+    
+    @property
+    def width(self):
+        return self.array.shape[1]
+    
+    @property
+    def height(self):
+        return self.array.shape[0]
+    
+    @property
+    def bytes_per_line(self):
+        return self.array.strides[0]
+    
+    def to_pil(self):
+        # Widok PIL na ten sam bufor; format BMP sprawia, że pytesseract zapisuje plik bez kompresji
+        pil_image = Image.frombuffer('L', (self.width, self.height), self.array, 'raw', 'L', self.bytes_per_line, 1)
+        pil_image.format = ENGINE_IMAGE_FORMAT
+        return pil_image
+    
+    def set_on(self, api):
+        # SetImageBytes przyjmuje tylko bytes (nie memoryview), a Tesseract i tak kopiuje dane do własnego Pix -
+        # jedna tymczasowa kopia bufora jest tu nieunikniona
+        api.SetImageBytes(self.array.tobytes(), self.width, self.height, self.bytes_per_pixel, self.bytes_per_line)
+
+def make_display_thumbnail(img, max_size):
+    # Najpierw zmniejszenie, potem konwersja kolorów - tylko na miniaturze
+    h, w = img.shape[:2]
+    scale = min(max_size[0] / w, max_size[1] / h, 1.0)
+    if scale < 1.0:
+        img = cv2.resize(img, (max(1, int(w * scale)), max(1, int(h * scale))), interpolation=cv2.INTER_AREA)
+    if img.ndim == 3:
+        img = cv2.cvtColor(img, cv2.COLOR_BGR2RGB)
+    return Image.fromarray(img)
+
+class OCRSession:
+    # Ustawienia OCR zebrane raz; przy dostępnym tesserocr silnik pozostaje załadowany między wywołaniami
+    def __init__(self, lang, psm, oem, whitelist=False, preserve_spaces=False, invert=False, tier=VERIFY_TIER):
+        self.settings = (lang, str(psm), str(oem), bool(whitelist), bool(preserve_spaces), bool(invert), tier)
+        self.lang = lang
+        self.tessdata = tier_tessdata(tier, lang)
+        self.psm = str(psm)
+        self.oem = str(oem)
         
-        height, width = gray.shape
-        gray_resized = cv2.resize(gray, (width * 2, height * 2), interpolation=cv2.INTER_CUBIC)
+        self.variables = {}
+        if whitelist:
+            self.variables['tessedit_char_whitelist'] = OCR_CHAR_WHITELIST
+        if preserve_spaces:
+            self.variables['preserve_interword_spaces'] = '1'
+        if invert:
+            self.variables['tessedit_do_invert'] = '1'
         
-        custom_config = '--oem 1 --psm 6'
-        pil_img = Image.fromarray(gray_resized)
-        text = pytesseract.image_to_string(pil_img, lang=lang, config=custom_config)
+        options = f"--oem {self.oem} --psm {self.psm}"
+        if self.tessdata:
+            options += f" --tessdata-dir {tessdata_config_path(self.tessdata)}"
+        self.config = tesseract_config(options, self.variables)
         
-        return text.strip()
+        self._api = None
+        self._variants = {}
+        self._lock = threading.Lock()
+    
+    def variant(self, psm):
+        # Ta sama konfiguracja z innym trybem PSM (np. 7 - pojedyncza linia); sesje zapamiętywane
+        psm = str(psm)
+        if psm == self.psm:
+            return self
+        with self._lock:
+            if psm not in self._variants:
+                self._variants[psm] = OCRSession(self.lang, psm, self.oem, *self.settings[3:])
+            return self._variants[psm]
+    
+    def validate(self):
+        validate_languages(self.lang)
+        return self
+    
+    def _get_api(self):
+        if self._api is None:
+            tessdata = self.tessdata or os.environ.get('TESSDATA_PREFIX')
+            kwargs = {'path': tessdata} if tessdata else {}
+            self._api = tesserocr.PyTessBaseAPI(lang=self.lang, psm=int(self.psm), oem=int(self.oem), **kwargs)
+            for name, value in self.variables.items():
+                self._api.SetVariable(name, value)
+        return self._api
+    
+    def image_to_string(self, buffer):
+        if TESSEROCR_AVAILABLE:
+            with self._lock:
+                api = self._get_api()
+                buffer.set_on(api)
+                return api.GetUTF8Text()
+        return pytesseract.image_to_string(buffer.to_pil(), lang=self.lang, config=self.config)
+    
+    def image_to_data(self, buffer):
+        if TESSEROCR_AVAILABLE:
+            with self._lock:
+                api = self._get_api()
+                buffer.set_on(api)
+                return parse_tsv_data(api.GetTSVText(0))
+        return pytesseract.image_to_data(buffer.to_pil(), lang=self.lang, config=self.config,
+                                         output_type=pytesseract.Output.DICT)
+    
+    def close(self):
+        with self._lock:
+            variants = list(self._variants.values())
+            self._variants.clear()
+            if self._api is not None:
+                self._api.End()
+                self._api = None
+        for session in variants:
+            session.close()
+
+OCR_CACHE_BYTES = int(float(os.environ.get('OCR_CACHE_MB', '256')) * 1024 * 1024)
+
+def estimate_nbytes(value):
+    if isinstance(value, np.ndarray):
+        return value.nbytes
+    if isinstance(value, str):
+        return len(value) * 2 + 64
+    if isinstance(value, dict):
+        return 64 + sum(estimate_nbytes(v) for v in value.values())
+    if isinstance(value, (list, tuple)):
+        return 64 + sum(estimate_nbytes(v) for v in value)
+    return 32
+
+def image_digest(img):
+    hasher = hashlib.blake2b(digest_size=16)
+    hasher.update(f"{img.shape}{img.dtype}".encode())
+    hasher.update(np.ascontiguousarray(img).data)
+    return hasher.hexdigest()
+
+class ByteBudgetLRU:
+    def __init__(self, max_bytes=OCR_CACHE_BYTES):
+        self.max_bytes = max_bytes
+        self.items = OrderedDict()
+        self.total_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+    
+    def get(self, key, default=None):
+        with self._lock:
+            if key in self.items:
+                self.items.move_to_end(key)
+                self.hits += 1
+                return self.items[key][0]
+            self.misses += 1
+            return default
+    
+    def put(self, key, value, nbytes=None):
+        nbytes = estimate_nbytes(value) if nbytes is None else nbytes
+        if nbytes > self.max_bytes:
+            return
+        if isinstance(value, np.ndarray):
+            # Wynik z pamięci podręcznej jest współdzielony - blokujemy modyfikację w miejscu
+            value.flags.writeable = False
+        with self._lock:
+            if key in self.items:
+                self.total_bytes -= self.items.pop(key)[1]
+            self.items[key] = (value, nbytes)
+            self.total_bytes += nbytes
+            while self.total_bytes > self.max_bytes:
+                _, (_, evicted_bytes) = self.items.popitem(last=False)
+                self.total_bytes -= evicted_bytes
+    
+    def clear(self):
+        with self._lock:
+            self.items.clear()
+            self.total_bytes = 0
+
+ocr_memo = ByteBudgetLRU()
+metrics.counter('ocr_cache_hits_total', "Trafienia pamięci podręcznej wyników OCR", function=lambda: ocr_memo.hits)
+metrics.counter('ocr_cache_misses_total', "Chybienia pamięci podręcznej wyników OCR", function=lambda: ocr_memo.misses)
+metrics.gauge('ocr_cache_bytes', "Rozmiar pamięci podręcznej wyników OCR", function=lambda: ocr_memo.total_bytes)
+
+BATCH_OCR_CONFIG = '--oem 1 --psm 6'
+BATCH_OCR_SCALE = 2
+
+DESKEW_MAX_SIDE = 1000
+DESKEW_MAX_ANGLE = 10.0
+OSD_MAX_SIDE = 2000
+OSD_ROTATIONS = {90: cv2.ROTATE_90_CLOCKWISE, 180: cv2.ROTATE_180, 270: cv2.ROTATE_90_COUNTERCLOCKWISE}
+
+_geometry_cache = {}
+_geometry_cache_lock = threading.Lock()
+
+def _downscale(gray, max_side):
+    scale = min(1.0, max_side / max(gray.shape[:2]))
+    if scale >= 1.0:
+        return gray
+    return cv2.resize(gray, (max(1, int(gray.shape[1] * scale)), max(1, int(gray.shape[0] * scale))),
+                      interpolation=cv2.INTER_AREA)
+
+def _projection_score(binary, angle):
+    h, w = binary.shape
+    matrix = cv2.getRotationMatrix2D((w / 2, h / 2), angle, 1.0)
+    rotated = cv2.warpAffine(binary, matrix, (w, h), flags=cv2.INTER_NEAREST, borderValue=0)
+    profile = rotated.sum(axis=1, dtype=np.float64)
+    return float(np.var(profile))
+
+def estimate_skew_angle(gray):
+    small = _downscale(gray, DESKEW_MAX_SIDE)
+    _, binary = cv2.threshold(small, 0, 1, cv2.THRESH_BINARY_INV + cv2.THRESH_OTSU)
+    if cv2.countNonZero(binary) < 50:
+        return 0.0
+    
+    # Profil rzutowania: wiersze tekstu dają najbardziej "schodkowy" profil przy właściwym kącie
+    coarse = np.arange(-DESKEW_MAX_ANGLE, DESKEW_MAX_ANGLE + 0.01, 1.0)
+    best = max(coarse, key=lambda a: _projection_score(binary, a))
+    fine = np.arange(best - 1.0, best + 1.01, 0.2)
+    best = max(fine, key=lambda a: _projection_score(binary, a))
+    return round(float(best), 1)
+
+def detect_orientation(gray):
+    small = _downscale(gray, OSD_MAX_SIDE)
+    try:
+        osd = pytesseract.image_to_osd(ImageBuffer(small).to_pil(), config='--psm 0',
+                                       output_type=pytesseract.Output.DICT, timeout=OCR_RETRY_TIMEOUT)
+        return int(osd.get('rotate', 0)) % 360
     except Exception as e:
-        print(f"Błąd OCR dla {image_path}: {e}")
-        return ""
+        log.warning("⚠️ Brak wykrycia orientacji (OSD): %s", e)
+        return 0
+
+def estimate_page_geometry(gray, use_osd=True):
+    rotate = detect_orientation(gray) if use_osd else 0
+    oriented = _downscale(gray, DESKEW_MAX_SIDE)
+    if rotate in OSD_ROTATIONS:
+        oriented = cv2.rotate(oriented, OSD_ROTATIONS[rotate])
+    return rotate, estimate_skew_angle(oriented)
 
-def find_similar_images(reference_image_path, search_folder, similarity_threshold=0.3, lang="pol+eng"):
-    print(f"Analizuję obraz referencyjny: {reference_image_path}")
-    reference_text = extract_text_from_image(reference_image_path, lang)
+def _file_cache_key(image_path):
+    stat = os.stat(image_path)
+    return (os.path.abspath(image_path), stat.st_mtime_ns, stat.st_size)
+
+def get_page_geometry(gray, image_path=None, use_osd=True):
+    cache_key = None
+    if image_path is not None:
+        try:
+            cache_key = _file_cache_key(image_path) + (use_osd,)
+        except OSError:
+            cache_key = None
     
-    if not reference_text.strip():
-        return [], "Nie znaleziono tekstu w obrazie referencyjnym"
+    if cache_key is not None:
+        with _geometry_cache_lock:
+            if cache_key in _geometry_cache:
+                return _geometry_cache[cache_key]
     
-    print(f"Tekst referencyjny: {reference_text[:100]}...")
+    geometry = estimate_page_geometry(gray, use_osd)
     
-    supported_formats = ('.png', '.jpg', '.jpeg', '.bmp', '.tiff', '.gif')
+    if cache_key is not None:
+        with _geometry_cache_lock:
+            _geometry_cache[cache_key] = geometry
+    return geometry
+
+def page_geometry_transform(shape, rotate, skew):
+    # Macierz 2x3 przekształcenia oryginał -> obraz skorygowany (współrzędne krawędzi pikseli)
+    # oraz rozmiar (szerokość, wysokość) obrazu wynikowego
+    h, w = shape[:2]
+    if abs(skew) < 0.1:
+        if rotate == 90:
+            return np.array([[0.0, -1.0, h], [1.0, 0.0, 0.0]]), (h, w)
+        if rotate == 180:
+            return np.array([[-1.0, 0.0, w], [0.0, -1.0, h]]), (w, h)
+        if rotate == 270:
+            return np.array([[0.0, 1.0, 0.0], [-1.0, 0.0, w]]), (h, w)
+        return np.eye(2, 3), (w, h)
     
-    image_files = []
+    # Obrót o wielokrotność 90° i korekta pochylenia jako jedna transformacja
+    angle = skew - rotate
+    matrix = cv2.getRotationMatrix2D((w / 2, h / 2), angle, 1.0)
+    cos, sin = abs(matrix[0, 0]), abs(matrix[0, 1])
+    new_w = int(round(h * sin + w * cos))
+    new_h = int(round(h * cos + w * sin))
+    matrix[0, 2] += new_w / 2 - w / 2
+    matrix[1, 2] += new_h / 2 - h / 2
+    return matrix, (new_w, new_h)
+
+def apply_page_geometry(img, rotate, skew):
+    if abs(skew) < 0.1:
+        return cv2.rotate(img, OSD_ROTATIONS[rotate]) if rotate in OSD_ROTATIONS else img
+    
+    matrix, size = page_geometry_transform(img.shape, rotate, skew)
+    border = (255, 255, 255) if img.ndim == 3 else 255
+    return cv2.warpAffine(img, matrix, size, flags=cv2.INTER_LINEAR,
+                          borderMode=cv2.BORDER_CONSTANT, borderValue=border)
+
+def correct_page_geometry(img, image_path=None, use_osd=True, with_transform=False):
+    # with_transform=True zwraca też macierz oryginał -> wynik (do przeliczania ramek z powrotem)
+    gray = img if img.ndim == 2 else cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
+    rotate, skew = get_page_geometry(gray, image_path, use_osd)
+    if rotate or skew:
+        log.debug("📐 Korekta geometrii: obrót %d°, pochylenie %.1f°", rotate, skew)
+    corrected = apply_page_geometry(img, rotate, skew)
+    if with_transform:
+        return corrected, page_geometry_transform(img.shape, rotate, skew)[0]
+    return corrected
+
+def scale_transform(matrix, from_shape, to_shape):
+    # Złożenie transformacji z późniejszym przeskalowaniem obrazu from_shape -> to_shape
+    sx = to_shape[1] / from_shape[1]
+    sy = to_shape[0] / from_shape[0]
+    return matrix * np.array([[sx], [sy]])
+
+def transform_bbox(bbox, matrix, size):
+    # Ramka przekształcona afinicznie to czworokąt - bierzemy jego obwiednię przyciętą do obrazu
+    x0, y0, x1, y1 = bbox
+    corners = np.array([[x0, y0], [x1, y0], [x0, y1], [x1, y1]], dtype=np.float64)
+    mapped = corners @ matrix[:, :2].T + matrix[:, 2]
+    width, height = size
+    left, top = np.round(mapped.min(axis=0))
+    right, bottom = np.round(mapped.max(axis=0))
+    return [int(min(max(left, 0), width)), int(min(max(top, 0), height)),
+            int(min(max(right, 0), width)), int(min(max(bottom, 0), height))]
+
+def layout_to_original(layout, transform, original_shape):
+    # Ramki układu z obrazu OCR (po prostowaniu/skalowaniu) z powrotem do układu oryginału
+    inverse = cv2.invertAffineTransform(transform)
+    size = (original_shape[1], original_shape[0])
+    layout['bbox'] = [0, 0, size[0], size[1]]
+    for block in layout['blocks']:
+        block['bbox'] = transform_bbox(block['bbox'], inverse, size)
+        for line in block['lines']:
+            line['bbox'] = transform_bbox(line['bbox'], inverse, size)
+            for word in line['words']:
+                word['bbox'] = transform_bbox(word['bbox'], inverse, size)
+    return layout
+
+NOISE_SAMPLE_SIDE = 1024
+DENOISE_STRIPE_MIN_PIXELS = 2_000_000
+DENOISE_WORKERS = max(1, min(8, os.cpu_count() or 1))
+
+def estimate_noise_sigma(gray):
+    # Metoda Immerkæra na środkowym wycinku: maska Laplace'a wygasza gładkie tło i proste krawędzie,
+    # zostaje głównie szum; krawędzie tekstu wykluczone progiem gradientu
+    height, width = gray.shape[:2]
+    top = max(0, (height - NOISE_SAMPLE_SIDE) // 2)
+    left = max(0, (width - NOISE_SAMPLE_SIDE) // 2)
+    sample = gray[top:top + NOISE_SAMPLE_SIDE, left:left + NOISE_SAMPLE_SIDE].astype(np.float32)
+    if min(sample.shape[:2]) < 8:
+        return 0.0
+    
+    kernel = np.array([[1, -2, 1], [-2, 4, -2], [1, -2, 1]], np.float32)
+    response = np.abs(cv2.filter2D(sample, -1, kernel))[1:-1, 1:-1]
+    gradient = cv2.magnitude(cv2.Sobel(sample, cv2.CV_32F, 1, 0), cv2.Sobel(sample, cv2.CV_32F, 0, 1))[1:-1, 1:-1]
+    flat = gradient < np.percentile(gradient, 90)
+    values = response[flat] if flat.any() else response
+    return float(np.sqrt(np.pi / 2) * values.mean() / 6)
+
+IMPULSE_NOISE_RATIO = 0.005
+
+def estimate_impulse_ratio(gray):
+    # Odsetek pikseli odizolowanych: jaśniejszych lub ciemniejszych od wszystkich 8 sąsiadów o ponad 60 -
+    # szum typu "sól i pieprz"; piksele pociągnięć pisma mają zawsze podobnego sąsiada
+    height, width = gray.shape[:2]
+    top = max(0, (height - NOISE_SAMPLE_SIDE) // 2)
+    left = max(0, (width - NOISE_SAMPLE_SIDE) // 2)
+    sample = gray[top:top + NOISE_SAMPLE_SIDE, left:left + NOISE_SAMPLE_SIDE].astype(np.int16)
+    if min(sample.shape[:2]) < 8:
+        return 0.0
+    ring = np.ones((3, 3), np.uint8)
+    ring[1, 1] = 0
+    neighbours_max = cv2.dilate(sample, ring)
+    neighbours_min = cv2.erode(sample, ring)
+    isolated = (sample > neighbours_max + 60) | (sample < neighbours_min - 60)
+    return float(np.mean(isolated[1:-1, 1:-1]))
+
+def _denoise_median(gray, sigma):
+    return cv2.medianBlur(gray, 3)
+
+def _denoise_bilateral(gray, sigma):
+    return cv2.bilateralFilter(gray, 5, max(10.0, sigma * 3), 3)
+
+def _denoise_morph(gray, sigma):
+    # Domknięcie jasności = otwarcie ciemnego "tuszu": usuwa ciemne plamki mniejsze od jądra;
+    # jądro nieparzyste (3x3, kotwica w środku), więc obraz nie przesuwa się o piksel
+    kernel = cv2.getStructuringElement(cv2.MORPH_RECT, (3, 3))
+    return cv2.morphologyEx(gray, cv2.MORPH_CLOSE, kernel)
+
+def _denoise_nlmeans(gray, sigma):
+    return cv2.fastNlMeansDenoising(gray, None, h=max(3.0, sigma * 1.2), templateWindowSize=7, searchWindowSize=21)
+
+# nazwa -> (etykieta, funkcja(gray, sigma), margines pasa w pikselach)
+DENOISE_METHODS = {
+    'median': ("mediana 3x3", _denoise_median, 2),
+    'bilateral': ("filtr bilateralny", _denoise_bilateral, 4),
+    'morph': ("domknięcie 3x3", _denoise_morph, 2),
+    'nlmeans': ("NL-means", _denoise_nlmeans, 14),
+}
+# Wybór automatyczny: (maksymalna sigma szumu, metoda); None = bez odszumiania
+DENOISE_AUTO = ((3.5, None), (20.0, 'bilateral'), (float('inf'), 'nlmeans'))
+
+def choose_denoise_method(sigma, impulse_ratio=0.0):
+    if impulse_ratio > IMPULSE_NOISE_RATIO:
+        return 'median'
+    for max_sigma, method in DENOISE_AUTO:
+        if sigma <= max_sigma:
+            return method
+    return DENOISE_AUTO[-1][1]
+
+def run_in_stripes(func, gray, margin, workers=DENOISE_WORKERS):
+    # Poziome pasy z zakładką równą zasięgowi filtra, przetwarzane równolegle (OpenCV zwalnia GIL)
+    height = gray.shape[0]
+    if workers <= 1 or gray.size < DENOISE_STRIPE_MIN_PIXELS:
+        return func(gray)
+    
+    bounds = np.linspace(0, height, workers + 1).astype(int)
+    result = np.empty_like(gray)
+    
+    def process(i):
+        y0, y1 = bounds[i], bounds[i + 1]
+        top, bottom = max(0, y0 - margin), min(height, y1 + margin)
+        result[y0:y1] = func(gray[top:bottom])[y0 - top:y1 - top]
+    
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        list(executor.map(process, range(workers)))
+    return result
+
+def fast_denoise(gray, method='auto', workers=DENOISE_WORKERS):
+    # Zwraca (obraz, metoda, sigma); wywoływać w natywnej rozdzielczości, przed powiększeniem
+    sigma = estimate_noise_sigma(gray)
+    if method == 'auto':
+        method = choose_denoise_method(sigma, estimate_impulse_ratio(gray))
+    if method is None:
+        return gray, None, sigma
+    _, func, margin = DENOISE_METHODS[method]
+    return run_in_stripes(lambda stripe: func(stripe, sigma), gray, margin, workers), method, sigma
+
+OCR_TIMEOUT = float(os.environ.get('OCR_TIMEOUT', '60'))
+OCR_RETRY_TIMEOUT = float(os.environ.get('OCR_RETRY_TIMEOUT', '20'))
+# Termin na cały obraz: wszystkie próby, kafle i kroki w procesie (prostowanie, OSD, wykrywanie języka)
+OCR_IMAGE_TIMEOUT = float(os.environ.get('OCR_IMAGE_TIMEOUT', '180'))
+OCR_MAX_PIXELS = int(float(os.environ.get('OCR_MAX_MEGAPIXELS', '250')) * 1_000_000)
+OCR_RETRY_MAX_SIDE = 2000
+
+class OCRTimeout(RuntimeError):
+    pass
+
+def time_left(deadline, limit):
+    # Limit dla kolejnego wywołania tesseract: nie dłuższy niż limit i nie poza termin obrazu.
+    # Kroków w procesie nie da się przerwać - termin sprawdzany jest między nimi
+    if deadline is None:
+        return limit
+    left = deadline - time.monotonic()
+    if left <= 0:
+        raise OCRTimeout("OCR timeout: przekroczony termin na obraz")
+    return min(limit, left)
+
+def read_grayscale(image_path):
+    # Limit pikseli sprawdzany na podstawie nagłówka, zanim obraz zostanie zdekodowany
+    pixels = image_pixel_count(image_path)
+    if pixels > OCR_MAX_PIXELS:
+        raise ValueError(f"Obraz za duży: {pixels / 1e6:.0f} MP (limit {OCR_MAX_PIXELS / 1e6:.0f} MP)")
+    
+    gray = cv2.imread(image_path, cv2.IMREAD_GRAYSCALE)
+    if gray is None:
+        # OpenCV nie odczytuje m.in. GIF - pierwsza klatka przez PIL
+        with Image.open(image_path) as img:
+            gray = np.array(img.convert('L'))
+    return gray
+
+def load_batch_ocr_image(image_path, deskew=False, with_transform=False):
+    # with_transform=True zwraca też macierz oryginał -> obraz OCR i kształt oryginału
+    gray = read_grayscale(image_path)
+    original_shape = gray.shape
+    transform = np.eye(2, 3)
+    if deskew:
+        gray, transform = correct_page_geometry(gray, image_path, with_transform=True)
+    
+    height, width = gray.shape
+    scaled = cv2.resize(gray, (width * BATCH_OCR_SCALE, height * BATCH_OCR_SCALE), interpolation=cv2.INTER_CUBIC)
+    if with_transform:
+        return scaled, scale_transform(transform, gray.shape, scaled.shape), original_shape
+    return scaled
+
+AUTO_LANG = "auto"
+AUTO_LANG_CANDIDATES = ('pol', 'eng', 'deu')
+LANG_DETECTION_MODEL = 'eng'
+LANG_DETECTION_CROP_HEIGHT = 400
+LANG_CACHE_MIN_SAMPLES = 5
+LANG_CACHE_MIN_SHARE = 0.8
+
+# Model 'eng' gubi znaki diakrytyczne, więc oprócz nich liczą się typowe n-gramy ASCII
+LANGUAGE_PROFILES = {
+    'pol': {'chars': 'ąćęłńóśźż', 'ngrams': ('prz', 'sz', 'cz', 'rz', 'dz', 'nie', 'ow', 'ych', 'ego', 'wie', 'ani', 'kt')},
+    'deu': {'chars': 'äöüß', 'ngrams': ('sch', 'ch', 'ei', 'ie', 'der', 'die', 'und', 'ung', 'gen', 'ich', 'eit', 'ck')},
+    'eng': {'chars': '', 'ngrams': ('th', 'the', 'ing', 'and', 'ion', 'tio', 'wh', 'of', 'ed', 'ly', 'ou', 'ea')},
+}
+
+_folder_languages = {}
+_folder_languages_lock = threading.Lock()
+
+def installed_candidates(candidates=AUTO_LANG_CANDIDATES):
+    # Tylko kandydaci z zainstalowanym modelem (lista języków jest zapamiętywana w get_available_languages)
     try:
-        for file in os.listdir(search_folder):
-            if file.lower().endswith(supported_formats):
-                full_path = os.path.join(search_folder, file)
-                if os.path.abspath(full_path) != os.path.abspath(reference_image_path):
-                    image_files.append(full_path)
+        available = get_available_languages()
     except Exception as e:
-        return [], f"Błąd odczytu folderu: {e}"
+        log.warning("⚠️ Nie można sprawdzić dostępnych języków: %s", e)
+        return tuple(candidates)
+    return tuple(code for code in candidates if code in available)
+
+def detect_text_language(text, candidates=AUTO_LANG_CANDIDATES):
+    candidates = installed_candidates(candidates)
+    text = re.sub(r'[^\w\s]', ' ', text.lower())
+    letters = sum(1 for ch in text if ch.isalpha())
+    if letters < 20:
+        return None
     
-    if not image_files:
-        return [], "Nie znaleziono obrazów w folderze"
+    padded = " " + re.sub(r'\s+', ' ', text) + " "
+    scores = {}
+    for lang in candidates:
+        profile = LANGUAGE_PROFILES.get(lang)
+        if profile is None:
+            continue
+        ngram_hits = sum(padded.count(ngram) * len(ngram) for ngram in profile['ngrams'])
+        char_hits = sum(padded.count(ch) for ch in profile['chars'])
+        scores[lang] = (ngram_hits + 10 * char_hits) / letters
+    
+    if not scores:
+        return None
+    return max(scores, key=scores.get)
+
+def detect_image_language(gray, candidates=AUTO_LANG_CANDIDATES):
+    height = gray.shape[0]
+    crop_height = min(LANG_DETECTION_CROP_HEIGHT, height)
+    top = (height - crop_height) // 2
+    crop = gray[top:top + crop_height]
+    text = pytesseract.image_to_string(ImageBuffer(crop).to_pil(), lang=LANG_DETECTION_MODEL, config=BATCH_OCR_CONFIG,
+                                       timeout=OCR_RETRY_TIMEOUT)
+    return detect_text_language(text, candidates)
+
+def folder_language_distribution(folder):
+    with _folder_languages_lock:
+        return Counter(_folder_languages.get(os.path.abspath(folder), {}))
+
+def resolve_image_language(image_path, gray, candidates=AUTO_LANG_CANDIDATES):
+    folder = os.path.abspath(os.path.dirname(image_path))
+    with _folder_languages_lock:
+        counts = _folder_languages.setdefault(folder, Counter())
+        total = sum(counts.values())
+        if total >= LANG_CACHE_MIN_SAMPLES:
+            lang, hits = counts.most_common(1)[0]
+            if hits / total >= LANG_CACHE_MIN_SHARE:
+                return lang
     
-    print(f"Znaleziono {len(image_files)} obrazów do analizy")
+    lang = detect_image_language(gray, candidates)
+    if lang is None:
+        return "+".join(installed_candidates(candidates))
     
-    similar_images = []
+    with _folder_languages_lock:
+        _folder_languages[folder][lang] += 1
+    log.debug("🔮 Wykryty język %s: %s", image_path, lang)
+    return lang
+
+def extract_text_from_image(image_path, lang="pol+eng", deskew=False, tier=None):
+    try:
+        text, _ = ocr_image_file(image_path, lang, deskew, tier=tier)
+        return text
+    except OCRFailure as e:
+        log.error("Błąd OCR dla %s: %s", image_path, e, extra={'fields': {'event': 'ocr_failed', 'path': image_path}})
+        return ""
+
+def _scale_bbox(left, top, width, height, scale):
+    return [int(round(left / scale)), int(round(top / scale)),
+            int(round((left + width) / scale)), int(round((top + height) / scale))]
+
+def build_ocr_layout(data, scale=1.0):
+    # Strona -> blok -> linia -> słowo; akapity Tesseracta są spłaszczane do linii bloku
+    layout = {'bbox': [0, 0, 0, 0], 'blocks': []}
+    blocks = {}
+    lines = {}
+    
+    for i in range(len(data['level'])):
+        level = int(data['level'][i])
+        bbox = _scale_bbox(int(data['left'][i]), int(data['top'][i]),
+                           int(data['width'][i]), int(data['height'][i]), scale)
+        block_key = int(data['block_num'][i])
+        line_key = (block_key, int(data['par_num'][i]), int(data['line_num'][i]))
+        
+        if level == 1:
+            layout['bbox'] = bbox
+        elif level == 2:
+            blocks[block_key] = {'bbox': bbox, 'lines': []}
+            layout['blocks'].append(blocks[block_key])
+        elif level == 4 and block_key in blocks:
+            lines[line_key] = {'bbox': bbox, 'words': []}
+            blocks[block_key]['lines'].append(lines[line_key])
+        elif level == 5 and line_key in lines:
+            text = str(data['text'][i]).strip()
+            if text:
+                lines[line_key]['words'].append({
+                    'text': text,
+                    'bbox': bbox,
+                    'conf': round(float(data['conf'][i]), 2)
+                })
+    
+    for block in layout['blocks']:
+        block['lines'] = [line for line in block['lines'] if line['words']]
+    layout['blocks'] = [block for block in layout['blocks'] if block['lines']]
+    return layout
+
+def layout_words(layout):
+    for block in layout['blocks']:
+        for line in block['lines']:
+            for word in line['words']:
+                yield word
+
+def layout_text(layout):
+    return "\n\n".join(
+        "\n".join(" ".join(word['text'] for word in line['words']) for line in block['lines'])
+        for block in layout['blocks']
+    )
+
+def layout_confidence(layout):
+    confs = [word['conf'] for word in layout_words(layout) if word['conf'] > 0]
+    return sum(confs) / len(confs) if confs else None
+
+def extract_layout_from_image(image_path, lang="pol+eng", deskew=False):
+    try:
+        layout, _ = ocr_image_file(image_path, lang, deskew, with_layout=True)
+        return layout
+    except OCRFailure as e:
+        log.error("Błąd OCR dla %s: %s", image_path, e, extra={'fields': {'event': 'ocr_failed', 'path': image_path}})
+        return None
+
+TILED_OCR_MIN_PIXELS = 12_000_000
+TILE_SIZE = 1500
+TILE_OVERLAP = 200
+TILED_OCR_WORKERS = max(1, min(4, (os.cpu_count() or 2) // 2))
+
+def image_pixel_count(image_path):
+    # PIL czyta tylko nagłówek - wymiary bez dekodowania pikseli
+    try:
+        with Image.open(image_path) as img:
+            width, height = img.size
+        return width * height
+    except Exception:
+        return 0
+
+def is_large_image(image_path):
+    return image_pixel_count(image_path) > TILED_OCR_MIN_PIXELS
+
+def iter_tiles(width, height, tile_size=TILE_SIZE, overlap=TILE_OVERLAP):
+    step = tile_size - overlap
+    xs = list(range(0, max(width - overlap, 1), step))
+    ys = list(range(0, max(height - overlap, 1), step))
+    for y in ys:
+        for x in xs:
+            yield x, y, min(x + tile_size, width), min(y + tile_size, height)
+
+def ocr_tile(gray, tile, lang, timeout=OCR_TIMEOUT, config=BATCH_OCR_CONFIG, deadline=None):
+    # Limit liczony przy starcie kafla - kafle czekające w kolejce nie dostają czasu już zużytego
+    timeout = time_left(deadline, timeout)
+    x0, y0, x1, y1 = tile
+    crop = gray[y0:y1, x0:x1]
+    crop = cv2.resize(crop, ((x1 - x0) * BATCH_OCR_SCALE, (y1 - y0) * BATCH_OCR_SCALE), interpolation=cv2.INTER_CUBIC)
+    data = pytesseract.image_to_data(ImageBuffer(crop).to_pil(), lang=lang, config=config,
+                                     output_type=pytesseract.Output.DICT, timeout=timeout)
+    del crop
+    
+    words = []
+    for i in range(len(data['level'])):
+        text = str(data['text'][i]).strip()
+        if int(data['level'][i]) != 5 or not text:
+            continue
+        bx0, by0, bx1, by1 = _scale_bbox(int(data['left'][i]), int(data['top'][i]),
+                                         int(data['width'][i]), int(data['height'][i]), BATCH_OCR_SCALE)
+        words.append({'text': text, 'bbox': [bx0 + x0, by0 + y0, bx1 + x0, by1 + y0],
+                      'conf': round(float(data['conf'][i]), 2)})
+    return words
+
+def _owned_words(words, tile, width, height, overlap=TILE_OVERLAP):
+    # Słowo należy do kafla, którego "rdzeń" (kafel minus pół zakładki od strony sąsiada) zawiera jego środek;
+    # słowa ucięte na wewnętrznej krawędzi kafla pomijamy - sąsiad ma je w całości
+    x0, y0, x1, y1 = tile
+    half = overlap / 2
+    core = (x0 + half if x0 > 0 else 0, y0 + half if y0 > 0 else 0,
+            x1 - half if x1 < width else width, y1 - half if y1 < height else height)
+    owned = []
+    for word in words:
+        wx0, wy0, wx1, wy1 = word['bbox']
+        if (x0 > 0 and wx0 <= x0 + 1) or (y0 > 0 and wy0 <= y0 + 1) or \
+           (x1 < width and wx1 >= x1 - 1) or (y1 < height and wy1 >= y1 - 1):
+            continue
+        cx, cy = (wx0 + wx1) / 2, (wy0 + wy1) / 2
+        if core[0] <= cx < core[2] and core[1] <= cy < core[3]:
+            owned.append(word)
+    return owned
+
+def merge_words_reading_order(words):
+    if not words:
+        return []
+    
+    heights = sorted(w['bbox'][3] - w['bbox'][1] for w in words)
+    tolerance = max(heights[len(heights) // 2] * 0.5, 1)
+    
+    lines = []
+    for word in sorted(words, key=lambda w: (w['bbox'][1] + w['bbox'][3]) / 2):
+        center_y = (word['bbox'][1] + word['bbox'][3]) / 2
+        if lines and abs(center_y - lines[-1]['center_y']) <= tolerance:
+            line = lines[-1]
+            line['words'].append(word)
+            line['center_y'] += (center_y - line['center_y']) / len(line['words'])
+        else:
+            lines.append({'center_y': center_y, 'words': [word]})
+    
+    merged = []
+    for line in lines:
+        line_words = sorted(line['words'], key=lambda w: w['bbox'][0])
+        merged.append({
+            'bbox': [min(w['bbox'][0] for w in line_words), min(w['bbox'][1] for w in line_words),
+                     max(w['bbox'][2] for w in line_words), max(w['bbox'][3] for w in line_words)],
+            'words': line_words
+        })
+    return merged
+
+def extract_layout_tiled(image_path, lang="pol+eng", deskew=False, max_workers=TILED_OCR_WORKERS,
+                         timeout=OCR_TIMEOUT, tier=None, deadline=None):
+    # Skala szarości od razu przy dekodowaniu; powiększany jest tylko pojedynczy kafel
+    gray = read_grayscale(image_path)
+    original_shape = gray.shape
+    transform = None
+    if deskew:
+        time_left(deadline, timeout)
+        gray, transform = correct_page_geometry(gray, image_path, with_transform=True)
+    if lang == AUTO_LANG:
+        time_left(deadline, timeout)
+        lang = resolve_image_language(image_path, gray)
+    config = BATCH_OCR_CONFIG + tier_config(tier, lang)
+    
+    height, width = gray.shape
+    tiles = iter_tiles(width, height)
+    words = []
+    log.debug("🧩 OCR kafelkowy: %s (%dx%d)", image_path, width, height)
+    
+    # Kafle dziedziczą środowisko tesseract wątku wywołującego (limit OpenMP tylko w pracy wsadowej)
+    with ThreadPoolExecutor(max_workers=max_workers, initializer=tesseract_environ.set_overrides,
+                            initargs=(tesseract_environ.overrides(),)) as executor:
+        in_flight = {}
+        for tile in tiles:
+            # Co najwyżej max_workers kafli w pamięci jednocześnie
+            if len(in_flight) >= max_workers:
+                done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+                for future in done:
+                    words.extend(_owned_words(future.result(), in_flight.pop(future), width, height))
+            in_flight[executor.submit(ocr_tile, gray, tile, lang, timeout, config, deadline)] = tile
+        for future in list(in_flight):
+            words.extend(_owned_words(future.result(), in_flight.pop(future), width, height))
+    
+    lines = merge_words_reading_order(words)
+    blocks = [{'bbox': line['bbox'], 'lines': [line]} for line in lines]
+    layout = {'bbox': [0, 0, width, height], 'blocks': [{
+        'bbox': [min(b['bbox'][0] for b in blocks), min(b['bbox'][1] for b in blocks),
+                 max(b['bbox'][2] for b in blocks), max(b['bbox'][3] for b in blocks)],
+        'lines': lines
+    }] if lines else []}
+    if transform is not None:
+        layout = layout_to_original(layout, transform, original_shape)
+    return layout
+
+REFINE_CONF_THRESHOLD = 70.0
+REFINE_TARGET_CONF = 90.0
+REFINE_MAX_LINES = 200
+REFINE_PADDING = 0.3
+
+def _refine_denoise(crop):
+    denoised = cv2.fastNlMeansDenoising(crop, h=15)
+    return cv2.resize(denoised, None, fx=3, fy=3, interpolation=cv2.INTER_CUBIC), 3
+
+def _refine_otsu(crop):
+    big = cv2.resize(crop, None, fx=3, fy=3, interpolation=cv2.INTER_CUBIC)
+    _, binary = cv2.threshold(cv2.GaussianBlur(big, (3, 3), 0), 0, 255, cv2.THRESH_BINARY + cv2.THRESH_OTSU)
+    return binary, 3
+
+def _refine_adaptive(crop):
+    big = cv2.resize(crop, None, fx=2, fy=2, interpolation=cv2.INTER_CUBIC)
+    return cv2.adaptiveThreshold(big, 255, cv2.ADAPTIVE_THRESH_GAUSSIAN_C, cv2.THRESH_BINARY, 31, 10), 2
+
+# (nazwa, przygotowanie wycinka -> (obraz, skala), PSM); kolejno od najbardziej obiecującego
+REFINE_VARIANTS = (
+    ('odszumianie x3', _refine_denoise, 7),
+    ('Otsu x3', _refine_otsu, 7),
+    ('progowanie adaptacyjne x2', _refine_adaptive, 13),
+)
+
+def line_confidence(line):
+    confs = [word['conf'] for word in line['words'] if word['conf'] >= 0]
+    return sum(confs) / len(confs) if confs else 0.0
+
+def refine_line(session, gray, line, scale):
+    # Wycinek linii (bbox w układzie oryginału, gray w skali `scale`) czytany mocniejszymi wariantami;
+    # zwraca słowa najlepszego wariantu albo None, gdy żaden nie przebił pewności oryginału
+    height, width = gray.shape[:2]
+    x0, y0, x1, y1 = [int(round(v * scale)) for v in line['bbox']]
+    pad = int((y1 - y0) * REFINE_PADDING) + 2
+    x0, y0, x1, y1 = max(0, x0 - pad), max(0, y0 - pad), min(width, x1 + pad), min(height, y1 + pad)
+    crop = gray[y0:y1, x0:x1]
+    if crop.size == 0:
+        return None
+    
+    best_conf = line_confidence(line)
+    best_words = None
+    for _, prepare, psm in REFINE_VARIANTS:
+        variant_img, variant_scale = prepare(crop)
+        data = session.variant(psm).image_to_data(ImageBuffer(variant_img))
+        words = []
+        for i in range(len(data['level'])):
+            text = str(data['text'][i]).strip()
+            if int(data['level'][i]) != 5 or not text:
+                continue
+            cx0, cy0, cx1, cy1 = _scale_bbox(int(data['left'][i]), int(data['top'][i]),
+                                             int(data['width'][i]), int(data['height'][i]), variant_scale)
+            words.append({'text': text,
+                          'bbox': _scale_bbox(cx0 + x0, cy0 + y0, cx1 - cx0, cy1 - cy0, scale),
+                          'conf': round(float(data['conf'][i]), 2)})
+        conf = line_confidence({'words': words})
+        if words and conf > best_conf:
+            best_conf, best_words = conf, words
+            if best_conf >= REFINE_TARGET_CONF:
+                break
+    return best_words
+
+def refine_layout(session, gray, layout, scale, max_workers=TILED_OCR_WORKERS):
+    # Ponowny OCR tylko linii o niskiej pewności; zwraca (poprawione, sprawdzone)
+    weak = [line for block in layout['blocks'] for line in block['lines']
+            if line_confidence(line) < REFINE_CONF_THRESHOLD]
+    weak = sorted(weak, key=line_confidence)[:REFINE_MAX_LINES]
+    if not weak:
+        return 0, 0
+    
+    improved = 0
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        for line, words in zip(weak, executor.map(lambda l: refine_line(session, gray, l, scale), weak)):
+            if words:
+                line['words'] = words
+                line['bbox'] = [min(w['bbox'][0] for w in words), min(w['bbox'][1] for w in words),
+                                max(w['bbox'][2] for w in words), max(w['bbox'][3] for w in words)]
+                improved += 1
+    return improved, len(weak)
+
+OCR_STRATEGIES = ('full', 'cheap')
+QUARANTINE_DIR = os.path.join(os.path.expanduser('~'), '.ocr_tesseract', 'quarantine')
+
+class OCRFailure(Exception):
+    def __init__(self, image_path, attempts):
+        self.image_path = image_path
+        self.attempts = attempts
+        super().__init__("; ".join(f"{a['strategy']}: {a['error']}" for a in attempts))
+
+def fallback_language(lang):
+    if lang == AUTO_LANG:
+        return LANG_DETECTION_MODEL
+    return lang.split('+')[0]
+
+def _run_ocr_strategy(image_path, lang, deskew, strategy, with_layout, tier=None, deadline=None):
+    if strategy == 'full':
+        if is_large_image(image_path):
+            layout = extract_layout_tiled(image_path, lang, deskew, timeout=OCR_TIMEOUT, tier=tier,
+                                          deadline=deadline)
+            return layout if with_layout else layout_text(layout)
+        gray, transform, original_shape = load_batch_ocr_image(image_path, deskew, with_transform=True)
+        if lang == AUTO_LANG:
+            time_left(deadline, OCR_TIMEOUT)
+            lang = resolve_image_language(image_path, gray)
+        timeout = time_left(deadline, OCR_TIMEOUT)
+    else:
+        # Tańsza próba: bez powiększenia i prostowania, pomniejszony obraz, jeden język
+        gray = read_grayscale(image_path)
+        original_shape = gray.shape
+        gray = _downscale(gray, OCR_RETRY_MAX_SIDE)
+        transform = scale_transform(np.eye(2, 3), original_shape, gray.shape)
+        timeout = time_left(deadline, OCR_RETRY_TIMEOUT)
+        lang = fallback_language(lang)
     
-    for i, img_path in enumerate(image_files, 1):
+    pil_img = ImageBuffer(gray).to_pil()
+    config = BATCH_OCR_CONFIG + tier_config(tier, lang)
+    if with_layout:
+        data = pytesseract.image_to_data(pil_img, lang=lang, config=config,
+                                         output_type=pytesseract.Output.DICT, timeout=timeout)
+        return layout_to_original(build_ocr_layout(data), transform, original_shape)
+    return pytesseract.image_to_string(pil_img, lang=lang, config=config, timeout=timeout).strip()
+
+def ocr_image_file(image_path, lang="pol+eng", deskew=False, with_layout=False, tier=None):
+    # Zwraca (wynik, strategia); po porażce wszystkich strategii zgłasza OCRFailure z przebiegiem prób.
+    # Przekroczenie limitu czasu kończy proces tesseract (pytesseract zabija go przy timeout).
+    # Termin liczony raz na obraz; pełna próba zostawia czas na tańszą
+    deadline = time.monotonic() + OCR_IMAGE_TIMEOUT
+    attempts = []
+    for strategy in OCR_STRATEGIES:
+        start = time.time()
+        strategy_deadline = deadline
+        if strategy != OCR_STRATEGIES[-1]:
+            strategy_deadline = max(deadline - OCR_RETRY_TIMEOUT, time.monotonic())
         try:
-            print(f"Analizuję {i}/{len(image_files)}: {os.path.basename(img_path)}")
-            
-            img_text = extract_text_from_image(img_path, lang)
-            
-            if img_text.strip():
-                similarity = calculate_text_similarity(reference_text, img_text)
-                
-                if similarity >= similarity_threshold:
-                    similar_images.append({
-                        'path': img_path,
-                        'filename': os.path.basename(img_path),
-                        'similarity': similarity,
-                        'text': img_text[:200] + "..." if len(img_text) > 200 else img_text
-                    })
-                    print(f"  ✅ Podobieństwo: {similarity:.2%}")
-                else:
-                    print(f"  ❌ Podobieństwo: {similarity:.2%} (poniżej progu)")
-            else:
-                print(f"  ⚠️ Brak tekstu")
-                
+            result = _run_ocr_strategy(image_path, lang, deskew, strategy, with_layout, tier, strategy_deadline)
         except Exception as e:
-            print(f"  ❌ Błąd: {e}")
+            seconds = time.time() - start
+            cause = failure_cause(e)
+            OCR_SECONDS.observe(seconds, strategy=strategy, tier=tier or 'default', outcome='error')
+            OCR_FAILURES.inc(strategy=strategy, cause=cause)
+            attempts.append({'strategy': strategy, 'error': str(e) or type(e).__name__,
+                             'cause': cause, 'seconds': round(seconds, 2)})
+            log.warning("  ⚠️ %s: próba '%s' nieudana (%s)", image_path, strategy, e,
+                        extra={'fields': {'event': 'ocr_attempt_failed', 'path': image_path,
+                                          'strategy': strategy, 'cause': cause}})
+            if time.monotonic() >= deadline:
+                break
+            continue
+        OCR_SECONDS.observe(time.time() - start, strategy=strategy, tier=tier or 'default', outcome='ok')
+        OCR_IMAGES.inc(result='ok' if strategy == OCR_STRATEGIES[0] else 'fallback')
+        return result, strategy
+    OCR_IMAGES.inc(result='failed')
+    raise OCRFailure(image_path, attempts)
+
+WORKER_MEMORY_BYTES = 400 * 1024 * 1024
+AUTOSCALE_WINDOW_SECONDS = 5.0
+AUTOSCALE_MIN_SAMPLES = 4
+
+def cpu_load():
+    # Obciążenie znormalizowane do liczby rdzeni (1.0 = wszystkie zajęte); None gdy nieznane
+    if PSUTIL_AVAILABLE:
+        return psutil.cpu_percent(interval=None) / 100
+    if hasattr(os, 'getloadavg'):
+        return os.getloadavg()[0] / (os.cpu_count() or 1)
+    return None
+
+def available_memory():
+    if PSUTIL_AVAILABLE:
+        return psutil.virtual_memory().available
+    try:
+        with open('/proc/meminfo', 'r') as f:
+            for line in f:
+                if line.startswith('MemAvailable:'):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    return None
+
+class OCRAutoscaler:
+    # Wspinaczka po przepustowości: liczba wątków zmieniana o 1 co okno pomiarowe, dopóki obrazy/s rosną;
+    # obciążenie CPU i wolna pamięć blokują zwiększanie
+    def __init__(self, max_workers=None, fixed_workers=None):
+        cpus = os.cpu_count() or 2
+        self.max_workers = max(1, max_workers or cpus)
+        self.fixed = fixed_workers is not None
+        if self.fixed:
+            self.workers = max(1, min(self.max_workers, fixed_workers))
+        else:
+            self.workers = max(1, min(self.max_workers, cpus // 2, self._memory_limit()))
+        self.direction = 1
+        self.last_throughput = None
+        self.window_start = time.time()
+        self.window_done = 0
+        self.started = self.window_start
+        self.history = [{'t': 0.0, 'workers': self.workers, 'throughput': None}]
+        OCR_WORKERS.set(self.workers)
     
-    similar_images.sort(key=lambda x: x['similarity'], reverse=True)
+    @classmethod
+    def from_environment(cls):
+        fixed = os.environ.get('OCR_WORKERS')
+        max_workers = os.environ.get('OCR_MAX_WORKERS')
+        return cls(int(max_workers) if max_workers else None, int(fixed) if fixed else None)
     
-    return similar_images, ""
+    def _memory_limit(self):
+        free = available_memory()
+        if free is None:
+            return self.max_workers
+        return max(1, int(free // WORKER_MEMORY_BYTES))
+    
+    def describe(self):
+        free = available_memory()
+        load = cpu_load()
+        return (f"wątki {self.workers}{' (stałe)' if self.fixed else f' (maks. {self.max_workers})'}, "
+                f"OMP_THREAD_LIMIT={TESSERACT_THREADS}, CPU {os.cpu_count()}"
+                f"{f', obciążenie {load:.0%}' if load is not None else ''}"
+                f"{f', wolna pamięć {free / 1024 ** 3:.1f} GB' if free is not None else ''}")
+    
+    def completed(self):
+        self.window_done += 1
+        elapsed = time.time() - self.window_start
+        if self.fixed or elapsed < AUTOSCALE_WINDOW_SECONDS or self.window_done < AUTOSCALE_MIN_SAMPLES:
+            return
+        self._adjust(self.window_done / elapsed)
+        self.window_start = time.time()
+        self.window_done = 0
+    
+    def _adjust(self, throughput):
+        if self.last_throughput is None or throughput > self.last_throughput * 1.05:
+            step = self.direction
+        elif throughput < self.last_throughput * 0.95:
+            # Ostatnia zmiana pogorszyła przepustowość - cofamy ją i zmieniamy kierunek
+            self.direction = -self.direction
+            step = self.direction
+        else:
+            step = 0
+        self.last_throughput = throughput
+        OCR_THROUGHPUT.set(round(throughput, 3))
+        
+        load = cpu_load()
+        if step > 0 and ((load is not None and load > 1.0) or self._memory_limit() <= self.workers):
+            step = 0
+        if self._memory_limit() < self.workers:
+            step = -1
+        
+        workers = max(1, min(self.max_workers, self.workers + step))
+        if workers != self.workers:
+            log.info("⚙️ Wątki OCR: %d → %d (%.2f obr/s%s)", self.workers, workers, throughput,
+                     f", obciążenie CPU {load:.0%}" if load is not None else "")
+            self.workers = workers
+            OCR_WORKERS.set(workers)
+            self.history.append({'t': round(time.time() - self.started, 1), 'workers': workers,
+                                 'throughput': round(throughput, 3)})
 
+def write_quarantine_report(failures, search_folder):
+    os.makedirs(QUARANTINE_DIR, exist_ok=True)
+    report_path = os.path.join(QUARANTINE_DIR, time.strftime('quarantine-%Y%m%d-%H%M%S.json'))
+    report = {
+        'search_folder': os.path.abspath(search_folder),
+        'timestamp': time.strftime('%Y-%m-%d %H:%M:%S'),
+        'files': failures
+    }
+    with open(report_path, 'w', encoding='utf-8') as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+    return report_path
 
-setup_tesseract()
+def _bbox_title(bbox):
+    return "bbox {} {} {} {}".format(*bbox)
+
+def _hocr_page(layout, page_no, image_name=""):
+    title = f'image "{image_name}"; {_bbox_title(layout["bbox"])}'
+    parts = [f'<div class="ocr_page" id="page_{page_no}" title={quoteattr(title)}>']
+    for b, block in enumerate(layout['blocks'], 1):
+        parts.append(f'<div class="ocr_carea" id="block_{page_no}_{b}" title="{_bbox_title(block["bbox"])}">')
+        for l, line in enumerate(block['lines'], 1):
+            parts.append(f'<span class="ocr_line" id="line_{page_no}_{b}_{l}" title="{_bbox_title(line["bbox"])}">')
+            for w, word in enumerate(line['words'], 1):
+                parts.append(f'<span class="ocrx_word" id="word_{page_no}_{b}_{l}_{w}" '
+                             f'title="{_bbox_title(word["bbox"])}; x_wconf {int(word["conf"])}">'
+                             f'{escape(word["text"])}</span>')
+            parts.append('</span>')
+        parts.append('</div>')
+    parts.append('</div>')
+    return "\n".join(parts) + "\n"
+
+HOCR_HEADER = """<?xml version="1.0" encoding="UTF-8"?>
+<!DOCTYPE html PUBLIC "-//W3C//DTD XHTML 1.0 Transitional//EN" "http://www.w3.org/TR/xhtml1/DTD/xhtml1-transitional.dtd">
+<html xmlns="http://www.w3.org/1999/xhtml">
+<head>
+<meta http-equiv="Content-Type" content="text/html; charset=utf-8" />
+<meta name="ocr-system" content="tesseract" />
+<meta name="ocr-capabilities" content="ocr_page ocr_carea ocr_line ocrx_word" />
+</head>
+<body>
+"""
+HOCR_FOOTER = "</body>\n</html>\n"
+
+def _alto_box(bbox):
+    x0, y0, x1, y1 = bbox
+    return f'HPOS="{x0}" VPOS="{y0}" WIDTH="{x1 - x0}" HEIGHT="{y1 - y0}"'
+
+def _alto_page(layout, page_no):
+    x0, y0, x1, y1 = layout['bbox']
+    parts = [f'<Page ID="page_{page_no}" PHYSICAL_IMG_NR="{page_no}" WIDTH="{x1 - x0}" HEIGHT="{y1 - y0}">',
+             f'<PrintSpace {_alto_box(layout["bbox"])}>']
+    for b, block in enumerate(layout['blocks'], 1):
+        parts.append(f'<TextBlock ID="block_{page_no}_{b}" {_alto_box(block["bbox"])}>')
+        for l, line in enumerate(block['lines'], 1):
+            parts.append(f'<TextLine ID="line_{page_no}_{b}_{l}" {_alto_box(line["bbox"])}>')
+            for w, word in enumerate(line['words'], 1):
+                if w > 1:
+                    parts.append('<SP/>')
+                parts.append(f'<String ID="word_{page_no}_{b}_{l}_{w}" {_alto_box(word["bbox"])} '
+                             f'WC="{max(word["conf"], 0) / 100:.2f}" CONTENT={quoteattr(word["text"])}/>')
+            parts.append('</TextLine>')
+        parts.append('</TextBlock>')
+    parts.append('</PrintSpace>')
+    parts.append('</Page>')
+    return "\n".join(parts) + "\n"
+
+ALTO_HEADER = """<?xml version="1.0" encoding="UTF-8"?>
+<alto xmlns="http://www.loc.gov/standards/alto/ns-v4#">
+<Description><MeasurementUnit>pixel</MeasurementUnit></Description>
+<Layout>
+"""
+ALTO_FOOTER = "</Layout>\n</alto>\n"
+
+def layout_to_compact(layout, image_path=None):
+    # Słowa jako [tekst, x0, y0, x1, y1, pewność] - kilkukrotnie mniej bajtów niż słowniki
+    compact = {
+        'bbox': layout['bbox'],
+        'blocks': [[[line['bbox'], [[w['text'], *w['bbox'], w['conf']] for w in line['words']]]
+                    for line in block['lines']] for block in layout['blocks']]
+    }
+    if image_path is not None:
+        compact['image'] = image_path
+    return compact
+
+def layout_to_json(layout, image_path=None):
+    return json.dumps(layout_to_compact(layout, image_path), ensure_ascii=False, separators=(',', ':'))
+
+def layout_to_hocr(layout, image_name=""):
+    return HOCR_HEADER + _hocr_page(layout, 1, image_name) + HOCR_FOOTER
+
+def layout_to_alto(layout):
+    return ALTO_HEADER + _alto_page(layout, 1) + ALTO_FOOTER
+
+LAYOUT_FORMATS = {'.hocr': 'hocr', '.html': 'hocr', '.xml': 'alto', '.json': 'json', '.jsonl': 'json'}
+
+def layout_format_for_path(path):
+    return LAYOUT_FORMATS.get(os.path.splitext(path)[1].lower(), 'json')
+
+class LayoutStreamWriter:
+    def __init__(self, path, fmt=None):
+        self.fmt = fmt or layout_format_for_path(path)
+        self.pages = 0
+        self.file = open(path, 'w', encoding='utf-8')
+        if self.fmt == 'hocr':
+            self.file.write(HOCR_HEADER)
+        elif self.fmt == 'alto':
+            self.file.write(ALTO_HEADER)
+    
+    def write(self, layout, image_path=""):
+        self.pages += 1
+        if self.fmt == 'hocr':
+            self.file.write(_hocr_page(layout, self.pages, image_path))
+        elif self.fmt == 'alto':
+            self.file.write(_alto_page(layout, self.pages))
+        else:
+            self.file.write(layout_to_json(layout, image_path) + "\n")
+    
+    def close(self):
+        if self.file.closed:
+            return
+        if self.fmt == 'hocr':
+            self.file.write(HOCR_FOOTER)
+        elif self.fmt == 'alto':
+            self.file.write(ALTO_FOOTER)
+        self.file.close()
+    
+    def __enter__(self):
+        return self
+    
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+def write_layout_file(layout, path, image_path=""):
+    with LayoutStreamWriter(path) as writer:
+        writer.write(layout, image_path)
+
+SIMILARITY_MODES = {
+    'tfidf': "Słowa TF-IDF",
+    'char': "N-gramy znakowe 3-4",
+    'fuzzy': "N-gramy + odległość edycyjna",
+    'semantic': "Semantyczne (wektory)",
+}
+# Domyślny próg dla trybu - skale wyników są różne (skalibrowane: python benchmark.py similarity)
+SIMILARITY_THRESHOLDS = {'tfidf': 0.3, 'char': 0.5, 'fuzzy': 0.7, 'semantic': 0.4}
+CHAR_NGRAM_RANGE = (3, 4)
+CHAR_NGRAM_FEATURES = 2 ** 20
+FUZZY_RERANK_TOP_K = int(os.environ.get('OCR_FUZZY_TOP_K', '20'))
+SCORE_BATCH_SIZE = 32
+
+def levenshtein_distance(a, b, max_distance=None):
+    # Algorytm bitowy Myersa/Hyyrö na liczbach całkowitych Pythona: O(len(a) * len(b) / 64)
+    if RAPIDFUZZ_AVAILABLE:
+        return RapidLevenshtein.distance(a, b, score_cutoff=max_distance)
+    if len(a) < len(b):
+        a, b = b, a
+    m = len(b)
+    if m == 0:
+        return len(a) if max_distance is None else min(len(a), max_distance + 1)
+    
+    peq = {}
+    for i, ch in enumerate(b):
+        peq[ch] = peq.get(ch, 0) | (1 << i)
+    
+    mask = (1 << m) - 1
+    last = 1 << (m - 1)
+    vp, vn = mask, 0
+    score = m
+    remaining = len(a)
+    for ch in a:
+        eq = peq.get(ch, 0)
+        xv = eq | vn
+        xh = (((eq & vp) + vp) ^ vp) | eq
+        hp = (vn | ~(xh | vp)) & mask
+        hn = vp & xh
+        if hp & last:
+            score += 1
+        elif hn & last:
+            score -= 1
+        remaining -= 1
+        # Pasmo: nawet same trafienia do końca nie zejdą poniżej limitu
+        if max_distance is not None and score - remaining > max_distance:
+            return max_distance + 1
+        hp = ((hp << 1) | 1) & mask
+        hn = (hn << 1) & mask
+        vp = (hn | ~(xv | hp)) & mask
+        vn = hp & xv
+    return score
+
+def edit_similarity(a, b, min_similarity=0.0):
+    longest = max(len(a), len(b))
+    if longest == 0:
+        return 0.0
+    max_distance = int(longest * (1.0 - min_similarity))
+    distance = levenshtein_distance(a, b, max_distance)
+    if distance > max_distance:
+        return 0.0
+    return 1.0 - distance / longest
+
+def _char_ngram_counts(text):
+    padded = f" {text} "
+    counts = Counter()
+    for n in range(CHAR_NGRAM_RANGE[0], CHAR_NGRAM_RANGE[1] + 1):
+        counts.update(padded[i:i + n] for i in range(len(padded) - n + 1))
+    return {gram: 1.0 + np.log(count) for gram, count in counts.items()}
+
+def _sparse_cosine(v1, v2):
+    dot = sum(weight * v2.get(gram, 0.0) for gram, weight in v1.items())
+    norm = (sum(w * w for w in v1.values()) * sum(w * w for w in v2.values())) ** 0.5
+    return dot / norm if norm else 0.0
+
+EMBEDDING_DIM = 256
+EMBEDDING_HASHES = 4
+EMBEDDING_MODEL = os.environ.get('OCR_EMBEDDING_MODEL', '')
+EMBEDDINGS_DIR = os.path.join(os.path.expanduser('~'), '.ocr_tesseract', 'embeddings')
+EMBEDDING_QUERY_CHUNK = 65536
+_HASH_MULTIPLIERS = np.array([0x9E3779B1, 0x85EBCA77, 0xC2B2AE3D, 0x27D4EB2F], dtype=np.uint64)
+
+class TextEmbedder:
+    # Lokalny model sentence-transformers (OCR_EMBEDDING_MODEL) albo haszowane n-gramy
+    # rzutowane losowo do EMBEDDING_DIM wymiarów - bez pobierania modelu
+    def __init__(self, dim=EMBEDDING_DIM, model_name=EMBEDDING_MODEL):
+        self.model = None
+        self.name = f"hashed-{dim}"
+        self.dim = dim
+        if model_name:
+            try:
+                from sentence_transformers import SentenceTransformer
+                self.model = SentenceTransformer(model_name, device='cpu')
+                self.dim = self.model.get_sentence_embedding_dimension()
+                self.name = model_name
+            except Exception as e:
+                log.warning("⚠️ Model %s niedostępny (%s) - używam wektorów haszowanych", model_name, e)
+    
+    def _features(self, text):
+        words = normalize_text(text).split()
+        grams = list(words)
+        for word in words:
+            padded = f" {word} "
+            grams.extend(padded[i:i + 4] for i in range(max(len(padded) - 3, 1)))
+        return grams
+    
+    def _hashed_vector(self, text):
+        vector = np.zeros(self.dim, dtype=np.float32)
+        grams = self._features(text)
+        if not grams:
+            return vector
+        hashes = np.fromiter((zlib.crc32(g.encode('utf-8')) for g in grams), dtype=np.uint64, count=len(grams))
+        for k in range(EMBEDDING_HASHES):
+            mixed = (hashes * _HASH_MULTIPLIERS[k]) & np.uint64(0xFFFFFFFF)
+            index = (mixed >> np.uint64(8)) % np.uint64(self.dim)
+            sign = np.where((mixed >> np.uint64(k)) & np.uint64(1), 1.0, -1.0).astype(np.float32)
+            np.add.at(vector, index.astype(np.intp), sign)
+        return vector
+    
+    def embed(self, texts):
+        if self.model is not None:
+            vectors = np.asarray(self.model.encode(list(texts), batch_size=32, show_progress_bar=False), dtype=np.float32)
+        else:
+            vectors = np.vstack([self._hashed_vector(t) for t in texts]) if texts else np.zeros((0, self.dim), np.float32)
+        norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+        return vectors / np.maximum(norms, 1e-12)
+
+_text_embedder = None
+
+def get_text_embedder():
+    global _text_embedder
+    if _text_embedder is None:
+        _text_embedder = TextEmbedder()
+    return _text_embedder
+
+class EmbeddingStore:
+    # Wektory float32 w pliku .npy mapowanym do pamięci; metadane (ścieżka, mtime, rozmiar, podgląd) w JSON
+    def __init__(self, directory, dim, model_name):
+        self.directory = directory
+        self.matrix_path = os.path.join(directory, 'vectors.npy')
+        self.meta_path = os.path.join(directory, 'meta.json')
+        self.dim = dim
+        self.model_name = model_name
+        self.entries = []
+        self.matrix = None
+        
+        os.makedirs(directory, exist_ok=True)
+        try:
+            with open(self.meta_path, 'r', encoding='utf-8') as f:
+                meta = json.load(f)
+            if meta.get('dim') == dim and meta.get('model') == model_name and os.path.exists(self.matrix_path):
+                self.entries = meta['entries']
+                self.matrix = np.lib.format.open_memmap(self.matrix_path, mode='r+')
+        except (OSError, ValueError, KeyError):
+            self.entries = []
+        self.index = {entry[0]: row for row, entry in enumerate(self.entries)}
+    
+    @classmethod
+    def for_folder(cls, folder, embedder):
+        key = hashlib.blake2b(os.path.abspath(folder).encode('utf-8'), digest_size=8).hexdigest()
+        return cls(os.path.join(EMBEDDINGS_DIR, key), embedder.dim, embedder.name)
+    
+    def __len__(self):
+        return len(self.entries)
+    
+    def lookup(self, path):
+        row = self.index.get(path)
+        if row is None:
+            return None
+        try:
+            stat = os.stat(path)
+        except OSError:
+            return None
+        _, mtime_ns, size, _ = self.entries[row]
+        return row if (mtime_ns, size) == (stat.st_mtime_ns, stat.st_size) else None
+    
+    def _ensure_capacity(self, rows):
+        capacity = 0 if self.matrix is None else self.matrix.shape[0]
+        if rows <= capacity:
+            return
+        new_capacity = max(1024, capacity * 2, rows)
+        tmp_path = self.matrix_path + '.tmp'
+        grown = np.lib.format.open_memmap(tmp_path, mode='w+', dtype=np.float32, shape=(new_capacity, self.dim))
+        if self.matrix is not None:
+            grown[:capacity] = self.matrix
+            del self.matrix
+        grown.flush()
+        del grown
+        os.replace(tmp_path, self.matrix_path)
+        self.matrix = np.lib.format.open_memmap(self.matrix_path, mode='r+')
+    
+    def add(self, path, vector, preview=""):
+        stat = os.stat(path)
+        entry = [path, stat.st_mtime_ns, stat.st_size, preview]
+        row = self.index.get(path)
+        if row is None:
+            row = len(self.entries)
+            self._ensure_capacity(row + 1)
+            self.entries.append(entry)
+            self.index[path] = row
+        else:
+            self.entries[row] = entry
+        self.matrix[row] = vector
+        return row
+    
+    def vectors(self, rows):
+        return np.asarray(self.matrix[np.asarray(rows, dtype=np.intp)])
+    
+    def preview(self, row):
+        return self.entries[row][3]
+    
+    def flush(self):
+        if self.matrix is not None:
+            self.matrix.flush()
+        tmp_path = self.meta_path + '.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump({'dim': self.dim, 'model': self.model_name, 'entries': self.entries}, f, ensure_ascii=False)
+        os.replace(tmp_path, self.meta_path)
+    
+    def query(self, vector, top_k=50):
+        # Iloczyny skalarne partiami - pamięć ograniczona niezależnie od liczby dokumentów
+        count = len(self.entries)
+        best_rows = np.zeros(0, dtype=np.intp)
+        best_scores = np.zeros(0, dtype=np.float32)
+        for start in range(0, count, EMBEDDING_QUERY_CHUNK):
+            chunk_scores = np.asarray(self.matrix[start:min(start + EMBEDDING_QUERY_CHUNK, count)]) @ vector
+            rows = np.arange(start, start + len(chunk_scores))
+            best_rows = np.concatenate([best_rows, rows])
+            best_scores = np.concatenate([best_scores, chunk_scores])
+            if len(best_scores) > top_k:
+                keep = np.argpartition(-best_scores, top_k)[:top_k]
+                best_rows, best_scores = best_rows[keep], best_scores[keep]
+        order = np.argsort(-best_scores)
+        return [(self.entries[r][0], float(s), self.entries[r][3]) for r, s in zip(best_rows[order], best_scores[order])]
+
+def semantic_search(reference_text, search_folder, top_k=50):
+    embedder = get_text_embedder()
+    store = EmbeddingStore.for_folder(search_folder, embedder)
+    return store.query(embedder.embed([reference_text])[0], top_k)
+
+def make_char_vectorizer():
+    return HashingVectorizer(analyzer='char_wb', ngram_range=CHAR_NGRAM_RANGE, n_features=CHAR_NGRAM_FEATURES,
+                             alternate_sign=False, norm=None, lowercase=False)
+
+def char_ngram_matrix(vectorizer, cleaned_texts):
+    matrix = vectorizer.transform(cleaned_texts)
+    matrix.data = 1.0 + np.log(matrix.data)
+    return normalize(matrix)
+
+# IDF z dwóch dokumentów jak w calculate_text_similarity (smooth_idf): słowo w obu -> 1, w jednym -> ln(3/2) + 1
+PAIRWISE_IDF_SINGLE = np.log(1.5) + 1.0
+
+def pairwise_tfidf_scores(reference_texts, candidate_texts):
+    # Te same wyniki co calculate_text_similarity dla każdej pary (bez limitu max_features), ale dla całej
+    # macierzy wzorce x kandydaci naraz: waga słowa zależy tylko od tego, czy występuje w obu tekstach,
+    # więc iloczyn i normy sprowadzają się do kilku iloczynów macierzy rzadkich
+    cleaned = [normalize_text(text) for text in list(reference_texts) + list(candidate_texts)]
+    try:
+        # Słownik dokładny (nie haszowany) - kolizja zrobiłaby z dwóch różnych słów słowo wspólne
+        counts = CountVectorizer(ngram_range=(1, 2), lowercase=True).fit_transform(cleaned).astype(np.float64)
+    except ValueError:
+        return np.zeros((len(reference_texts), len(candidate_texts)))
+    refs, cands = counts[:len(reference_texts)], counts[len(reference_texts):]
+    refs_sq, cands_sq = refs.multiply(refs), cands.multiply(cands)
+    refs_bin, cands_bin = (refs > 0).astype(np.float64), (cands > 0).astype(np.float64)
+    
+    single_sq = PAIRWISE_IDF_SINGLE ** 2
+    dot = (refs @ cands.T).toarray()
+    refs_norm = single_sq * np.asarray(refs_sq.sum(axis=1)) - (single_sq - 1.0) * (refs_sq @ cands_bin.T).toarray()
+    cands_norm = single_sq * np.asarray(cands_sq.sum(axis=1)).T - (single_sq - 1.0) * (refs_bin @ cands_sq.T).toarray()
+    denominator = np.sqrt(np.maximum(refs_norm, 0.0) * np.maximum(cands_norm, 0.0))
+    with np.errstate(divide='ignore', invalid='ignore'):
+        scores = np.where(denominator > 0, dot / denominator, 0.0)
+    return np.clip(scores, 0.0, 1.0)
+
+def vectorize_corpus(texts, mode='tfidf'):
+    # Wiersze znormalizowane L2 - podobieństwa wszystkich par to jeden iloczyn macierzy
+    if mode == 'semantic':
+        return get_text_embedder().embed(texts)
+    cleaned = [normalize_text(text) for text in texts]
+    if mode == 'tfidf':
+        return TfidfVectorizer(ngram_range=(1, 2), min_df=1, lowercase=True).fit_transform(cleaned)
+    return char_ngram_matrix(make_char_vectorizer(), cleaned)
+
+class SimilarityScorer:
+    # Referencja jest wektoryzowana raz; kandydaci są oceniani partiami jednym iloczynem macierzy rzadkich
+    def __init__(self, reference_text, mode='tfidf', threshold=None, rerank_top_k=FUZZY_RERANK_TOP_K):
+        self.mode = mode if mode in SIMILARITY_MODES else 'tfidf'
+        self.threshold = SIMILARITY_THRESHOLDS[self.mode] if threshold is None else threshold
+        self.reference_text = reference_text
+        self.reference_clean = normalize_text(reference_text)
+        self.vectorizer = None
+        self.embedder = None
+        self.rerank_top_k = rerank_top_k
+        self._rerank = {}
+        if self.mode == 'semantic':
+            self.embedder = get_text_embedder()
+            self.reference_vector = self.embedder.embed([reference_text])[0]
+        elif self.mode != 'tfidf':
+            if SKLEARN_AVAILABLE:
+                self.vectorizer = make_char_vectorizer()
+                self.reference_vector = self._vectorize([self.reference_clean])
+            else:
+                self.reference_vector = _char_ngram_counts(self.reference_clean)
+    
+    def _vectorize(self, cleaned_texts):
+        return char_ngram_matrix(self.vectorizer, cleaned_texts)
+    
+    def char_scores(self, cleaned_texts):
+        if self.vectorizer is not None:
+            return np.asarray((self._vectorize(cleaned_texts) @ self.reference_vector.T).todense()).ravel()
+        return np.array([_sparse_cosine(self.reference_vector, _char_ngram_counts(t)) for t in cleaned_texts])
+    
+    def embed(self, texts):
+        return self.embedder.embed(texts)
+    
+    def score_vectors(self, vectors):
+        return np.clip(vectors @ self.reference_vector, 0.0, 1.0)
+    
+    def score_batch(self, texts, keys=None):
+        # W trybie fuzzy zwraca wyniki n-gramowe; z kluczami zapamiętuje k najlepszych do rerank()
+        if self.mode == 'semantic':
+            return self.score_vectors(self.embed(texts))
+        if self.mode == 'tfidf':
+            if SKLEARN_AVAILABLE:
+                return pairwise_tfidf_scores([self.reference_text], texts)[0]
+            return np.array([calculate_text_similarity(self.reference_text, text) for text in texts])
+        
+        cleaned = [normalize_text(text) for text in texts]
+        scores = np.clip(self.char_scores(cleaned), 0.0, 1.0)
+        if self.mode == 'fuzzy' and keys is not None:
+            # Ponownie oceniony klucz (np. po weryfikacji modelami best) zastępuje poprzedni wpis
+            for key, text, clean, score in zip(keys, texts, cleaned, scores.tolist()):
+                self._rerank.pop(key, None)
+                if len(self._rerank) >= self.rerank_top_k:
+                    weakest = min(self._rerank, key=lambda k: self._rerank[k][0])
+                    if self._rerank[weakest][0] >= score:
+                        continue
+                    del self._rerank[weakest]
+                self._rerank[key] = (score, text, clean)
+        return scores
+    
+    def rerank(self):
+        # Odległość edycyjna tylko dla k najlepszych według n-gramów; zastępuje (także obniża) ich wynik.
+        # {klucz: (wynik, tekst)}
+        candidates, self._rerank = self._rerank, {}
+        return {key: (edit_similarity(self.reference_clean, clean), text)
+                for key, (_, text, clean) in candidates.items()}
+
+SUPPORTED_FORMATS = ('.png', '.jpg', '.jpeg', '.bmp', '.tiff', '.gif')
+
+def compute_file_hash(path, limit=None, chunk_size=1 << 20):
+    hasher = hashlib.blake2b(digest_size=16)
+    remaining = limit
+    with open(path, 'rb') as f:
+        while remaining is None or remaining > 0:
+            chunk = f.read(chunk_size if remaining is None else min(chunk_size, remaining))
+            if not chunk:
+                break
+            hasher.update(chunk)
+            if remaining is not None:
+                remaining -= len(chunk)
+    return hasher.hexdigest()
+
+def compute_perceptual_hash(image_path, hash_size=16):
+    img = cv2.imread(image_path, cv2.IMREAD_GRAYSCALE)
+    if img is None:
+        return None
+    thumb = cv2.resize(img, (hash_size + 1, hash_size), interpolation=cv2.INTER_AREA)
+    diff = thumb[:, 1:] > thumb[:, :-1]
+    return np.packbits(diff).tobytes()
+
+def compute_pixel_hash(image_path):
+    # Skrót zdekodowanych pikseli - ten sam obraz w innym pliku (inne metadane, kompresja bezstratna)
+    img = cv2.imread(image_path, cv2.IMREAD_UNCHANGED)
+    if img is None:
+        return None
+    return image_digest(img)
+
+def _split_by_key(groups, key_func):
+    result = []
+    for group in groups:
+        if len(group) < 2:
+            result.append(group)
+            continue
+        buckets = {}
+        for path in group:
+            try:
+                key = key_func(path)
+            except OSError:
+                key = ('error', path)
+            buckets.setdefault(key, []).append(path)
+        result.extend(buckets.values())
+    return result
+
+def deduplicate_image_files(image_files, perceptual=False):
+    # Rozmiar -> hash początku pliku -> hash całego pliku; hashujemy tylko pliki o wspólnym rozmiarze
+    by_size = {}
+    for path in image_files:
+        try:
+            size = os.path.getsize(path)
+        except OSError:
+            size = ('error', path)
+        by_size.setdefault(size, []).append(path)
+
+    groups = _split_by_key(by_size.values(), lambda p: compute_file_hash(p, limit=64 * 1024))
+    groups = _split_by_key(groups, compute_file_hash)
+
+    if perceptual:
+        # dHash wskazuje tylko kandydatów (np. faktury różniące się numerem mają ten sam hash);
+        # scalane są wyłącznie grupy o identycznych pikselach po dekodowaniu
+        by_phash = {}
+        merged = []
+        for group in groups:
+            phash = compute_perceptual_hash(group[0])
+            if phash is None:
+                merged.append(group)
+            else:
+                by_phash.setdefault(phash, []).append(group)
+        for candidates in by_phash.values():
+            if len(candidates) == 1:
+                merged.append(candidates[0])
+                continue
+            by_pixels = {}
+            for group in candidates:
+                pixels = compute_pixel_hash(group[0])
+                by_pixels.setdefault(pixels if pixels is not None else ('error', group[0]), []).extend(group)
+            merged.extend(by_pixels.values())
+        groups = merged
+
+    order = {path: i for i, path in enumerate(image_files)}
+    unique = {}
+    for group in sorted(groups, key=lambda g: min(order[p] for p in g)):
+        group = sorted(group, key=order.get)
+        unique[group[0]] = group[1:]
+    return unique
+
+def list_image_files(search_folder, exclude_path=None):
+    image_files = []
+    for file in os.listdir(search_folder):
+        if file.lower().endswith(SUPPORTED_FORMATS):
+            full_path = os.path.join(search_folder, file)
+            if exclude_path is None or os.path.abspath(full_path) != os.path.abspath(exclude_path):
+                image_files.append(full_path)
+    return image_files
+
+VISUAL_THUMB_SIZE = 64
+VISUAL_HASH_SIZE = 16
+VISUAL_INK_BANDS = 8
+
+def load_visual_thumbnail(image_path):
+    # Dekodowanie w zmniejszonej rozdzielczości - dla JPEG znacznie szybsze niż pełny odczyt
+    img = cv2.imread(image_path, cv2.IMREAD_REDUCED_GRAYSCALE_4)
+    if img is None:
+        img = cv2.imread(image_path, cv2.IMREAD_GRAYSCALE)
+    if img is None or img.size == 0:
+        return None, None
+    h, w = img.shape[:2]
+    thumb = cv2.resize(img, (VISUAL_THUMB_SIZE, VISUAL_THUMB_SIZE), interpolation=cv2.INTER_AREA)
+    return thumb, w / h
+
+def compute_visual_signatures(thumbs, aspects):
+    arr = np.asarray(thumbs, dtype=np.float32) / 255.0
+    n = arr.shape[0]
+    cell = VISUAL_THUMB_SIZE // VISUAL_HASH_SIZE
+    pooled = arr.reshape(n, VISUAL_HASH_SIZE, cell, VISUAL_HASH_SIZE, cell).mean(axis=(2, 4))
+    hash_bits = (pooled > pooled.mean(axis=(1, 2), keepdims=True)).reshape(n, -1)
+
+    mean = arr.mean(axis=(1, 2), keepdims=True)
+    std = arr.std(axis=(1, 2), keepdims=True)
+    ink = arr < (mean - 0.5 * std)
+    band = VISUAL_THUMB_SIZE // VISUAL_INK_BANDS
+    row_density = ink.reshape(n, VISUAL_INK_BANDS, band * VISUAL_THUMB_SIZE).mean(axis=2)
+    col_density = ink.reshape(n, VISUAL_THUMB_SIZE, VISUAL_INK_BANDS, band).mean(axis=(1, 3))
+
+    return {
+        'hash': hash_bits,
+        'log_aspect': np.log(np.asarray(aspects, dtype=np.float32)),
+        'ink': np.concatenate([row_density, col_density], axis=1)
+    }
+
+def visual_distances(reference_signature, signatures):
+    hash_dist = (signatures['hash'] != reference_signature['hash'][0]).mean(axis=1)
+    aspect_dist = np.minimum(np.abs(signatures['log_aspect'] - reference_signature['log_aspect'][0]) / np.log(2), 1.0)
+    ink_dist = np.minimum(np.abs(signatures['ink'] - reference_signature['ink'][0]).mean(axis=1) * 4, 1.0)
+    return 0.5 * hash_dist + 0.25 * aspect_dist + 0.25 * ink_dist
+
+def visual_prefilter(reference_image_path, image_files, max_distance=0.35):
+    ref_thumb, ref_aspect = load_visual_thumbnail(reference_image_path)
+    if ref_thumb is None:
+        return list(image_files), {}
+
+    thumbs, aspects, loaded = [], [], []
+    unreadable = []
+    for path in image_files:
+        thumb, aspect = load_visual_thumbnail(path)
+        if thumb is None:
+            unreadable.append(path)
+        else:
+            thumbs.append(thumb)
+            aspects.append(aspect)
+            loaded.append(path)
+
+    if not loaded:
+        return unreadable, {}
+
+    reference_signature = compute_visual_signatures([ref_thumb], [ref_aspect])
+    distances = visual_distances(reference_signature, compute_visual_signatures(thumbs, aspects))
+
+    keep = set(np.asarray(loaded)[distances <= max_distance]) | set(unreadable)
+    kept = [path for path in image_files if path in keep]
+    return kept, dict(zip(loaded, distances.tolist()))
+
+class SimilarityResult:
+    __slots__ = ('path', 'filename', 'similarity', 'text')
+    
+    def __init__(self, path, similarity, text):
+        self.path = path
+        self.filename = os.path.basename(path)
+        self.similarity = similarity
+        self.text = text
+    
+    def to_dict(self):
+        return {'path': self.path, 'filename': self.filename, 'similarity': self.similarity, 'text': self.text}
+
+RESULT_FIELDS = SimilarityResult.__slots__
+
+class JsonlResultWriter:
+    def __init__(self, path, metadata=None):
+        self.count = 0
+        self.file = open(path, 'w', encoding='utf-8')
+        if metadata:
+            self.file.write(json.dumps({'metadata': metadata}, ensure_ascii=False) + "\n")
+    
+    def write(self, result):
+        self.file.write(json.dumps(result.to_dict(), ensure_ascii=False) + "\n")
+        self.count += 1
+    
+    def close(self):
+        self.file.close()
+    
+    def __enter__(self):
+        return self
+    
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+class CsvResultWriter(JsonlResultWriter):
+    def __init__(self, path, metadata=None):
+        self.count = 0
+        self.file = open(path, 'w', encoding='utf-8', newline='')
+        self.writer = csv.writer(self.file)
+        self.writer.writerow(RESULT_FIELDS)
+    
+    def write(self, result):
+        self.writer.writerow([getattr(result, field) for field in RESULT_FIELDS])
+        self.count += 1
+
+class JsonResultWriter(JsonlResultWriter):
+    # Ten sam format co dawny eksport json.dump, ale zapisywany rekord po rekordzie
+    def __init__(self, path, metadata=None):
+        self.count = 0
+        self.file = open(path, 'w', encoding='utf-8')
+        header = json.dumps(metadata or {}, ensure_ascii=False, indent=2)[:-1].rstrip()
+        self.file.write(header + (',' if metadata else '') + '\n  "results": [')
+    
+    def write(self, result):
+        self.file.write((',' if self.count else '') + '\n    ' + json.dumps(result.to_dict(), ensure_ascii=False))
+        self.count += 1
+    
+    def close(self):
+        if not self.file.closed:
+            self.file.write('\n  ]\n}\n')
+            self.file.close()
+
+RESULT_WRITERS = {'.jsonl': JsonlResultWriter, '.csv': CsvResultWriter, '.json': JsonResultWriter}
+
+def open_result_writer(path, metadata=None):
+    writer_class = RESULT_WRITERS.get(os.path.splitext(path)[1].lower(), JsonResultWriter)
+    return writer_class(path, metadata)
+
+def write_results(path, results, metadata=None):
+    with open_result_writer(path, metadata) as writer:
+        for result in results:
+            writer.write(result)
+        return writer.count
+
+class MatchAssignment(SimilarityResult):
+    __slots__ = ('reference',)
+    
+    def __init__(self, path, similarity, text, reference):
+        super().__init__(path, similarity, text)
+        self.reference = reference
+    
+    def to_dict(self):
+        data = super().to_dict()
+        data['reference'] = self.reference
+        return data
+
+def similarity_matrix(reference_texts, candidate_texts, mode='tfidf', rerank_top_k=FUZZY_RERANK_TOP_K):
+    # Te same wyniki co SimilarityScorer w wyszukiwaniu pojedynczym, więc ten sam próg daje te same dopasowania
+    if mode not in SIMILARITY_MODES:
+        raise ValueError(f"Nieznany tryb podobieństwa: {mode}")
+    if mode == 'tfidf' and SKLEARN_AVAILABLE:
+        return pairwise_tfidf_scores(reference_texts, candidate_texts).astype(np.float32)
+    if (mode != 'tfidf' and SKLEARN_AVAILABLE) or mode == 'semantic':
+        # N-gramy znakowe (haszowane) i embeddingi nie zależą od korpusu - jeden iloczyn dla wszystkich par
+        matrix = vectorize_corpus(list(reference_texts) + list(candidate_texts),
+                                  'semantic' if mode == 'semantic' else 'char')
+        refs, cands = matrix[:len(reference_texts)], matrix[len(reference_texts):]
+        product = refs @ cands.T
+        scores = product.toarray() if hasattr(product, 'toarray') else np.asarray(product)
+        scores = np.clip(scores.astype(np.float32), 0.0, 1.0)
+    else:
+        scores = np.array([SimilarityScorer(ref, mode).score_batch(candidate_texts) for ref in reference_texts],
+                          dtype=np.float32)
+    if mode == 'fuzzy' and scores.size:
+        # Jak SimilarityScorer.rerank(): odległość edycyjna dla k najlepszych kandydatów każdego wzorca
+        cleaned_candidates = {}
+        k = min(rerank_top_k, scores.shape[1])
+        for r, reference_text in enumerate(reference_texts):
+            reference_clean = normalize_text(reference_text)
+            for c in np.argpartition(-scores[r], k - 1)[:k]:
+                if c not in cleaned_candidates:
+                    cleaned_candidates[c] = normalize_text(candidate_texts[c])
+                scores[r, c] = edit_similarity(reference_clean, cleaned_candidates[c])
+    return scores
+
+def find_similar_images_multi(reference_image_paths, search_folder, similarity_threshold=None, lang="pol+eng",
+                              top_k=10, similarity_mode='tfidf', deduplicate=True, deskew=False, stats=None):
+    if stats is None:
+        stats = {}
+    start_time = time.time()
+    # Metryki przebiegu zapisywane także przy wcześniejszym zakończeniu (błąd, brak tekstu, pusty folder)
+    try:
+        return _find_similar_images_multi(reference_image_paths, search_folder, similarity_threshold, lang,
+                                          top_k, similarity_mode, deduplicate, deskew, stats)
+    finally:
+        stats['elapsed'] = time.time() - start_time
+        record_run_metrics(stats, 'search_multi')
+
+def _find_similar_images_multi(reference_image_paths, search_folder, similarity_threshold, lang, top_k,
+                               similarity_mode, deduplicate, deskew, stats):
+    if similarity_mode not in SIMILARITY_MODES:
+        return {}, [], f"Nieznany tryb podobieństwa: {similarity_mode}"
+    if similarity_threshold is None:
+        similarity_threshold = SIMILARITY_THRESHOLDS[similarity_mode]
+    try:
+        validate_languages(lang)
+    except ValueError as e:
+        return {}, [], str(e)
+    except Exception as e:
+        log.warning("⚠️ Nie można sprawdzić dostępnych języków: %s", e)
+    
+    references = []
+    for path in reference_image_paths:
+        log.info("Analizuję obraz referencyjny: %s", path)
+        text = extract_text_from_image(path, lang, deskew)
+        if text.strip():
+            references.append((path, text))
+        else:
+            log.warning("  ⚠️ Brak tekstu we wzorcu %s - pomijam", path)
+    
+    if not references:
+        return {}, [], "Nie znaleziono tekstu w żadnym obrazie referencyjnym"
+    
+    reference_set = {os.path.abspath(path) for path in reference_image_paths}
+    try:
+        image_files = [p for p in list_image_files(search_folder) if os.path.abspath(p) not in reference_set]
+    except Exception as e:
+        return {}, [], f"Błąd odczytu folderu: {e}"
+    
+    if not image_files:
+        return {}, [], "Nie znaleziono obrazów w folderze"
+    
+    duplicate_groups = deduplicate_image_files(image_files) if deduplicate else {p: [] for p in image_files}
+    stats['total_files'] = len(image_files)
+    stats['duplicates_skipped'] = len(image_files) - len(duplicate_groups)
+    stats['references'] = len(references)
+    stats['ocr_runs'] = len(references)
+    stats['ocr_fallbacks'] = 0
+    
+    # Folder jest czytany jednokrotnie niezależnie od liczby wzorców, w tej samej puli co wyszukiwanie pojedyncze
+    texts = {}
+    quarantine = []
+    autoscaler = OCRAutoscaler.from_environment()
+    log.info("⚙️ Ustawienia OCR: %s", autoscaler.describe())
+    
+    def collect(future, img_path):
+        try:
+            text, strategy = future.result()
+        except OCRFailure as e:
+            quarantine.append({'path': img_path, 'attempts': e.attempts})
+            log.warning("  🚫 %s: kwarantanna (%s)", img_path, e,
+                        extra={'fields': {'event': 'quarantined', 'path': img_path}})
+            return
+        except Exception as e:
+            log.error("  ❌ Błąd: %s", e, extra={'fields': {'event': 'ocr_error', 'path': img_path}})
+            return
+        stats['ocr_runs'] += 1
+        if strategy != OCR_STRATEGIES[0]:
+            stats['ocr_fallbacks'] += 1
+        if text.strip():
+            texts[img_path] = text
+        else:
+            log.debug("  ⚠️ Brak tekstu: %s", img_path)
+    
+    with ThreadPoolExecutor(max_workers=autoscaler.max_workers, initializer=batch_tesseract_env) as executor:
+        in_flight = {}
+        for i, img_path in enumerate(duplicate_groups, 1):
+            log.debug("Analizuję %d/%d: %s", i, len(duplicate_groups), img_path)
+            while len(in_flight) >= autoscaler.workers:
+                done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+                for future in done:
+                    collect(future, in_flight.pop(future))
+                    autoscaler.completed()
+                    OCR_QUEUE_DEPTH.set(len(in_flight))
+            in_flight[executor.submit(ocr_image_file, img_path, lang, deskew)] = img_path
+            OCR_QUEUE_DEPTH.set(len(in_flight))
+        while in_flight:
+            done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+            for future in done:
+                collect(future, in_flight.pop(future))
+                autoscaler.completed()
+                OCR_QUEUE_DEPTH.set(len(in_flight))
+    
+    stats['ocr_workers'] = autoscaler.workers
+    stats['ocr_workers_history'] = autoscaler.history
+    if quarantine:
+        stats['quarantined'] = len(quarantine)
+        try:
+            stats['quarantine_report'] = write_quarantine_report(quarantine, search_folder)
+            log.warning("🚫 Raport kwarantanny: %s", stats['quarantine_report'])
+        except OSError as e:
+            log.warning("⚠️ Nie można zapisać raportu kwarantanny: %s", e)
+    
+    # Kolejność kandydatów jak w folderze, niezależnie od kolejności ukończenia OCR
+    candidates = [(img_path, texts[img_path]) for img_path in duplicate_groups if img_path in texts]
+    index_ocr_texts(references + [(path, text) for img_path, text in candidates
+                                  for path in [img_path] + duplicate_groups[img_path]])
+    
+    if not candidates:
+        return {path: [] for path, _ in references}, [], ""
+    
+    scores = similarity_matrix([t for _, t in references], [t for _, t in candidates], similarity_mode)
+    previews = [t[:200] + "..." if len(t) > 200 else t for _, t in candidates]
+    
+    per_reference = {}
+    for r, (ref_path, _) in enumerate(references):
+        row = scores[r]
+        k = min(top_k, len(row))
+        top = np.argpartition(-row, k - 1)[:k]
+        top = top[np.argsort(-row[top])]
+        per_reference[ref_path] = [SimilarityResult(candidates[c][0], float(row[c]), previews[c])
+                                   for c in top if row[c] >= similarity_threshold]
+    
+    best_refs = scores.argmax(axis=0)
+    best_scores = scores[best_refs, np.arange(scores.shape[1])]
+    assignments = []
+    for c, (img_path, _) in enumerate(candidates):
+        if best_scores[c] >= similarity_threshold:
+            for path in [img_path] + duplicate_groups[img_path]:
+                assignments.append(MatchAssignment(path, float(best_scores[c]), previews[c],
+                                                   references[best_refs[c]][0]))
+    assignments.sort(key=lambda x: x.similarity, reverse=True)
+    return per_reference, assignments, ""
+
+TEXT_INDEX_PATH = os.path.join(os.path.expanduser('~'), '.ocr_tesseract', 'text_index.db')
+TEXT_SEARCH_LIMIT = 100
+SEARCH_SNIPPET_CHARS = 160
+FTS_QUERY_PATTERN = re.compile(r'"([^"]*)"|(\S+)')
+FOLD_EXTRA = {'ł': 'l', 'Ł': 'l', 'ß': 's', 'ø': 'o', 'Ø': 'o', 'đ': 'd', 'Đ': 'd'}
+
+class _FoldTable(dict):
+    # Znak -> pojedynczy znak bez diakrytyków, małą literą; długość tekstu się nie zmienia,
+    # więc pozycje w tekście złożonym odpowiadają pozycjom w oryginale
+    def __missing__(self, code):
+        char = chr(code)
+        folded = FOLD_EXTRA.get(char)
+        if folded is None:
+            decomposed = unicodedata.normalize('NFD', char)
+            base = decomposed[0] if all(unicodedata.combining(c) for c in decomposed[1:]) else char
+            lower = base.lower()
+            folded = lower if len(lower) == 1 else base
+        self[code] = folded
+        return folded
+
+_fold_table = _FoldTable()
+
+def fold_text(text):
+    return text.translate(_fold_table)
+
+def build_fts_query(query):
+    # Słowa -> wszystkie muszą wystąpić, "cudzysłów" -> fraza, gwiazdka na końcu -> prefiks
+    clauses = []
+    for phrase, term in FTS_QUERY_PATTERN.findall(query):
+        prefix = not phrase and term.endswith('*')
+        tokens = re.findall(r'\w+', fold_text(phrase or term))
+        if tokens:
+            clause = '"' + ' '.join(tokens) + '"'
+            clauses.append(clause + '*' if prefix else clause)
+    return ' '.join(clauses)
+
+def make_snippet(text, query, width=SEARCH_SNIPPET_CHARS):
+    folded = fold_text(text)
+    positions = [folded.find(token) for token in re.findall(r'\w+', fold_text(query))]
+    positions = [p for p in positions if p >= 0]
+    start = max(0, min(positions) - width // 3) if positions else 0
+    snippet = " ".join(text[start:start + width].split())
+    return ("..." if start else "") + snippet + ("..." if start + width < len(text) else "")
+
+class TextIndex:
+    # Tekst OCR w SQLite; FTS5 bez własnej kopii treści (content='') indeksuje tekst po fold_text()
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS documents (
+            id INTEGER PRIMARY KEY,
+            path TEXT UNIQUE NOT NULL,
+            folder TEXT NOT NULL,
+            mtime_ns INTEGER NOT NULL,
+            size INTEGER NOT NULL,
+            text TEXT NOT NULL
+        );
+        CREATE INDEX IF NOT EXISTS documents_folder ON documents(folder);
+        CREATE VIRTUAL TABLE IF NOT EXISTS documents_fts USING fts5(
+            text, content='', prefix='2 3', tokenize='unicode61 remove_diacritics 2'
+        );
+    """
+    
+    def __init__(self, path=TEXT_INDEX_PATH):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        self.path = path
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self._lock = threading.Lock()
+        with self._lock, self.conn:
+            self.conn.execute("PRAGMA journal_mode=WAL")
+            self.conn.executescript(self.SCHEMA)
+    
+    def __len__(self):
+        with self._lock:
+            return self.conn.execute("SELECT COUNT(*) FROM documents").fetchone()[0]
+    
+    def is_current(self, path):
+        path = os.path.abspath(path)
+        with self._lock:
+            row = self.conn.execute("SELECT mtime_ns, size FROM documents WHERE path = ?", (path,)).fetchone()
+        if row is None:
+            return False
+        try:
+            stat = os.stat(path)
+        except OSError:
+            return False
+        return tuple(row) == (stat.st_mtime_ns, stat.st_size)
+    
+    def add_many(self, entries):
+        rows = []
+        for path, text in entries:
+            stat = os.stat(path)
+            path = os.path.abspath(path)
+            rows.append((path, os.path.dirname(path), stat.st_mtime_ns, stat.st_size, text))
+        
+        with self._lock, self.conn:
+            for path, folder, mtime_ns, size, text in rows:
+                old = self.conn.execute("SELECT id, text FROM documents WHERE path = ?", (path,)).fetchone()
+                if old is not None:
+                    doc_id = old[0]
+                    self.conn.execute("INSERT INTO documents_fts(documents_fts, rowid, text) VALUES('delete', ?, ?)",
+                                      (doc_id, fold_text(old[1])))
+                    self.conn.execute("UPDATE documents SET mtime_ns = ?, size = ?, text = ? WHERE id = ?",
+                                      (mtime_ns, size, text, doc_id))
+                else:
+                    doc_id = self.conn.execute(
+                        "INSERT INTO documents(path, folder, mtime_ns, size, text) VALUES (?, ?, ?, ?, ?)",
+                        (path, folder, mtime_ns, size, text)).lastrowid
+                self.conn.execute("INSERT INTO documents_fts(rowid, text) VALUES (?, ?)", (doc_id, fold_text(text)))
+    
+    def texts(self, paths):
+        if not paths:
+            return {}
+        with self._lock:
+            return {path: text for path, text in self.conn.execute(
+                f"SELECT path, text FROM documents WHERE path IN ({','.join('?' * len(paths))})", list(paths))}
+    
+    def search(self, query, folder=None, limit=TEXT_SEARCH_LIMIT):
+        # Wyniki jako SimilarityResult; trafność bm25 znormalizowana do najlepszego wyniku (= 1.0)
+        fts_query = build_fts_query(query)
+        if not fts_query:
+            return []
+        
+        sql = ("SELECT d.path, d.text, bm25(documents_fts) AS score FROM documents_fts "
+               "JOIN documents d ON d.id = documents_fts.rowid WHERE documents_fts MATCH ?")
+        params = [fts_query]
+        if folder is not None:
+            sql += " AND d.folder = ?"
+            params.append(os.path.abspath(folder))
+        sql += " ORDER BY score LIMIT ?"
+        params.append(limit)
+        
+        with self._lock:
+            rows = self.conn.execute(sql, params).fetchall()
+        if not rows:
+            return []
+        best = -rows[0][2] or 1.0
+        return [SimilarityResult(path, -score / best, make_snippet(text, query)) for path, text, score in rows]
+    
+    def close(self):
+        with self._lock:
+            self.conn.close()
+
+_text_index = None
+_text_index_lock = threading.Lock()
+
+def get_text_index():
+    global _text_index
+    with _text_index_lock:
+        if _text_index is None:
+            _text_index = TextIndex()
+        return _text_index
+
+def index_ocr_texts(entries):
+    # Indeks pełnotekstowy jest dodatkiem - jego błąd nie może przerwać wyszukiwania
+    try:
+        get_text_index().add_many(entries)
+    except (sqlite3.Error, OSError) as e:
+        log.warning("⚠️ Nie można zapisać tekstu w indeksie: %s", e)
+
+def search_text_index(query, folder=None, limit=TEXT_SEARCH_LIMIT):
+    start = time.perf_counter()
+    results = get_text_index().search(query, folder, limit)
+    return results, time.perf_counter() - start
+
+def index_folder(search_folder, lang="pol+eng", deskew=False, stats=None, on_progress=None):
+    # OCR tylko plików nowych lub zmienionych od ostatniego indeksowania
+    if stats is None:
+        stats = {}
+    start_time = time.time()
+    validate_languages(lang)
+    index = get_text_index()
+    
+    image_files = list_image_files(search_folder)
+    todo = [path for path in image_files if not index.is_current(path)]
+    stats['total_files'] = len(image_files)
+    stats['already_indexed'] = len(image_files) - len(todo)
+    stats['ocr_runs'] = 0
+    stats['quarantined'] = 0
+    log.info("🔤 Indeksowanie: %d/%d plików wymaga OCR", len(todo), len(image_files))
+    
+    batch = []
+    autoscaler = OCRAutoscaler.from_environment()
+    log.info("⚙️ Ustawienia OCR: %s", autoscaler.describe())
+    
+    def collect(future, img_path):
+        try:
+            text, _ = future.result()
+        except OCRFailure as e:
+            stats['quarantined'] += 1
+            log.warning("  🚫 %s: %s", img_path, e,
+                        extra={'fields': {'event': 'quarantined', 'path': img_path}})
+            return
+        stats['ocr_runs'] += 1
+        batch.append((img_path, text))
+        if len(batch) >= SCORE_BATCH_SIZE:
+            index.add_many(batch)
+            batch.clear()
+        if on_progress is not None:
+            on_progress(stats['ocr_runs'] + stats['quarantined'], len(todo))
+    
+    with ThreadPoolExecutor(max_workers=autoscaler.max_workers, initializer=batch_tesseract_env) as executor:
+        in_flight = {}
+        for img_path in todo:
+            while len(in_flight) >= autoscaler.workers:
+                done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+                for future in done:
+                    collect(future, in_flight.pop(future))
+                    autoscaler.completed()
+                    OCR_QUEUE_DEPTH.set(len(in_flight))
+            in_flight[executor.submit(ocr_image_file, img_path, lang, deskew)] = img_path
+            OCR_QUEUE_DEPTH.set(len(in_flight))
+        while in_flight:
+            done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+            for future in done:
+                collect(future, in_flight.pop(future))
+                autoscaler.completed()
+                OCR_QUEUE_DEPTH.set(len(in_flight))
+    
+    if batch:
+        index.add_many(batch)
+    stats['indexed_documents'] = len(index)
+    stats['elapsed'] = time.time() - start_time
+    record_run_metrics(stats, 'index')
+    return stats
+
+TFIDF_INDEX_DIR = os.path.join(os.path.expanduser('~'), '.ocr_tesseract', 'tfidf_index')
+TFIDF_HASH_FEATURES = 2 ** 21
+TFIDF_SHARD_SIZE = 50_000
+TFIDF_SHARD_CACHE_BYTES = int(float(os.environ.get('TFIDF_CACHE_MB', '1024')) * 1024 * 1024)
+
+def make_word_vectorizer():
+    # Odpowiednik TfidfVectorizer(ngram_range=(1, 2)) bez słownika - działa niezależnie w każdym procesie
+    return HashingVectorizer(ngram_range=(1, 2), n_features=TFIDF_HASH_FEATURES, alternate_sign=False,
+                             norm=None, lowercase=True, dtype=np.float32)
+
+def _count_tfidf_shard(db_path, first_id, last_id, counts_path, paths_path):
+    # Proces roboczy: liczności n-gramów jednego zakresu dokumentów i ich częstości dokumentowe (DF)
+    conn = sqlite3.connect(f"file:{db_path}?mode=ro", uri=True)
+    try:
+        rows = conn.execute("SELECT path, text FROM documents WHERE id >= ? AND id <= ? ORDER BY id",
+                            (first_id, last_id)).fetchall()
+    finally:
+        conn.close()
+    
+    counts = make_word_vectorizer().transform(normalize_text(text) for _, text in rows).tocsr()
+    sparse.save_npz(counts_path, counts)
+    with open(paths_path, 'w', encoding='utf-8') as f:
+        json.dump([path for path, _ in rows], f, ensure_ascii=False)
+    return len(rows), np.bincount(counts.indices, minlength=TFIDF_HASH_FEATURES).astype(np.int32)
+
+def _weight_tfidf_shard(counts_path, idf_path, shard_path):
+    # Proces roboczy: tf * idf z globalnych DF i normalizacja L2 wierszy
+    matrix = sparse.load_npz(counts_path).tocsr()
+    idf = np.load(idf_path)
+    matrix.data *= idf[matrix.indices]
+    sparse.save_npz(shard_path, normalize(matrix).astype(np.float32))
+    os.remove(counts_path)
+    return shard_path
+
+def build_sharded_index(db_path=TEXT_INDEX_PATH, directory=TFIDF_INDEX_DIR, shard_size=TFIDF_SHARD_SIZE,
+                        workers=None, on_progress=None):
+    # Dwie fazy w procesach: (1) liczności i DF każdego fragmentu, (2) po scaleniu DF - wagi tf-idf;
+    # indeks budowany obok i podmieniany na końcu, więc zapytania do starego działają w trakcie budowy
+    if not SKLEARN_AVAILABLE:
+        raise RuntimeError("Indeks TF-IDF wymaga scikit-learn")
+    start_time = time.time()
+    workers = workers or max(1, os.cpu_count() or 1)
+    
+    conn = sqlite3.connect(f"file:{db_path}?mode=ro", uri=True)
+    try:
+        ids = [row[0] for row in conn.execute("SELECT id FROM documents ORDER BY id")]
+    finally:
+        conn.close()
+    if not ids:
+        raise ValueError("Indeks tekstu jest pusty - najpierw zindeksuj folder")
+    ranges = [(ids[i], ids[min(i + shard_size, len(ids)) - 1]) for i in range(0, len(ids), shard_size)]
+    
+    building = directory + '.building'
+    shutil.rmtree(building, ignore_errors=True)
+    os.makedirs(building)
+    names = [f"shard-{i:05d}" for i in range(len(ranges))]
+    log.info("🧮 Budowa indeksu TF-IDF: %d dokumentów, %d fragmentów, procesy: %d", len(ids), len(ranges), workers)
+    
+    df = np.zeros(TFIDF_HASH_FEATURES, np.int64)
+    shard_docs = {}
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        futures = {executor.submit(_count_tfidf_shard, db_path, first_id, last_id,
+                                   os.path.join(building, f"{name}.counts.npz"),
+                                   os.path.join(building, f"{name}.json")): name
+                   for name, (first_id, last_id) in zip(names, ranges)}
+        for done, future in enumerate(as_completed(futures), 1):
+            docs, shard_df = future.result()
+            shard_docs[futures[future]] = docs
+            df += shard_df
+            if on_progress is not None:
+                on_progress(done, 2 * len(names))
+        
+        # Wygładzone IDF jak w TfidfVectorizer: ln((1 + N) / (1 + df)) + 1
+        idf = (np.log((1 + len(ids)) / (1 + df)) + 1).astype(np.float32)
+        idf_path = os.path.join(building, 'idf.npy')
+        np.save(idf_path, idf)
+        
+        futures = [executor.submit(_weight_tfidf_shard, os.path.join(building, f"{name}.counts.npz"), idf_path,
+                                   os.path.join(building, f"{name}.npz")) for name in names]
+        for done, future in enumerate(as_completed(futures), len(names) + 1):
+            future.result()
+            if on_progress is not None:
+                on_progress(done, 2 * len(names))
+    
+    manifest = {
+        'documents': len(ids),
+        'features': TFIDF_HASH_FEATURES,
+        'shards': [{'name': name, 'documents': shard_docs[name]} for name in names],
+        'source': os.path.abspath(db_path),
+        'built': time.strftime('%Y-%m-%d %H:%M:%S'),
+    }
+    with open(os.path.join(building, 'manifest.json'), 'w', encoding='utf-8') as f:
+        json.dump(manifest, f, ensure_ascii=False, indent=2)
+    
+    previous = directory + '.old'
+    shutil.rmtree(previous, ignore_errors=True)
+    if os.path.exists(directory):
+        os.replace(directory, previous)
+    os.replace(building, directory)
+    shutil.rmtree(previous, ignore_errors=True)
+    
+    elapsed = time.time() - start_time
+    SEARCH_SECONDS.observe(elapsed, operation='build_tfidf_index')
+    log.info("✅ Indeks TF-IDF gotowy: %d dokumentów w %d fragmentach (%.1fs)", len(ids), len(names), elapsed)
+    return manifest
+
+class ShardedTfidfIndex:
+    # Zapytanie trafia równolegle do wszystkich fragmentów; każdy zwraca swoje top-k, wyniki są scalane
+    def __init__(self, directory=TFIDF_INDEX_DIR, cache_bytes=TFIDF_SHARD_CACHE_BYTES):
+        self.directory = directory
+        with open(os.path.join(directory, 'manifest.json'), 'r', encoding='utf-8') as f:
+            self.manifest = json.load(f)
+        self.idf = np.load(os.path.join(directory, 'idf.npy'))
+        self.vectorizer = make_word_vectorizer()
+        self.shards = ByteBudgetLRU(cache_bytes)
+    
+    def __len__(self):
+        return self.manifest['documents']
+    
+    def _load_shard(self, name):
+        shard = self.shards.get(name)
+        if shard is None:
+            matrix = sparse.load_npz(os.path.join(self.directory, f"{name}.npz")).tocsr()
+            with open(os.path.join(self.directory, f"{name}.json"), 'r', encoding='utf-8') as f:
+                paths = json.load(f)
+            shard = (matrix, paths)
+            nbytes = matrix.data.nbytes + matrix.indices.nbytes + matrix.indptr.nbytes + 100 * len(paths)
+            self.shards.put(name, shard, nbytes)
+        return shard
+    
+    def vectorize(self, text):
+        vector = self.vectorizer.transform([normalize_text(text)]).tocsr()
+        vector.data *= self.idf[vector.indices]
+        return normalize(vector)
+    
+    def _query_shard(self, name, vector, top_k):
+        matrix, paths = self._load_shard(name)
+        scores = np.asarray((matrix @ vector.T).todense()).ravel()
+        if scores.size == 0:
+            return []
+        k = min(top_k, scores.size)
+        top = np.argpartition(-scores, k - 1)[:k]
+        return [(float(scores[i]), paths[i]) for i in top if scores[i] > 0]
+    
+    def query(self, text, top_k=10, workers=None):
+        vector = self.vectorize(text)
+        names = [shard['name'] for shard in self.manifest['shards']]
+        with ThreadPoolExecutor(max_workers=workers or min(len(names), os.cpu_count() or 1)) as executor:
+            partial = executor.map(lambda name: self._query_shard(name, vector, top_k), names)
+            best = heapq.nlargest(top_k, (hit for hits in partial for hit in hits))
+        return [(path, score) for score, path in best]
+
+def search_similar_in_index(reference_text, top_k=10, directory=TFIDF_INDEX_DIR):
+    # Wyniki jako SimilarityResult z podglądem tekstu z indeksu pełnotekstowego
+    start = time.perf_counter()
+    hits = ShardedTfidfIndex(directory).query(reference_text, top_k)
+    texts = get_text_index().texts([path for path, _ in hits])
+    results = []
+    for path, score in hits:
+        text = texts.get(path, "")
+        results.append(SimilarityResult(path, score, text[:200] + "..." if len(text) > 200 else text))
+    return results, time.perf_counter() - start
+
+FORM_TEMPLATES_PATH = os.path.join(os.path.expanduser('~'), '.ocr_tesseract', 'form_templates.json')
+FORM_MAX_DISTANCE = 0.25
+FORM_HEADER_BOX = (0.0, 0.0, 1.0, 0.2)
+FORM_MIN_KEYWORD_SHARE = 0.5
+FORM_FIELD_PADDING = 0.01
+
+# Typ pola -> (psm, dozwolone znaki); psm 7 = pojedyncza linia
+FORM_FIELD_TYPES = {
+    'text': (6, None),
+    'line': (7, None),
+    'number': (7, "0123456789/-"),
+    'date': (7, "0123456789.-/"),
+    'amount': (7, "0123456789,.-"),
+}
+
+class FormField:
+    # Obszar pola we współrzędnych względnych strony (0-1), więc szablon nie zależy od rozdzielczości skanu
+    __slots__ = ('name', 'box', 'kind')
+    
+    def __init__(self, name, box, kind='line'):
+        if kind not in FORM_FIELD_TYPES:
+            raise ValueError(f"Nieznany typ pola '{kind}' (dostępne: {', '.join(FORM_FIELD_TYPES)})")
+        self.name = name
+        self.box = tuple(float(v) for v in box)
+        self.kind = kind
+    
+    def variables(self):
+        whitelist = FORM_FIELD_TYPES[self.kind][1]
+        return {'tessedit_char_whitelist': whitelist} if whitelist else {}
+    
+    def config(self, options=""):
+        # Zmienne bez cudzysłowów (lub w pliku konfiguracyjnym) - patrz tesseract_config
+        psm = FORM_FIELD_TYPES[self.kind][0]
+        return tesseract_config(f"--oem 1 --psm {psm}{options}", self.variables())
+    
+    def to_dict(self):
+        return {'name': self.name, 'box': list(self.box), 'kind': self.kind}
+
+def relative_box(box, width, height):
+    # Współrzędne w pikselach wzorca (dowolna wartość > 1) są przeliczane na względne
+    x0, y0, x1, y1 = box
+    if max(box) > 1:
+        x0, x1 = x0 / width, x1 / width
+        y0, y1 = y0 / height, y1 / height
+    return min(x0, x1), min(y0, y1), max(x0, x1), max(y0, y1)
+
+def crop_relative(gray, box, padding=0.0):
+    height, width = gray.shape[:2]
+    x0, y0, x1, y1 = box
+    left = int(max(0.0, x0 - padding) * width)
+    top = int(max(0.0, y0 - padding) * height)
+    right = int(min(1.0, x1 + padding) * width)
+    bottom = int(min(1.0, y1 + padding) * height)
+    return gray[top:bottom, left:right]
+
+def visual_signature_from_gray(gray):
+    thumb = cv2.resize(gray, (VISUAL_THUMB_SIZE, VISUAL_THUMB_SIZE), interpolation=cv2.INTER_AREA)
+    return compute_visual_signatures([thumb], [gray.shape[1] / gray.shape[0]])
+
+class FormTemplate:
+    def __init__(self, name, fields, signature=None, keywords=(), header_box=FORM_HEADER_BOX):
+        self.name = name
+        self.fields = list(fields)
+        self.signature = signature
+        self.keywords = [fold_text(k) for k in keywords]
+        self.header_box = tuple(header_box)
+    
+    @classmethod
+    def from_image(cls, name, image_path, fields, keywords=(), deskew=False):
+        gray = read_grayscale(image_path)
+        if deskew:
+            gray = correct_page_geometry(gray, image_path)
+        height, width = gray.shape
+        fields = [FormField(field.name, relative_box(field.box, width, height), field.kind) for field in fields]
+        return cls(name, fields, visual_signature_from_gray(gray), keywords)
+    
+    def to_dict(self):
+        data = {'name': self.name, 'fields': [field.to_dict() for field in self.fields],
+                'keywords': self.keywords, 'header_box': list(self.header_box)}
+        if self.signature is not None:
+            data['signature'] = {
+                'hash': np.packbits(self.signature['hash'][0]).tobytes().hex(),
+                'log_aspect': float(self.signature['log_aspect'][0]),
+                'ink': self.signature['ink'][0].tolist(),
+            }
+        return data
+    
+    @classmethod
+    def from_dict(cls, data):
+        signature = None
+        if data.get('signature'):
+            bits = np.unpackbits(np.frombuffer(bytes.fromhex(data['signature']['hash']), dtype=np.uint8))
+            signature = {
+                'hash': bits[:VISUAL_HASH_SIZE * VISUAL_HASH_SIZE].astype(bool)[None, :],
+                'log_aspect': np.array([data['signature']['log_aspect']], dtype=np.float32),
+                'ink': np.array([data['signature']['ink']], dtype=np.float32),
+            }
+        fields = [FormField(f['name'], f['box'], f.get('kind', 'line')) for f in data['fields']]
+        return cls(data['name'], fields, signature, data.get('keywords', ()),
+                   data.get('header_box', FORM_HEADER_BOX))
+
+def load_form_templates(path=FORM_TEMPLATES_PATH):
+    if not os.path.exists(path):
+        return []
+    with open(path, 'r', encoding='utf-8') as f:
+        return [FormTemplate.from_dict(data) for data in json.load(f)]
+
+def save_form_templates(templates, path=FORM_TEMPLATES_PATH):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    temp_path = path + '.tmp'
+    with open(temp_path, 'w', encoding='utf-8') as f:
+        json.dump([template.to_dict() for template in templates], f, ensure_ascii=False, indent=2)
+    os.replace(temp_path, path)
+
+def register_form_template(template, path=FORM_TEMPLATES_PATH):
+    templates = [t for t in load_form_templates(path) if t.name != template.name]
+    templates.append(template)
+    save_form_templates(templates, path)
+    return templates
+
+class FormClassifier:
+    # Najpierw sygnatura wizualna (miniatura 64x64, bez OCR); słowa kluczowe z OCR samego nagłówka
+    # tylko gdy sygnatura nie rozstrzyga
+    def __init__(self, templates, max_distance=FORM_MAX_DISTANCE):
+        self.templates = list(templates)
+        self.max_distance = max_distance
+        self.visual = [t for t in self.templates if t.signature is not None]
+        if self.visual:
+            self.signatures = {key: np.concatenate([t.signature[key] for t in self.visual])
+                               for key in ('hash', 'log_aspect', 'ink')}
+    
+    def classify(self, gray, lang):
+        # Zwraca (szablon, metoda, liczba pikseli przekazanych do OCR)
+        if self.visual:
+            distances = visual_distances(visual_signature_from_gray(gray), self.signatures)
+            order = np.argsort(distances)
+            best = distances[order[0]]
+            runner_up = distances[order[1]] if len(order) > 1 else 1.0
+            # Dwa szablony prawie równie bliskie - sygnatura nie rozstrzyga
+            if best <= self.max_distance and runner_up - best > 0.02:
+                return self.visual[order[0]], 'signature', 0
+        
+        keyword_templates = [t for t in self.templates if t.keywords]
+        if not keyword_templates:
+            return None, None, 0
+        
+        header_boxes = {t.header_box for t in keyword_templates}
+        header_texts = {}
+        pixels = 0
+        for box in header_boxes:
+            crop = crop_relative(gray, box)
+            pixels += crop.size
+            header_texts[box] = fold_text(pytesseract.image_to_string(
+                ImageBuffer(crop).to_pil(), lang=lang, config=BATCH_OCR_CONFIG, timeout=OCR_RETRY_TIMEOUT))
+        
+        best, best_share = None, 0.0
+        for template in keyword_templates:
+            text = header_texts[template.header_box]
+            share = sum(keyword in text for keyword in template.keywords) / len(template.keywords)
+            if share > best_share:
+                best, best_share = template, share
+        if best_share >= FORM_MIN_KEYWORD_SHARE:
+            return best, 'keywords', pixels
+        return None, None, pixels
+
+def ocr_form_field(gray, field, lang, tier=None):
+    crop = crop_relative(gray, field.box, FORM_FIELD_PADDING)
+    if crop.size == 0:
+        return "", 0
+    height, width = crop.shape
+    crop = cv2.resize(crop, (width * BATCH_OCR_SCALE, height * BATCH_OCR_SCALE), interpolation=cv2.INTER_CUBIC)
+    text = pytesseract.image_to_string(ImageBuffer(crop).to_pil(), lang=lang,
+                                       config=field.config(tier_config(tier, lang)), timeout=OCR_RETRY_TIMEOUT)
+    return " ".join(text.split()), width * height
+
+def extract_form(image_path, classifier, executor, lang="pol+eng", deskew=False, tier=VERIFY_TIER):
+    # Rekord z polami szablonu; OCR tylko wycinków pól, równolegle w puli wątków
+    gray = read_grayscale(image_path)
+    if deskew:
+        gray = correct_page_geometry(gray, image_path)
+    if lang == AUTO_LANG:
+        lang = resolve_image_language(image_path, gray)
+    
+    template, method, pixels = classifier.classify(gray, lang)
+    record = {'path': image_path, 'template': template.name if template else None, 'classified_by': method,
+              'fields': {}, 'ocr_pixels': pixels, 'page_pixels': gray.size}
+    if template is None:
+        return record
+    
+    futures = {executor.submit(ocr_form_field, gray, field, lang, tier): field.name for field in template.fields}
+    for future in as_completed(futures):
+        try:
+            text, field_pixels = future.result()
+        except Exception as e:
+            log.warning("  ⚠️ %s: pole '%s' nieczytelne (%s)", image_path, futures[future], e)
+            text, field_pixels = None, 0
+        record['fields'][futures[future]] = text
+        record['ocr_pixels'] += field_pixels
+    # Kolejność pól jak w szablonie, niezależnie od kolejności zakończenia OCR
+    record['fields'] = {field.name: record['fields'][field.name] for field in template.fields}
+    return record
+
+def write_form_records(path, records):
+    if os.path.splitext(path)[1].lower() == '.csv':
+        names = list(dict.fromkeys(name for record in records for name in record['fields']))
+        with open(path, 'w', encoding='utf-8-sig', newline='') as f:
+            writer = csv.writer(f)
+            writer.writerow(['path', 'template'] + names)
+            for record in records:
+                writer.writerow([record['path'], record['template']] + [record['fields'].get(n) or "" for n in names])
+        return len(records)
+    with open(path, 'w', encoding='utf-8') as f:
+        for record in records:
+            f.write(json.dumps(record, ensure_ascii=False) + "\n")
+    return len(records)
+
+def extract_forms(search_folder, lang="pol+eng", deskew=False, templates=None, stats=None, on_progress=None):
+    if stats is None:
+        stats = {}
+    start_time = time.time()
+    templates = load_form_templates() if templates is None else templates
+    if not templates:
+        raise ValueError("Brak zarejestrowanych szablonów formularzy")
+    validate_languages(lang)
+    
+    classifier = FormClassifier(templates)
+    image_files = list_image_files(search_folder)
+    stats['total_files'] = len(image_files)
+    stats['forms'] = 0
+    stats['unclassified'] = 0
+    ocr_pixels = page_pixels = 0
+    records = []
+    
+    autoscaler = OCRAutoscaler.from_environment()
+    with ThreadPoolExecutor(max_workers=autoscaler.workers, initializer=batch_tesseract_env) as executor:
+        for i, img_path in enumerate(image_files, 1):
+            log.debug("Analizuję %d/%d: %s", i, len(image_files), img_path)
+            try:
+                record = extract_form(img_path, classifier, executor, lang, deskew)
+            except Exception as e:
+                log.warning("  🚫 %s: %s", img_path, e, extra={'fields': {'event': 'form_failed', 'path': img_path}})
+                stats['quarantined'] = stats.get('quarantined', 0) + 1
+                continue
+            ocr_pixels += record['ocr_pixels']
+            page_pixels += record['page_pixels']
+            if record['template'] is None:
+                stats['unclassified'] += 1
+            else:
+                stats['forms'] += 1
+                records.append(record)
+            if on_progress is not None:
+                on_progress(i, len(image_files))
+    
+    stats['ocr_pixel_share'] = ocr_pixels / page_pixels if page_pixels else 0.0
+    stats['elapsed'] = time.time() - start_time
+    record_run_metrics(stats, 'forms')
+    return records
+
+CHECKPOINTS_DIR = os.path.join(os.path.expanduser('~'), '.ocr_tesseract', 'checkpoints')
+CHECKPOINT_INTERVAL = 64
+CHECKPOINT_SECONDS = 10.0
+
+def text_digest(text):
+    return hashlib.blake2b(text.encode('utf-8'), digest_size=8).hexdigest()
+
+class SearchJournal:
+    # Dziennik postępu w JSONL, tylko dopisywany: nagłówek zadania, potem partie [plik, mtime, rozmiar, hash tekstu, wynik]
+    def __init__(self, path, job, threshold, resume=True):
+        self.path = path
+        self.job = job
+        self.folder = job['folder']
+        self.threshold = threshold
+        self.done = {}
+        self.hits = {}
+        self.pending_files = []
+        self.pending_hits = {}
+        self.last_flush = time.time()
+        
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        if resume:
+            self._load()
+        if self.done:
+            self.file = open(path, 'a', encoding='utf-8')
+        else:
+            self.file = open(path, 'w', encoding='utf-8')
+            self.file.write(json.dumps({'job': job}, ensure_ascii=False) + "\n")
+            self.file.flush()
+    
+    @classmethod
+    def for_search(cls, reference_image_path, search_folder, lang, mode, threshold, deskew, resume=True):
+        stat = os.stat(reference_image_path)
+        job = {
+            'reference': os.path.abspath(reference_image_path),
+            'reference_mtime': stat.st_mtime_ns,
+            'reference_size': stat.st_size,
+            'folder': os.path.abspath(search_folder),
+            'lang': lang,
+            'mode': mode,
+            'threshold': round(threshold, 4),
+            'deskew': bool(deskew),
+        }
+        key = hashlib.blake2b(json.dumps(job, sort_keys=True).encode('utf-8'), digest_size=8).hexdigest()
+        return cls(os.path.join(CHECKPOINTS_DIR, f"{key}.jsonl"), job, threshold, resume)
+    
+    def _load(self):
+        try:
+            with open(self.path, 'rb') as f:
+                raw = f.read()
+        except OSError:
+            return
+        
+        valid_bytes = 0
+        for line in raw.splitlines(keepends=True):
+            # Ostatnia linia mogła zostać przerwana w połowie zapisu - odrzucamy ją wraz z resztą pliku
+            if not line.endswith(b"\n"):
+                break
+            try:
+                entry = json.loads(line)
+            except ValueError:
+                break
+            if valid_bytes == 0:
+                if entry.get('job') != self.job:
+                    return
+            else:
+                for name, mtime_ns, size, text_hash, similarity in entry.get('files', []):
+                    self.done[name] = (mtime_ns, size, text_hash, similarity)
+                self.hits.update(entry.get('hits', {}))
+            valid_bytes += len(line)
+        
+        if self.done and valid_bytes < len(raw):
+            with open(self.path, 'r+b') as f:
+                f.truncate(valid_bytes)
+    
+    def __len__(self):
+        return len(self.done)
+    
+    def lookup(self, path):
+        name = os.path.relpath(path, self.folder)
+        entry = self.done.get(name)
+        if entry is None:
+            return None
+        try:
+            stat = os.stat(path)
+        except OSError:
+            return None
+        mtime_ns, size, _, similarity = entry
+        if (mtime_ns, size) != (stat.st_mtime_ns, stat.st_size):
+            return None
+        return similarity, self.hits.get(name, "")
+    
+    def record(self, path, text_hash, similarity, preview=""):
+        stat = os.stat(path)
+        name = os.path.relpath(path, self.folder)
+        similarity = round(similarity, 4)
+        self.pending_files.append([name, stat.st_mtime_ns, stat.st_size, text_hash, similarity])
+        if similarity >= self.threshold:
+            self.pending_hits[name] = preview
+        if len(self.pending_files) >= CHECKPOINT_INTERVAL or time.time() - self.last_flush >= CHECKPOINT_SECONDS:
+            self.flush()
+    
+    def flush(self):
+        if self.pending_files:
+            entry = {'files': self.pending_files}
+            if self.pending_hits:
+                entry['hits'] = self.pending_hits
+            self.file.write(json.dumps(entry, ensure_ascii=False, separators=(',', ':')) + "\n")
+            self.file.flush()
+            self.pending_files = []
+            self.pending_hits = {}
+        self.last_flush = time.time()
+    
+    def close(self):
+        if not self.file.closed:
+            self.flush()
+            self.file.close()
+    
+    def complete(self):
+        # Zakończone zadanie nie potrzebuje punktu kontrolnego
+        self.file.close()
+        try:
+            os.remove(self.path)
+        except OSError:
+            pass
+
+def format_run_summary(stats):
+    parts = []
+    if 'total_files' in stats:
+        parts.append(f"📁 Plików: {stats['total_files']}")
+    if 'references' in stats:
+        parts.append(f"📎 Wzorców: {stats['references']}")
+    if 'ocr_runs' in stats:
+        parts.append(f"🔍 OCR: {stats['ocr_runs']}")
+    if stats.get('resumed'):
+        parts.append(f"♻️ Wznowiono: {stats['resumed']}")
+    if stats.get('already_indexed'):
+        parts.append(f"🔤 Już w indeksie: {stats['already_indexed']}")
+    if stats.get('embedding_cache_hits'):
+        parts.append(f"🧠 Wektory z pamięci: {stats['embedding_cache_hits']}")
+    if 'ocr_workers' in stats:
+        parts.append(f"🧵 Wątki OCR: {stats['ocr_workers']}")
+    if stats.get('verified'):
+        parts.append(f"🎯 Zweryfikowane ({VERIFY_TIER}): {stats['verified']}")
+    if stats.get('fuzzy_reranked'):
+        parts.append(f"✏️ Odległość edycyjna: {stats['fuzzy_reranked']}")
+    if stats.get('ocr_fallbacks'):
+        parts.append(f"🪶 Tryb awaryjny: {stats['ocr_fallbacks']}")
+    if stats.get('quarantined'):
+        parts.append(f"🚫 Kwarantanna: {stats['quarantined']}")
+    if 'forms' in stats:
+        parts.append(f"📋 Formularze: {stats['forms']} (nierozpoznane: {stats['unclassified']}, "
+                     f"OCR {stats['ocr_pixel_share']:.0%} pikseli)")
+    if stats.get('duplicates_skipped'):
+        parts.append(f"🧬 Pominięte duplikaty: {stats['duplicates_skipped']}")
+    if 'prefilter_rejected' in stats:
+        parts.append(f"👁️ Odrzucone wizualnie: {stats['prefilter_rejected']}/{stats['prefilter_candidates']}")
+    if 'elapsed' in stats:
+        parts.append(f"⏱️ {stats['elapsed']:.1f}s")
+    return " | ".join(parts)
+
+def verify_screened(scorer, screened, duplicate_groups, similar_images, similarity_threshold, lang, deskew,
+                    workers, stats):
+    # Najlepsi kandydaci z przesiewu (także tuż pod progiem) rozpoznawani ponownie modelami best;
+    # ich wyniki zastępują wyniki przesiewu, pozostałe zostają bez zmian
+    verify = heapq.nlargest(VERIFY_TOP_K, screened, key=screened.get)
+    texts = {}
+    with ThreadPoolExecutor(max_workers=workers, initializer=batch_tesseract_env) as executor:
+        futures = {executor.submit(ocr_image_file, path, lang, deskew, tier=VERIFY_TIER): path for path in verify}
+        for future in as_completed(futures):
+            try:
+                text, strategy = future.result()
+            except OCRFailure as e:
+                log.warning("  ⚠️ %s: weryfikacja nieudana, zostaje wynik przesiewu (%s)", futures[future], e)
+                continue
+            # Przebiegi weryfikacji liczone tak samo jak przesiewu
+            stats['ocr_runs'] += 1
+            if strategy != OCR_STRATEGIES[0]:
+                stats['ocr_fallbacks'] += 1
+            if text.strip():
+                texts[futures[future]] = text
+    if not texts:
+        return
+    
+    paths = list(texts)
+    scores = scorer.score_batch([texts[path] for path in paths], keys=paths)
+    index_ocr_texts([(path, texts[img_path]) for img_path in paths for path in [img_path] + duplicate_groups[img_path]])
+    
+    for img_path, similarity in zip(paths, scores.tolist()):
+        log.debug("  🎯 %s: podobieństwo %.2f%% → %.2f%%", img_path, screened[img_path] * 100, similarity * 100)
+    rescore_results(similar_images, duplicate_groups,
+                    {img_path: (similarity, texts[img_path]) for img_path, similarity in zip(paths, scores.tolist())},
+                    similarity_threshold)
+    stats['verified'] = len(paths)
+
+def rescore_results(similar_images, duplicate_groups, rescored, similarity_threshold):
+    # rescored: {ścieżka: (wynik, tekst)}; nowe wyniki tych plików i ich duplikatów zastępują dotychczasowe
+    replaced = {path for img_path in rescored for path in [img_path] + duplicate_groups[img_path]}
+    similar_images[:] = [result for result in similar_images if result.path not in replaced]
+    for img_path, (similarity, text) in rescored.items():
+        if similarity >= similarity_threshold:
+            preview = text[:200] + "..." if len(text) > 200 else text
+            similar_images.extend(SimilarityResult(path, similarity, preview)
+                                  for path in [img_path] + duplicate_groups[img_path])
+
+def find_similar_images(reference_image_path, search_folder, similarity_threshold=None, lang="pol+eng",
+                        deduplicate=True, perceptual_dedup=False, visual_prefilter_distance=None, stats=None,
+                        layout_stream=None, on_result=None, deskew=False, similarity_mode='tfidf', resume=True):
+    if stats is None:
+        stats = {}
+    start_time = time.time()
+    if similarity_threshold is None:
+        similarity_threshold = SIMILARITY_THRESHOLDS.get(similarity_mode, SIMILARITY_THRESHOLDS['tfidf'])
+    # Metryki przebiegu zapisywane także przy wcześniejszym zakończeniu (błąd, brak tekstu, pusty folder)
+    try:
+        return _find_similar_images(reference_image_path, search_folder, similarity_threshold, lang, deduplicate,
+                                    perceptual_dedup, visual_prefilter_distance, stats, layout_stream, on_result,
+                                    deskew, similarity_mode, resume)
+    finally:
+        stats['elapsed'] = time.time() - start_time
+        record_run_metrics(stats, 'search')
+
+def _find_similar_images(reference_image_path, search_folder, similarity_threshold, lang, deduplicate,
+                         perceptual_dedup, visual_prefilter_distance, stats, layout_stream, on_result, deskew,
+                         similarity_mode, resume):
+    try:
+        validate_languages(lang)
+    except ValueError as e:
+        return [], str(e)
+    except Exception as e:
+        log.warning("⚠️ Nie można sprawdzić dostępnych języków: %s", e)
+
+    log.info("Analizuję obraz referencyjny: %s", reference_image_path)
+    reference_text = extract_text_from_image(reference_image_path, lang, deskew, tier=VERIFY_TIER)
+    
+    if not reference_text.strip():
+        return [], "Nie znaleziono tekstu w obrazie referencyjnym"
+    
+    log.debug("Tekst referencyjny: %s...", reference_text[:100])
+    index_ocr_texts([(reference_image_path, reference_text)])
+    
+    try:
+        image_files = list_image_files(search_folder, exclude_path=reference_image_path)
+    except Exception as e:
+        return [], f"Błąd odczytu folderu: {e}"
+    
+    if not image_files:
+        return [], "Nie znaleziono obrazów w folderze"
+    
+    log.info("Znaleziono %d obrazów do analizy", len(image_files))
+
+    if deduplicate:
+        duplicate_groups = deduplicate_image_files(image_files, perceptual=perceptual_dedup)
+    else:
+        duplicate_groups = {path: [] for path in image_files}
+
+    stats['total_files'] = len(image_files)
+    stats['unique_files'] = len(duplicate_groups)
+    stats['duplicates_skipped'] = len(image_files) - len(duplicate_groups)
+    stats['ocr_runs'] = 0
+
+    if stats['duplicates_skipped']:
+        log.info("🧬 Duplikaty: %d plików pominiętych w OCR", stats['duplicates_skipped'])
+
+    unique_files = list(duplicate_groups)
+
+    if visual_prefilter_distance is not None:
+        candidates = len(unique_files)
+        unique_files, _ = visual_prefilter(reference_image_path, unique_files, visual_prefilter_distance)
+        stats['prefilter_candidates'] = candidates
+        stats['prefilter_rejected'] = candidates - len(unique_files)
+        log.info("👁️ Filtr wizualny: %d/%d kandydatów przechodzi do OCR", len(unique_files), candidates)
+    
+    similar_images = []
+    scorer = SimilarityScorer(reference_text, similarity_mode, similarity_threshold)
+    pending = []
+    cached_rows = []
+    
+    # W trybie semantycznym wektory są zapamiętywane per folder - niezmienione pliki nie wymagają ponownego OCR
+    store = None
+    if scorer.embedder is not None and layout_stream is None:
+        store = EmbeddingStore.for_folder(search_folder, scorer.embedder)
+        stats['embedding_cache_hits'] = 0
+    
+    # Plik układu tekstu jest zapisywany od nowa, więc wznowienie pominęłoby część stron
+    journal = None
+    if layout_stream is None:
+        try:
+            journal = SearchJournal.for_search(reference_image_path, search_folder, lang, similarity_mode,
+                                               similarity_threshold, deskew, resume)
+            stats['resumed'] = 0
+            if len(journal):
+                log.info("♻️ Wznawiam przerwane wyszukiwanie: %d plików z punktu kontrolnego", len(journal))
+        except OSError as e:
+            log.warning("⚠️ Nie można utworzyć punktu kontrolnego: %s", e)
+    
+    # Przesiew tańszymi modelami fast; eksport układu tekstu zawsze korzysta z pełnych modeli
+    screen_tier = None
+    if layout_stream is None and tier_tessdata(SCREEN_TIER, lang) is not None:
+        screen_tier = SCREEN_TIER
+        stats['screen_tier'] = SCREEN_TIER
+        log.info("🏎️ Przesiew modelami %s, weryfikacja %d najlepszych modelami %s",
+                 SCREEN_TIER, VERIFY_TOP_K, VERIFY_TIER)
+    screened = {}
+    
+    def emit(img_path, preview, similarity):
+        if screen_tier is not None and similarity >= similarity_threshold - VERIFY_MARGIN:
+            screened[img_path] = similarity
+        if similarity >= similarity_threshold:
+            for path in [img_path] + duplicate_groups[img_path]:
+                result = SimilarityResult(path, similarity, preview)
+                similar_images.append(result)
+                if on_result is not None:
+                    on_result(result)
+            log.debug("  ✅ %s: podobieństwo %.2f%%", img_path, similarity * 100)
+        else:
+            log.debug("  ❌ %s: podobieństwo %.2f%% (poniżej progu)", img_path, similarity * 100)
+    
+    def score_pending():
+        texts = [text for _, text in pending]
+        previews = [text[:200] + "..." if len(text) > 200 else text for text in texts]
+        if store is not None:
+            vectors = scorer.embed(texts)
+            scores = scorer.score_vectors(vectors)
+            for (img_path, _), vector, preview in zip(pending, vectors, previews):
+                store.add(img_path, vector, preview)
+        else:
+            scores = scorer.score_batch(texts, keys=[img_path for img_path, _ in pending])
+        index_ocr_texts([(path, text) for img_path, text in pending for path in [img_path] + duplicate_groups[img_path]])
+        for (img_path, text), preview, similarity in zip(pending, previews, scores.tolist()):
+            emit(img_path, preview, similarity)
+            if journal is not None:
+                journal.record(img_path, text_digest(text), similarity, preview)
+        pending.clear()
+    
+    def score_cached():
+        scores = scorer.score_vectors(store.vectors([row for _, row in cached_rows]))
+        for (img_path, row), similarity in zip(cached_rows, scores.tolist()):
+            preview = store.preview(row)
+            emit(img_path, preview, similarity)
+            if journal is not None:
+                journal.record(img_path, "", similarity, preview)
+        cached_rows.clear()
+    
+    def ocr_job(img_path):
+        if layout_stream is not None:
+            layout, strategy = ocr_image_file(img_path, lang, deskew, with_layout=True)
+            return layout, layout_text(layout), strategy
+        text, strategy = ocr_image_file(img_path, lang, deskew, tier=screen_tier)
+        return None, text, strategy
+    
+    def collect(future, img_path):
+        try:
+            layout, img_text, strategy = future.result()
+        except OCRFailure as e:
+            quarantine.append({'path': img_path, 'attempts': e.attempts})
+            log.warning("  🚫 %s: kwarantanna (%s)", img_path, e,
+                        extra={'fields': {'event': 'quarantined', 'path': img_path}})
+            return
+        except Exception as e:
+            log.error("  ❌ Błąd: %s", e, extra={'fields': {'event': 'ocr_error', 'path': img_path}})
+            return
+        
+        stats['ocr_runs'] += 1
+        if strategy != OCR_STRATEGIES[0]:
+            stats['ocr_fallbacks'] += 1
+        if layout and layout_stream is not None:
+            for path in [img_path] + duplicate_groups[img_path]:
+                layout_stream.write(layout, path)
+        
+        if img_text.strip():
+            pending.append((img_path, img_text))
+            if len(pending) >= SCORE_BATCH_SIZE:
+                score_pending()
+        else:
+            log.debug("  ⚠️ Brak tekstu: %s", img_path)
+            if journal is not None:
+                journal.record(img_path, "", 0.0)
+    
+    # OCR w puli wątków (tesseract działa w osobnych procesach); jeden wolny obraz zajmuje tylko jeden wątek,
+    # a limit czasu na obraz ogranicza, jak długo może go blokować
+    quarantine = []
+    stats['ocr_fallbacks'] = 0
+    autoscaler = OCRAutoscaler.from_environment()
+    log.info("⚙️ Ustawienia OCR: %s", autoscaler.describe())
+    try:
+        with ThreadPoolExecutor(max_workers=autoscaler.max_workers, initializer=batch_tesseract_env) as executor:
+            in_flight = {}
+            for i, img_path in enumerate(unique_files, 1):
+                log.debug("Analizuję %d/%d: %s", i, len(unique_files), img_path)
+                
+                if journal is not None:
+                    checkpoint = journal.lookup(img_path)
+                    if checkpoint is not None:
+                        stats['resumed'] += 1
+                        emit(img_path, checkpoint[1], checkpoint[0])
+                        continue
+                
+                if store is not None:
+                    row = store.lookup(img_path)
+                    if row is not None:
+                        stats['embedding_cache_hits'] += 1
+                        cached_rows.append((img_path, row))
+                        if len(cached_rows) >= SCORE_BATCH_SIZE:
+                            score_cached()
+                        continue
+                
+                while len(in_flight) >= autoscaler.workers:
+                    done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        collect(future, in_flight.pop(future))
+                        autoscaler.completed()
+                        OCR_QUEUE_DEPTH.set(len(in_flight))
+                in_flight[executor.submit(ocr_job, img_path)] = img_path
+                OCR_QUEUE_DEPTH.set(len(in_flight))
+            
+            while in_flight:
+                done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+                for future in done:
+                    collect(future, in_flight.pop(future))
+                    autoscaler.completed()
+                    OCR_QUEUE_DEPTH.set(len(in_flight))
+        
+        if pending:
+            score_pending()
+        if cached_rows:
+            score_cached()
+    finally:
+        if store is not None:
+            store.flush()
+        if journal is not None:
+            journal.close()
+    
+    if journal is not None:
+        journal.complete()
+    
+    stats['ocr_workers'] = autoscaler.workers
+    stats['ocr_workers_history'] = autoscaler.history
+    log.info("⚙️ Wątki OCR na koniec: %d (aby powtórzyć: OCR_WORKERS=%d OCR_TESSERACT_THREADS=%s)",
+             autoscaler.workers, autoscaler.workers, TESSERACT_THREADS)
+    
+    if screened:
+        verify_screened(scorer, screened, duplicate_groups, similar_images, similarity_threshold, lang, deskew,
+                        autoscaler.workers, stats)
+    
+    if scorer.mode == 'fuzzy':
+        reranked = scorer.rerank()
+        rescore_results(similar_images, duplicate_groups, reranked, similarity_threshold)
+        stats['fuzzy_reranked'] = len(reranked)
+    
+    if quarantine:
+        stats['quarantined'] = len(quarantine)
+        try:
+            stats['quarantine_report'] = write_quarantine_report(quarantine, search_folder)
+            log.warning("🚫 Raport kwarantanny: %s", stats['quarantine_report'])
+        except OSError as e:
+            log.warning("⚠️ Nie można zapisać raportu kwarantanny: %s", e)
+    
+    similar_images.sort(key=lambda x: x.similarity, reverse=True)
+    
+    return similar_images, ""
+
+
+setup_tesseract()
+
+class VirtualResultsView:
+    # Treeview zawiera tylko widoczne wiersze; iid wiersza to indeks rekordu w self.records
+    COLUMNS = ('Plik', 'Podobieństwo', 'Tekst')
+    
+    def __init__(self, parent, height=15):
+        self.records = []
+        self.view = []
+        self.view_keys = []
+        self.sort_column = 'Podobieństwo'
+        self.sort_reverse = True
+        self.min_similarity = 0.0
+        self.offset = 0
+        self.page_size = height
+        self._render_pending = False
+        
+        self.tree = ttk.Treeview(parent, columns=self.COLUMNS, show='headings', height=height)
+        
+        self.tree.heading('Plik', text='📄 Nazwa pliku', command=lambda: self.sort_by('Plik'))
+        self.tree.heading('Podobieństwo', text='🎯 Podobieństwo', command=lambda: self.sort_by('Podobieństwo'))
+        self.tree.heading('Tekst', text='📝 Fragment tekstu')
+        
+        self.tree.column('Plik', width=200)
+        self.tree.column('Podobieństwo', width=100, anchor='center')
+        self.tree.column('Tekst', width=400)
+        
+        self.scrollbar = ttk.Scrollbar(parent, orient=tk.VERTICAL, command=self.on_scroll)
+        
+        self.tree.pack(side=tk.LEFT, fill=tk.BOTH, expand=True)
+        self.scrollbar.pack(side=tk.RIGHT, fill=tk.Y)
+        
+        self.tree.bind('<MouseWheel>', lambda e: self.scroll_by(-1 if e.delta > 0 else 1, 'units'))
+        self.tree.bind('<Button-4>', lambda e: self.scroll_by(-1, 'units'))
+        self.tree.bind('<Button-5>', lambda e: self.scroll_by(1, 'units'))
+        self.tree.bind('<Prior>', lambda e: self.scroll_by(-1, 'pages'))
+        self.tree.bind('<Next>', lambda e: self.scroll_by(1, 'pages'))
+        self.tree.bind('<Configure>', self.on_resize)
+    
+    def _key(self, index):
+        record = self.records[index]
+        if self.sort_column == 'Plik':
+            return record.filename.lower()
+        return record.similarity
+    
+    def append(self, records):
+        for record in records:
+            index = len(self.records)
+            self.records.append(record)
+            if record.similarity >= self.min_similarity:
+                key = self._key(index)
+                position = bisect_right(self.view_keys, key)
+                self.view_keys.insert(position, key)
+                self.view.insert(position, index)
+        self.schedule_render()
+    
+    def refresh(self):
+        indices = [i for i, record in enumerate(self.records) if record.similarity >= self.min_similarity]
+        indices.sort(key=self._key)
+        self.view = indices
+        self.view_keys = [self._key(i) for i in indices]
+        self.offset = 0
+        self.schedule_render()
+    
+    def sort_by(self, column):
+        if column == self.sort_column:
+            self.sort_reverse = not self.sort_reverse
+        else:
+            self.sort_column = column
+            self.sort_reverse = column == 'Podobieństwo'
+        self.refresh()
+    
+    def set_min_similarity(self, value):
+        self.min_similarity = value
+        self.refresh()
+    
+    def record_at(self, position):
+        if self.sort_reverse:
+            return self.records[self.view[len(self.view) - 1 - position]]
+        return self.records[self.view[position]]
+    
+    def visible_records(self):
+        return [self.record_at(p) for p in range(len(self.view))]
+    
+    def selected_record(self):
+        selection = self.tree.selection()
+        return self.records[int(selection[0])] if selection else None
+    
+    def schedule_render(self):
+        if not self._render_pending:
+            self._render_pending = True
+            self.tree.after_idle(self.render)
+    
+    def render(self):
+        self._render_pending = False
+        total = len(self.view)
+        self.offset = max(0, min(self.offset, total - self.page_size))
+        selection = self.tree.selection()
+        
+        self.tree.delete(*self.tree.get_children())
+        for position in range(self.offset, min(self.offset + self.page_size, total)):
+            index = self.view[total - 1 - position] if self.sort_reverse else self.view[position]
+            record = self.records[index]
+            text_preview = record.text[:100] + "..." if len(record.text) > 100 else record.text
+            self.tree.insert('', 'end', iid=str(index), values=(
+                record.filename,
+                f"{record.similarity:.1%}",
+                text_preview
+            ), tags=('result',))
+        
+        visible_selection = [iid for iid in selection if self.tree.exists(iid)]
+        if visible_selection:
+            self.tree.selection_set(visible_selection)
+        
+        if total > self.page_size:
+            self.scrollbar.set(self.offset / total, (self.offset + self.page_size) / total)
+        else:
+            self.scrollbar.set(0.0, 1.0)
+    
+    def scroll_by(self, amount, what):
+        step = self.page_size if what.startswith('page') else 1
+        self.offset += int(amount) * step
+        self.render()
+    
+    def on_scroll(self, action, value, what=None):
+        if action == 'moveto':
+            self.offset = int(float(value) * len(self.view))
+            self.render()
+        else:
+            self.scroll_by(value, what)
+    
+    def on_resize(self, event):
+        row_height = ttk.Style().lookup('Treeview', 'rowheight') or 20
+        page_size = max(1, (event.height - 25) // int(row_height))
+        if page_size != self.page_size:
+            self.page_size = page_size
+            self.schedule_render()
 
 class OCRApp:
     def __init__(self, root):
@@ -241,8 +3779,14 @@ class OCRApp:
         self.setup_styles()
         
         self.current_image = None
+        self.current_image_digest = None
         self.processed_image = None
+        self.processed_transform = None
+        self.processed_image_digest = None
         self.original_image_path = None
+        self.last_layout = None
+        self.ocr_session = None
+        self.ocr_session_lock = threading.Lock()
         
         self.root.configure(bg=self.colors['light'])
         
@@ -348,7 +3892,7 @@ class OCRApp:
         
         self.lang_var = tk.StringVar(value="eng")
         lang_combo = ttk.Combobox(lang_frame, textvariable=self.lang_var, 
-                                 values=["🇺🇸 eng", "🇵🇱 pol", "deu", "🌍 pol+eng", "🌍 pol+deu", "🌍 eng+deu", "🌍 pol+eng+deu"], 
+                                 values=["🔮 auto", "🇺🇸 eng", "🇵🇱 pol", "deu", "🌍 pol+eng", "🌍 pol+deu", "🌍 eng+deu", "🌍 pol+eng+deu"], 
                                  state="readonly", width=25, font=('Segoe UI', 10))
         lang_combo.pack(fill=tk.X)
         
@@ -425,6 +3969,10 @@ class OCRApp:
                                        width=30, font=('Segoe UI', 9))
         processing_combo.pack(fill=tk.X)
         
+        self.deskew_var = tk.BooleanVar(value=False)
+        ttk.Checkbutton(method_frame, text="📐 Automatyczne prostowanie i orientacja",
+                       variable=self.deskew_var).pack(anchor=tk.W, pady=(10, 0))
+        
         advanced_frame = ttk.Frame(settings_notebook, style='Modern.TFrame', padding="15")
         settings_notebook.add(advanced_frame, text="🔧 Zaawansowane")
 
@@ -446,6 +3994,10 @@ class OCRApp:
                                       variable=self.auto_invert_var, style='Modern.TCheckbutton')
         invert_check.pack(anchor=tk.W, pady=5)
         
+        self.refine_var = tk.BooleanVar(value=True)
+        ttk.Checkbutton(options_frame, text="🎯 Popraw fragmenty o niskiej pewności",
+                       variable=self.refine_var, style='Modern.TCheckbutton').pack(anchor=tk.W, pady=5)
+        
         action_frame = ttk.LabelFrame(advanced_frame, text="🎬 Akcje", style='Card.TLabelframe', padding="15")
         action_frame.pack(fill=tk.X)
 
@@ -460,6 +4012,14 @@ class OCRApp:
                   command=self.run_ocr).grid(row=1, column=0, columnspan=2, sticky=(tk.W, tk.E), pady=(5, 2))
         ttk.Button(btn_frame, text="🔎 Znajdź podobne", style='Primary.TButton',
                   command=self.find_similar_images_dialog).grid(row=2, column=0, columnspan=2, sticky=(tk.W, tk.E), pady=(5, 2))
+        ttk.Button(btn_frame, text="📎 Porównaj z wieloma wzorcami", style='Primary.TButton',
+                  command=self.find_similar_multi_dialog).grid(row=3, column=0, columnspan=2, sticky=(tk.W, tk.E), pady=(5, 2))
+        ttk.Button(btn_frame, text="🔤 Szukaj w tekście dokumentów", style='Primary.TButton',
+                  command=self.text_search_dialog).grid(row=4, column=0, columnspan=2, sticky=(tk.W, tk.E), pady=(5, 2))
+        ttk.Button(btn_frame, text="🗂️ Eksportuj układ tekstu", style='Secondary.TButton',
+                  command=self.export_layout).grid(row=5, column=0, columnspan=2, sticky=(tk.W, tk.E), pady=(5, 2))
+        ttk.Button(btn_frame, text="📋 Odczytaj pola formularzy", style='Secondary.TButton',
+                  command=self.extract_forms_dialog).grid(row=6, column=0, columnspan=2, sticky=(tk.W, tk.E), pady=(5, 2))
         
         btn_frame.columnconfigure(0, weight=1)
         btn_frame.columnconfigure(1, weight=1)
@@ -582,9 +4142,12 @@ class OCRApp:
                     messagebox.showerror("❌ Błąd", "Nie można wczytać obrazu.\nSprawdź format pliku.")
                     return
                 
+                self.current_image_digest = image_digest(self.current_image)
                 self.display_image(self.current_image, self.original_label, max_size=(500, 350))
                 
                 self.processed_image = None
+                self.processed_transform = None
+                self.processed_image_digest = None
                 self.processed_label.config(image='', text="⚙️ Przetwórz obraz aby zobaczyć rezultat")
                 self.processed_label.image = None
                 
@@ -601,14 +4164,7 @@ class OCRApp:
         if cv_image is None:
             return
 
-        if len(cv_image.shape) == 3:
-            image_rgb = cv2.cvtColor(cv_image, cv2.COLOR_BGR2RGB)
-        else:
-            image_rgb = cv_image
-
-        pil_image = Image.fromarray(image_rgb)
-
-        pil_image.thumbnail(max_size, Image.Resampling.LANCZOS)
+        pil_image = make_display_thumbnail(cv_image, max_size)
 
         from PIL import ImageOps
         pil_image = ImageOps.expand(pil_image, border=2, fill='#2E86AB')
@@ -678,12 +4234,14 @@ class OCRApp:
             return img_inverted
             
         elif option == "Redukcja szumu + powiększenie":
-            h, w = img.shape[:2]
-            img_resized = cv2.resize(img, (int(w * scale_factor), int(h * scale_factor)), 
-                                   interpolation=cv2.INTER_CUBIC)
-            img_gray = cv2.cvtColor(img_resized, cv2.COLOR_BGR2GRAY)
-            img_denoised = cv2.fastNlMeansDenoising(img_gray)
-            return img_denoised
+            # Odszumianie w natywnej rozdzielczości (scale_factor² mniej pikseli), dopiero potem powiększenie
+            img_gray = img if img.ndim == 2 else cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
+            img_denoised, method, sigma = fast_denoise(img_gray)
+            label = DENOISE_METHODS[method][0] if method else "bez odszumiania"
+            log.info("🧹 Odszumianie: %s (szum σ≈%.1f)", label, sigma)
+            h, w = img_gray.shape[:2]
+            return cv2.resize(img_denoised, (int(w * scale_factor), int(h * scale_factor)), 
+                              interpolation=cv2.INTER_CUBIC)
             
         elif option == "Wszystkie filtry (agresywne)":
             h, w = img.shape[:2]
@@ -712,12 +4270,37 @@ class OCRApp:
             processing_option = self.processing_var.get().split(' ', 1)[1] if ' ' in self.processing_var.get() else self.processing_var.get()
             scale_factor = self.scale_var.get()
             
-            self.processed_image = self.preprocess_image(self.current_image, processing_option, scale_factor)
+            cache_key = ('preprocess', self.current_image_digest, processing_option, round(scale_factor, 2),
+                         self.deskew_var.get())
+            cached = ocr_memo.get(cache_key)
+            from_cache = cached is not None
+            
+            if from_cache:
+                processed, transform = cached
+            else:
+                source_image = self.current_image
+                transform = np.eye(2, 3)
+                if self.deskew_var.get():
+                    source_image, transform = correct_page_geometry(source_image, self.original_image_path,
+                                                                    with_transform=True)
+                
+                processed = self.preprocess_image(source_image, processing_option, scale_factor)
+                if processed is self.current_image:
+                    processed = processed.copy()
+                # Przetworzony obraz bywa wyprostowany i przeskalowany - ramki OCR przeliczamy tą macierzą
+                transform = scale_transform(transform, source_image.shape, processed.shape)
+                processed.flags.writeable = False
+                ocr_memo.put(cache_key, (processed, transform))
+            
+            self.processed_image = processed
+            self.processed_transform = transform
+            self.processed_image_digest = image_digest(processed)
             
             self.display_image(self.processed_image, self.processed_label, max_size=(500, 350))
             
             self.stop_progress()
-            self.status_label.config(text=f"✅ Obraz przetworzony ({processing_option})")
+            cache_note = " ⚡ z pamięci podręcznej" if from_cache else ""
+            self.status_label.config(text=f"✅ Obraz przetworzony ({processing_option}){cache_note}")
 
             self.image_notebook.select(1)
             
@@ -734,57 +4317,82 @@ class OCRApp:
                 self.root.after(0, lambda: messagebox.showwarning("⚠️ Uwaga", "Najpierw wczytaj obraz"))
                 return
             
-            if len(image_for_ocr.shape) == 3:
-                pil_image = Image.fromarray(cv2.cvtColor(image_for_ocr, cv2.COLOR_BGR2RGB))
+            use_deskew = self.processed_image is None and self.deskew_var.get()
+            source_digest = self.processed_image_digest if self.processed_image is not None else self.current_image_digest
+            cache_key = ('ocr', source_digest, use_deskew, self.lang_var.get(), self.psm_var.get(), self.oem_var.get(),
+                         self.use_whitelist_var.get(), self.preserve_spaces_var.get(), self.auto_invert_var.get(),
+                         self.refine_var.get())
+            cached = ocr_memo.get(cache_key)
+            if cached is not None:
+                self.root.after(0, lambda: self.update_ocr_results(*cached))
+                self.root.after(0, lambda: self.status_label.config(text="⚡ OCR z pamięci podręcznej"))
+                return
+            
+            # Macierz oryginał -> obraz OCR; ramki układu przeliczamy jej odwrotnością
+            if self.processed_image is not None:
+                transform = self.processed_transform
+            elif use_deskew:
+                image_for_ocr, transform = correct_page_geometry(image_for_ocr, self.original_image_path,
+                                                                 with_transform=True)
             else:
-                pil_image = Image.fromarray(image_for_ocr)
+                transform = np.eye(2, 3)
+            
+            buffer = ImageBuffer(image_for_ocr)
             
             lang = self.lang_var.get().split(' ')[-1]
+            if lang == AUTO_LANG:
+                lang = resolve_image_language(self.original_image_path, buffer.array)
+                self.root.after(0, lambda: self.status_label.config(text=f"🔮 Wykryty język: {lang}"))
             psm = self.psm_var.get().split(' ')[0]    
             oem = self.oem_var.get().split(' ')[0]   
             
-            config_parts = [f"--oem {oem}", f"--psm {psm}"]
-            
-            if self.use_whitelist_var.get():
-                char_whitelist = "ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyzĄĆĘŁŃÓŚŹŻąćęłńóśźż0123456789 .,;:!?-"
-                config_parts.append(f"-c tessedit_char_whitelist={char_whitelist}")
-            
-            if self.preserve_spaces_var.get():
-                config_parts.append("-c preserve_interword_spaces=1")
-                
-            if self.auto_invert_var.get():
-                config_parts.append("-c tessedit_do_invert=1")
-            
-            custom_config = " ".join(config_parts)
+            session = self.get_ocr_session(lang, psm, oem, self.use_whitelist_var.get(),
+                                           self.preserve_spaces_var.get(), self.auto_invert_var.get())
 
-            text = pytesseract.image_to_string(pil_image, lang=lang, config=custom_config)
+            text = session.image_to_string(buffer)
 
             lines = text.strip().split('\n')
             non_empty_lines = [line for line in lines if line.strip()]
             char_count = len(text.strip())
             line_count = len(non_empty_lines)
+            layout = None
+            refine_note = None
 
             try:
-                confidence_data = pytesseract.image_to_data(pil_image, lang=lang, 
-                                                          config=custom_config, 
-                                                          output_type=pytesseract.Output.DATAFRAME)
+                ocr_data = session.image_to_data(buffer)
                 
-                valid_conf = confidence_data[confidence_data['conf'] > 0]['conf']
+                # Ramki w układzie obrazu OCR; do układu oryginału po ewentualnej poprawie linii
+                layout = build_ocr_layout(ocr_data)
                 
-                if len(valid_conf) > 0:
-                    avg_conf = valid_conf.mean()
-                    confidence_text = f"{avg_conf:.1f}%" if not np.isnan(avg_conf) else "0.0%"
+                if self.refine_var.get():
+                    try:
+                        improved, checked = refine_layout(session, buffer.array, layout, 1.0)
+                    except Exception as e:
+                        log.warning("⚠️ Poprawa linii o niskiej pewności nieudana: %s", e)
+                        improved, checked = 0, 0
+                    if checked:
+                        refine_note = f"🎯 Poprawiono {improved}/{checked} linii o niskiej pewności"
+                    if improved:
+                        text = layout_text(layout)
+                        char_count = len(text.strip())
+                        line_count = len([line for line in text.split('\n') if line.strip()])
+                
+                layout = layout_to_original(layout, transform, self.current_image.shape)
+                avg_conf = layout_confidence(layout)
+                
+                if avg_conf is not None:
+                    confidence_text = f"{avg_conf:.1f}%"
                 else:
                     confidence_text = "0.0%"
                     
             except pytesseract.TesseractError as te:
-                print(f"Tesseract error: {te}")
+                log.error("Tesseract error: %s", te)
                 confidence_text = "Błąd Tesseract"
             except ImportError as ie:
-                print(f"Import error: {ie}")
+                log.error("Import error: %s", ie)
                 confidence_text = "Błąd bibliotek"
             except Exception as e:
-                print(f"Confidence calculation error: {e}")
+                log.warning("Confidence calculation error: %s", e)
                 try:
                     simple_conf = 75.0  
                     if len(text.strip()) > 10: 
@@ -795,7 +4403,11 @@ class OCRApp:
                 except:
                     confidence_text = "50.0%" 
             
-            self.root.after(0, lambda: self.update_ocr_results(text, char_count, line_count, confidence_text))
+            result = (text, char_count, line_count, confidence_text, layout)
+            ocr_memo.put(cache_key, result)
+            self.root.after(0, lambda: self.update_ocr_results(*result))
+            if refine_note:
+                self.root.after(0, lambda: self.status_label.config(text=f"✅ OCR zakończone | {refine_note}"))
             
         except Exception as e:
             error_msg = str(e)
@@ -805,6 +4417,16 @@ class OCRApp:
         finally:
             self.root.after(0, self.stop_progress)
     
+    def get_ocr_session(self, *settings):
+        with self.ocr_session_lock:
+            session = OCRSession(*settings)
+            if self.ocr_session is None or self.ocr_session.settings != session.settings:
+                session.validate()
+                if self.ocr_session is not None:
+                    self.ocr_session.close()
+                self.ocr_session = session
+            return self.ocr_session
+    
     def run_ocr(self):
         if self.current_image is None:
             messagebox.showwarning("⚠️ Uwaga", "Najpierw wczytaj obraz do analizy")
@@ -817,7 +4439,8 @@ class OCRApp:
         thread.daemon = True
         thread.start()
     
-    def update_ocr_results(self, text, char_count, line_count, confidence):
+    def update_ocr_results(self, text, char_count, line_count, confidence, layout=None):
+        self.last_layout = layout
         self.result_text.delete(1.0, tk.END)
         
         if text.strip():
@@ -845,6 +4468,65 @@ class OCRApp:
         
         self.status_label.config(text=f"✅ OCR zakończone - znaleziono {char_count} znaków")
     
+    def export_layout(self):
+        if self.last_layout is None:
+            messagebox.showwarning("⚠️ Uwaga", "Najpierw uruchom OCR")
+            return
+        
+        export_path = filedialog.asksaveasfilename(
+            title="Zapisz układ tekstu",
+            defaultextension=".hocr",
+            filetypes=[("hOCR", "*.hocr *.html"), ("ALTO XML", "*.xml"), ("JSON", "*.json"), ("All files", "*.*")]
+        )
+        
+        if export_path:
+            try:
+                write_layout_file(self.last_layout, export_path, self.original_image_path or "")
+                self.status_label.config(text=f"✅ Układ zapisany: {os.path.basename(export_path)}")
+            except Exception as e:
+                messagebox.showerror("❌ Błąd", f"Nie można zapisać pliku:\n{e}")
+    
+    def extract_forms_dialog(self):
+        templates = load_form_templates()
+        if not templates:
+            messagebox.showwarning("⚠️ Uwaga", "Brak szablonów formularzy.\n"
+                                   "Dodaj szablon poleceniem: main.py template-add NAZWA OBRAZ --field ...")
+            return
+        
+        search_folder = filedialog.askdirectory(title="Wybierz folder z formularzami")
+        if not search_folder:
+            return
+        export_path = filedialog.asksaveasfilename(
+            title="Zapisz pola formularzy",
+            defaultextension=".csv",
+            filetypes=[("CSV", "*.csv"), ("JSON Lines", "*.jsonl"), ("All files", "*.*")]
+        )
+        if not export_path:
+            return
+        
+        lang = self.lang_var.get().split(' ')[-1]
+        self.start_progress()
+        self.status_label.config(text="📋 Odczytywanie formularzy...")
+        
+        def report(done, total):
+            self.root.after(0, lambda: self.status_label.config(text=f"📋 Formularze: {done}/{total}"))
+        
+        def forms_worker():
+            try:
+                stats = {}
+                records = extract_forms(search_folder, lang, self.deskew_var.get(), templates, stats, report)
+                write_form_records(export_path, records)
+                self.root.after(0, lambda: self.status_label.config(text=f"✅ {format_run_summary(stats)}"))
+            except Exception as e:
+                error_msg = f"Błąd odczytu formularzy:\n{str(e)}"
+                self.root.after(0, lambda: messagebox.showerror("❌ Błąd", error_msg))
+            finally:
+                self.root.after(0, self.stop_progress)
+        
+        thread = threading.Thread(target=forms_worker)
+        thread.daemon = True
+        thread.start()
+    
     def find_similar_images_dialog(self):
         if self.original_image_path is None:
             messagebox.showwarning("⚠️ Uwaga", "Najpierw wczytaj obraz referencyjny")
@@ -863,7 +4545,7 @@ class OCRApp:
     def show_similarity_options_dialog(self, search_folder):
         dialog = tk.Toplevel(self.root)
         dialog.title("🔎 Opcje wyszukiwania podobnych obrazów")
-        dialog.geometry("480x480")
+        dialog.geometry("480x680")
         dialog.resizable(False, False)
         dialog.transient(self.root)
         dialog.grab_set()
@@ -908,34 +4590,100 @@ class OCRApp:
         
         lang_var = tk.StringVar(value="pol+eng")
         lang_combo = ttk.Combobox(lang_frame, textvariable=lang_var, 
-                                 values=["eng", "pol", "pol+eng", "deu", "deu+eng"], 
+                                 values=["auto", "eng", "pol", "pol+eng", "deu", "deu+eng"], 
                                  state="readonly", width=15)
         lang_combo.pack(side=tk.RIGHT)
         
+        mode_frame = ttk.Frame(options_frame)
+        mode_frame.pack(fill=tk.X, pady=(0, 10))
+        
+        ttk.Label(mode_frame, text="🧮 Ocena podobieństwa:", font=('Segoe UI', 9, 'bold')).pack(side=tk.LEFT)
+        
+        mode_names = {label: mode for mode, label in SIMILARITY_MODES.items()}
+        mode_var = tk.StringVar(value=SIMILARITY_MODES['tfidf'])
+        mode_combo = ttk.Combobox(mode_frame, textvariable=mode_var, values=list(mode_names),
+                                  state="readonly", width=28)
+        mode_combo.pack(side=tk.RIGHT)
+        
         threshold_frame = ttk.Frame(options_frame)
         threshold_frame.pack(fill=tk.X, pady=(0, 10))
         
         ttk.Label(threshold_frame, text="🎯 Próg podobieństwa:", font=('Segoe UI', 9, 'bold')).pack(side=tk.LEFT)
         
-        threshold_var = tk.DoubleVar(value=0.3)
+        threshold_var = tk.DoubleVar(value=SIMILARITY_THRESHOLDS['tfidf'])
         threshold_scale = ttk.Scale(threshold_frame, from_=0.1, to=0.9, variable=threshold_var,
                                    orient=tk.HORIZONTAL, length=150)
         threshold_scale.pack(side=tk.RIGHT, padx=(10, 0))
         
-        threshold_label = ttk.Label(threshold_frame, text="30%", font=('Segoe UI', 9))
+        threshold_label = ttk.Label(threshold_frame, text=f"{int(SIMILARITY_THRESHOLDS['tfidf'] * 100)}%",
+                                    font=('Segoe UI', 9))
         threshold_label.pack(side=tk.RIGHT, padx=(5, 5))
         
         def update_threshold_label(value):
-            threshold_label.config(text=f"{int(float(value)*100)}%")
+            threshold_label.config(text=f"{int(round(float(value) * 100))}%")
         
         threshold_scale.configure(command=update_threshold_label)
         
+        def apply_mode_threshold(event=None):
+            # Skale wyników trybów są różne - po zmianie trybu jego domyślny próg
+            threshold_var.set(SIMILARITY_THRESHOLDS[mode_names[mode_var.get()]])
+            update_threshold_label(threshold_var.get())
+        
+        mode_combo.bind('<<ComboboxSelected>>', apply_mode_threshold)
+
+        perceptual_dedup_var = tk.BooleanVar(value=False)
+        ttk.Checkbutton(options_frame, text="🧬 Scalaj obrazy o identycznych pikselach (np. PNG i BMP tego samego skanu)",
+                       variable=perceptual_dedup_var).pack(anchor=tk.W)
+
+        prefilter_frame = ttk.Frame(options_frame)
+        prefilter_frame.pack(fill=tk.X, pady=(10, 0))
+
+        prefilter_var = tk.BooleanVar(value=False)
+        ttk.Checkbutton(prefilter_frame, text="👁️ Filtr wizualny",
+                       variable=prefilter_var).pack(side=tk.LEFT)
+
+        prefilter_distance_var = tk.DoubleVar(value=0.35)
+        prefilter_scale = ttk.Scale(prefilter_frame, from_=0.1, to=0.6, variable=prefilter_distance_var,
+                                   orient=tk.HORIZONTAL, length=150)
+        prefilter_scale.pack(side=tk.RIGHT, padx=(10, 0))
+
+        prefilter_label = ttk.Label(prefilter_frame, text="tolerancja 35%", font=('Segoe UI', 9))
+        prefilter_label.pack(side=tk.RIGHT, padx=(5, 5))
+
+        prefilter_scale.configure(command=lambda value: prefilter_label.config(text=f"tolerancja {int(float(value)*100)}%"))
+
+        deskew_var = tk.BooleanVar(value=self.deskew_var.get())
+        ttk.Checkbutton(options_frame, text="📐 Prostowanie i orientacja stron",
+                       variable=deskew_var).pack(anchor=tk.W, pady=(10, 0))
+
+        layout_export_var = tk.BooleanVar(value=False)
+        ttk.Checkbutton(options_frame, text="🗂️ Zapisuj układ tekstu w trakcie (hOCR/ALTO/JSONL)",
+                       variable=layout_export_var).pack(anchor=tk.W, pady=(10, 0))
+
+        resume_var = tk.BooleanVar(value=True)
+        ttk.Checkbutton(options_frame, text="♻️ Wznów przerwane wyszukiwanie (punkt kontrolny)",
+                       variable=resume_var).pack(anchor=tk.W, pady=(10, 0))
+        
         btn_frame = ttk.Frame(main_frame)
         btn_frame.pack(fill=tk.X, pady=(30, 0))
         
         def start_search():
+            layout_path = None
+            if layout_export_var.get():
+                layout_path = filedialog.asksaveasfilename(
+                    parent=dialog,
+                    title="Plik układu tekstu",
+                    defaultextension=".jsonl",
+                    filetypes=[("JSON Lines", "*.jsonl"), ("hOCR", "*.hocr"), ("ALTO XML", "*.xml")]
+                )
+                if not layout_path:
+                    return
             dialog.destroy()
-            self.search_similar_images_thread(search_folder, lang_var.get(), threshold_var.get())
+            self.search_similar_images_thread(search_folder, lang_var.get(), threshold_var.get(),
+                                              perceptual_dedup_var.get(),
+                                              prefilter_distance_var.get() if prefilter_var.get() else None,
+                                              layout_path, deskew_var.get(), mode_names[mode_var.get()],
+                                              resume_var.get())
 
         buttons_container = ttk.Frame(main_frame, padding="15")
         buttons_container.pack(fill=tk.X, pady=(10, 0))
@@ -945,128 +4693,501 @@ class OCRApp:
         ttk.Button(buttons_container, text="🔍 Rozpocznij wyszukiwanie", command=start_search, 
                   style='Primary.TButton').pack(side=tk.RIGHT, padx=(10, 0))
     
-    def search_similar_images_thread(self, search_folder, lang, threshold):
+    def search_similar_images_thread(self, search_folder, lang, threshold, perceptual_dedup=False,
+                                     visual_prefilter_distance=None, layout_path=None, deskew=False,
+                                     similarity_mode='tfidf', resume=True):
         self.start_progress()
         self.status_label.config(text="🔎 Wyszukiwanie podobnych obrazów...")
         
+        result_queue = queue.SimpleQueue()
+        results_window = self.show_similarity_results(search_folder, result_queue)
+        
         def search_worker():
+            layout_stream = None
             try:
+                stats = {}
+                if layout_path:
+                    layout_stream = LayoutStreamWriter(layout_path)
                 similar_images, error = find_similar_images(
                     self.original_image_path, 
                     search_folder, 
                     threshold, 
-                    lang
+                    lang,
+                    perceptual_dedup=perceptual_dedup,
+                    visual_prefilter_distance=visual_prefilter_distance,
+                    stats=stats,
+                    layout_stream=layout_stream,
+                    on_result=result_queue.put,
+                    deskew=deskew,
+                    similarity_mode=similarity_mode,
+                    resume=resume
                 )
                 
-                self.root.after(0, lambda: self.show_similarity_results(similar_images, error, search_folder))
+                self.root.after(0, lambda: self.finish_similarity_results(results_window, similar_images, error, stats))
                 
             except Exception as e:
                 error_msg = f"Błąd podczas wyszukiwania:\n{str(e)}"
-                self.root.after(0, lambda: messagebox.showerror("❌ Błąd", error_msg))
+                self.root.after(0, lambda: self.finish_similarity_results(results_window, [], error_msg, {}))
             finally:
+                if layout_stream is not None:
+                    layout_stream.close()
                 self.root.after(0, self.stop_progress)
         
         thread = threading.Thread(target=search_worker)
         thread.daemon = True
         thread.start()
     
-    def show_similarity_results(self, similar_images, error, search_folder):
+    def show_similarity_results(self, search_folder, result_queue):
+        results_window = tk.Toplevel(self.root)
+        results_window.title("🔎 Wyszukiwanie podobnych obrazów...")
+        results_window.geometry("800x600")
+        results_window.transient(self.root)
+        results_window.search_running = True
+        results_window.stats = {}
+        
+        main_frame = ttk.Frame(results_window, padding="10")
+        main_frame.pack(fill=tk.BOTH, expand=True)
+        
+        title_frame = ttk.Frame(main_frame)
+        title_frame.pack(fill=tk.X, pady=(0, 10))
+        
+        results_window.title_label = ttk.Label(title_frame, text="🔎 Wyszukiwanie w toku...", 
+                                              font=('Segoe UI', 14, 'bold'), foreground=self.colors['primary'])
+        results_window.title_label.pack(side=tk.LEFT)
+
+        results_window.summary_label = ttk.Label(main_frame, text="", font=('Segoe UI', 9),
+                                                foreground=self.colors['gray'])
+        results_window.summary_label.pack(anchor=tk.W, pady=(0, 10))
+
+        filter_frame = ttk.Frame(main_frame)
+        filter_frame.pack(fill=tk.X, pady=(0, 10))
+        
+        ttk.Label(filter_frame, text="🎯 Min. podobieństwo:", font=('Segoe UI', 9, 'bold')).pack(side=tk.LEFT)
+        filter_label = ttk.Label(filter_frame, text="0%", font=('Segoe UI', 9))
+        filter_label.pack(side=tk.RIGHT, padx=(5, 0))
+        filter_var = tk.DoubleVar(value=0.0)
+        filter_scale = ttk.Scale(filter_frame, from_=0.0, to=1.0, variable=filter_var,
+                                orient=tk.HORIZONTAL, length=200)
+        filter_scale.pack(side=tk.RIGHT, padx=(10, 0))
+        
+        list_frame = ttk.Frame(main_frame)
+        list_frame.pack(fill=tk.BOTH, expand=True)
+        
+        view = VirtualResultsView(list_frame)
+        results_window.view = view
+        
+        pending_filter = []
+        
+        def apply_filter():
+            pending_filter.clear()
+            view.set_min_similarity(filter_var.get())
+        
+        def update_filter(value):
+            filter_label.config(text=f"{int(float(value)*100)}%")
+            if not pending_filter:
+                pending_filter.append(results_window.after(150, apply_filter))
+        
+        filter_scale.configure(command=update_filter)
+        
+        def poll_results():
+            if not results_window.winfo_exists():
+                return
+            batch = []
+            while True:
+                try:
+                    batch.append(result_queue.get_nowait())
+                except queue.Empty:
+                    break
+            if batch:
+                view.append(batch)
+                results_window.title(f"🔎 Znalezione podobne obrazy ({len(view.records)})")
+            if results_window.search_running or batch:
+                results_window.after(200, poll_results)
+        
+        results_window.poll_results = poll_results
+        poll_results()
+        
+        btn_frame = ttk.Frame(main_frame)
+        btn_frame.pack(fill=tk.X, pady=(10, 0))
+        
+        def open_selected():
+            record = view.selected_record()
+            if record is not None:
+                os.startfile(record.path) 
+        
+        def export_results():
+            export_path = filedialog.asksaveasfilename(
+                title="Zapisz wyniki",
+                defaultextension=".json",
+                filetypes=[("JSON files", "*.json"), ("JSON Lines", "*.jsonl"), ("CSV", "*.csv"), ("All files", "*.*")]
+            )
+            
+            if export_path:
+                results = view.visible_records()
+                metadata = {
+                    'reference_image': self.original_image_path,
+                    'search_folder': search_folder,
+                    'timestamp': time.strftime('%Y-%m-%d %H:%M:%S'),
+                    'results_count': len(results),
+                    'summary': results_window.stats
+                }
+                self.export_results_thread(export_path, results, metadata)
+        
+        ttk.Button(btn_frame, text="📂 Otwórz plik", command=open_selected).pack(side=tk.LEFT, padx=(0, 5))
+        ttk.Button(btn_frame, text="💾 Eksportuj wyniki", command=export_results).pack(side=tk.LEFT, padx=(5, 5))
+        ttk.Button(btn_frame, text="❌ Zamknij", command=results_window.destroy).pack(side=tk.RIGHT)
+        
+        return results_window
+    
+    def finish_similarity_results(self, results_window, similar_images, error, stats):
+        window_open = results_window.winfo_exists()
+        if window_open:
+            results_window.search_running = False
+            results_window.stats = stats
+        
         if error:
+            if window_open:
+                results_window.destroy()
             messagebox.showerror("❌ Błąd", error)
             self.status_label.config(text="❌ Błąd wyszukiwania")
             return
         
         if not similar_images:
+            if window_open:
+                results_window.destroy()
             messagebox.showinfo("ℹ️ Informacja", "Nie znaleziono podobnych obrazów")
             self.status_label.config(text="✅ Wyszukiwanie zakończone - brak wyników")
             return
         
+        if window_open:
+            results_window.poll_results()
+            # Wyniki przesyłane w trakcie pochodzą z przesiewu - lista końcowa zawiera wyniki po weryfikacji
+            results_window.view.records = list(similar_images)
+            results_window.view.refresh()
+            results_window.title(f"🔎 Znalezione podobne obrazy ({len(similar_images)})")
+            results_window.title_label.config(text=f"🔎 Znaleziono {len(similar_images)} podobnych obrazów")
+            results_window.summary_label.config(text=format_run_summary(stats))
+        
+        self.status_label.config(text=f"✅ Znaleziono {len(similar_images)} podobnych obrazów")
+        
+        if stats.get('quarantine_report'):
+            messagebox.showwarning("🚫 Kwarantanna",
+                                   f"Nie udało się odczytać {stats['quarantined']} obrazów.\n"
+                                   f"Raport: {stats['quarantine_report']}")
+    
+    def find_similar_multi_dialog(self):
+        reference_paths = filedialog.askopenfilenames(
+            title="Wybierz obrazy wzorcowe",
+            filetypes=[("Wszystkie obrazy", "*.png *.jpg *.jpeg *.bmp *.tiff *.gif"), ("Wszystkie pliki", "*.*")]
+        )
+        if not reference_paths:
+            return
+        
+        search_folder = filedialog.askdirectory(
+            title="Wybierz folder do przeszukania",
+            initialdir=os.path.dirname(reference_paths[0])
+        )
+        if not search_folder:
+            return
+        
+        dialog = tk.Toplevel(self.root)
+        dialog.title("📎 Porównanie z wieloma wzorcami")
+        dialog.geometry("420x300")
+        dialog.resizable(False, False)
+        dialog.transient(self.root)
+        dialog.grab_set()
+        
+        main_frame = ttk.Frame(dialog, padding="20")
+        main_frame.pack(fill=tk.BOTH, expand=True)
+        
+        ttk.Label(main_frame, text=f"📎 Wzorców: {len(reference_paths)}", font=('Segoe UI', 10, 'bold')).pack(anchor=tk.W)
+        ttk.Label(main_frame, text=f"📁 {search_folder}", font=('Segoe UI', 9),
+                 foreground=self.colors['gray']).pack(anchor=tk.W, pady=(0, 15))
+        
+        options_frame = ttk.Frame(main_frame)
+        options_frame.pack(fill=tk.X)
+        
+        ttk.Label(options_frame, text="🌐 Język OCR:").grid(row=0, column=0, sticky=tk.W, pady=3)
+        lang_var = tk.StringVar(value="pol+eng")
+        ttk.Combobox(options_frame, textvariable=lang_var, values=["auto", "eng", "pol", "pol+eng", "deu", "deu+eng"],
+                     state="readonly", width=18).grid(row=0, column=1, sticky=tk.E, pady=3)
+        
+        ttk.Label(options_frame, text="🧮 Ocena podobieństwa:").grid(row=1, column=0, sticky=tk.W, pady=3)
+        mode_names = {label: mode for mode, label in SIMILARITY_MODES.items()}
+        mode_var = tk.StringVar(value=SIMILARITY_MODES['tfidf'])
+        mode_combo = ttk.Combobox(options_frame, textvariable=mode_var, values=list(mode_names),
+                                  state="readonly", width=18)
+        mode_combo.grid(row=1, column=1, sticky=tk.E, pady=3)
+        
+        ttk.Label(options_frame, text="🎯 Próg podobieństwa (%):").grid(row=2, column=0, sticky=tk.W, pady=3)
+        threshold_var = tk.IntVar(value=round(SIMILARITY_THRESHOLDS['tfidf'] * 100))
+        ttk.Spinbox(options_frame, from_=5, to=95, increment=5, textvariable=threshold_var,
+                    width=6).grid(row=2, column=1, sticky=tk.E, pady=3)
+        mode_combo.bind('<<ComboboxSelected>>', lambda event: threshold_var.set(
+            round(SIMILARITY_THRESHOLDS[mode_names[mode_var.get()]] * 100)))
+        
+        ttk.Label(options_frame, text="🏆 Najlepszych na wzorzec:").grid(row=3, column=0, sticky=tk.W, pady=3)
+        top_k_var = tk.IntVar(value=10)
+        ttk.Spinbox(options_frame, from_=1, to=1000, textvariable=top_k_var,
+                    width=6).grid(row=3, column=1, sticky=tk.E, pady=3)
+        options_frame.columnconfigure(1, weight=1)
+        
+        def start_search():
+            options = (lang_var.get(), threshold_var.get() / 100, max(1, top_k_var.get()), mode_names[mode_var.get()])
+            dialog.destroy()
+            self.search_similar_multi_thread(list(reference_paths), search_folder, *options)
+        
+        buttons_container = ttk.Frame(main_frame, padding=(0, 15, 0, 0))
+        buttons_container.pack(fill=tk.X)
+        ttk.Button(buttons_container, text="❌ Anuluj", command=dialog.destroy,
+                  style='Secondary.TButton').pack(side=tk.LEFT)
+        ttk.Button(buttons_container, text="🔍 Porównaj", command=start_search,
+                  style='Primary.TButton').pack(side=tk.RIGHT)
+    
+    def search_similar_multi_thread(self, reference_paths, search_folder, lang, threshold, top_k, similarity_mode):
+        self.start_progress()
+        self.status_label.config(text=f"📎 Porównywanie z {len(reference_paths)} wzorcami...")
+        
+        def search_worker():
+            try:
+                stats = {}
+                per_reference, assignments, error = find_similar_images_multi(
+                    reference_paths, search_folder, threshold, lang, top_k, similarity_mode, stats=stats)
+                self.root.after(0, lambda: self.show_multi_results(per_reference, assignments, error, search_folder, stats))
+            except Exception as e:
+                error_msg = f"Błąd podczas wyszukiwania:\n{str(e)}"
+                self.root.after(0, lambda: messagebox.showerror("❌ Błąd", error_msg))
+            finally:
+                self.root.after(0, self.stop_progress)
+        
+        thread = threading.Thread(target=search_worker)
+        thread.daemon = True
+        thread.start()
+    
+    def show_multi_results(self, per_reference, assignments, error, search_folder, stats):
+        if error:
+            messagebox.showerror("❌ Błąd", error)
+            self.status_label.config(text="❌ Błąd wyszukiwania")
+            return
+        
         results_window = tk.Toplevel(self.root)
-        results_window.title(f"🔎 Znalezione podobne obrazy ({len(similar_images)})")
+        results_window.title(f"📎 Dopasowania do wzorców ({len(assignments)})")
         results_window.geometry("800x600")
         results_window.transient(self.root)
         
         main_frame = ttk.Frame(results_window, padding="10")
         main_frame.pack(fill=tk.BOTH, expand=True)
         
-        title_frame = ttk.Frame(main_frame)
-        title_frame.pack(fill=tk.X, pady=(0, 10))
+        ttk.Label(main_frame, text=format_run_summary(stats), font=('Segoe UI', 9),
+                 foreground=self.colors['gray']).pack(anchor=tk.W, pady=(0, 10))
         
-        ttk.Label(title_frame, text=f"🔎 Znaleziono {len(similar_images)} podobnych obrazów", 
-                 font=('Segoe UI', 14, 'bold'), foreground=self.colors['primary']).pack(side=tk.LEFT)
+        best_match_label = "🏆 Najlepszy wzorzec dla każdego pliku"
+        views = {best_match_label: [
+            SimilarityResult(a.path, a.similarity, f"📎 {os.path.basename(a.reference)} | {a.text}") for a in assignments
+        ]}
+        for ref_path, results in per_reference.items():
+            views[f"📎 {os.path.basename(ref_path)} (top {len(results)})"] = results
+        
+        view_var = tk.StringVar(value=best_match_label)
+        view_combo = ttk.Combobox(main_frame, textvariable=view_var, values=list(views), state="readonly", width=60)
+        view_combo.pack(anchor=tk.W, pady=(0, 10))
         
         list_frame = ttk.Frame(main_frame)
         list_frame.pack(fill=tk.BOTH, expand=True)
+        view = VirtualResultsView(list_frame)
+        view.append(views[best_match_label])
         
-        columns = ('Plik', 'Podobieństwo', 'Tekst')
-        results_tree = ttk.Treeview(list_frame, columns=columns, show='headings', height=15)
-
-        results_tree.heading('Plik', text='📄 Nazwa pliku')
-        results_tree.heading('Podobieństwo', text='🎯 Podobieństwo')
-        results_tree.heading('Tekst', text='📝 Fragment tekstu')
-        
-        results_tree.column('Plik', width=200)
-        results_tree.column('Podobieństwo', width=100, anchor='center')
-        results_tree.column('Tekst', width=400)
+        def switch_view(event=None):
+            view.records = list(views[view_var.get()])
+            view.refresh()
         
-        for img_data in similar_images:
-            similarity_percent = f"{img_data['similarity']:.1%}"
-            text_preview = img_data['text'][:100] + "..." if len(img_data['text']) > 100 else img_data['text']
-            
-            results_tree.insert('', 'end', values=(
-                img_data['filename'],
-                similarity_percent,
-                text_preview
-            ), tags=('result',))
+        view_combo.bind('<<ComboboxSelected>>', switch_view)
         
-        scrollbar = ttk.Scrollbar(list_frame, orient=tk.VERTICAL, command=results_tree.yview)
-        results_tree.configure(yscrollcommand=scrollbar.set)
+        def open_selected():
+            record = view.selected_record()
+            if record is not None:
+                os.startfile(record.path)
         
-        results_tree.pack(side=tk.LEFT, fill=tk.BOTH, expand=True)
-        scrollbar.pack(side=tk.RIGHT, fill=tk.Y)
+        def export_results():
+            export_path = filedialog.asksaveasfilename(
+                title="Zapisz wyniki",
+                defaultextension=".json",
+                filetypes=[("JSON files", "*.json"), ("JSON Lines", "*.jsonl"), ("CSV", "*.csv"), ("All files", "*.*")]
+            )
+            if export_path:
+                metadata = {
+                    'references': list(per_reference),
+                    'search_folder': search_folder,
+                    'timestamp': time.strftime('%Y-%m-%d %H:%M:%S'),
+                    'results_count': len(assignments),
+                    'summary': stats,
+                    'top_k': {ref: [r.to_dict() for r in results] for ref, results in per_reference.items()}
+                }
+                self.export_results_thread(export_path, list(assignments), metadata)
         
         btn_frame = ttk.Frame(main_frame)
         btn_frame.pack(fill=tk.X, pady=(10, 0))
+        ttk.Button(btn_frame, text="📂 Otwórz plik", command=open_selected).pack(side=tk.LEFT, padx=(0, 5))
+        ttk.Button(btn_frame, text="💾 Eksportuj wyniki", command=export_results).pack(side=tk.LEFT, padx=(5, 5))
+        ttk.Button(btn_frame, text="❌ Zamknij", command=results_window.destroy).pack(side=tk.RIGHT)
         
-        def open_selected():
-            selection = results_tree.selection()
-            if selection:
-                item = results_tree.item(selection[0])
-                filename = item['values'][0]
-                for img_data in similar_images:
-                    if img_data['filename'] == filename:
-                        os.startfile(img_data['path']) 
-                        break
+        self.status_label.config(text=f"✅ Dopasowano {len(assignments)} plików do {len(per_reference)} wzorców")
+    
+    def text_search_dialog(self):
+        window = tk.Toplevel(self.root)
+        window.title("🔤 Wyszukiwanie w tekście dokumentów")
+        window.geometry("800x600")
+        window.transient(self.root)
         
-        def export_results():
+        main_frame = ttk.Frame(window, padding="10")
+        main_frame.pack(fill=tk.BOTH, expand=True)
+        
+        ttk.Label(main_frame, text='Słowa muszą wystąpić wszystkie, "fraza" w cudzysłowie, prefiks z gwiazdką (zapł*). '
+                                  'Wielkość liter i polskie znaki nie mają znaczenia.',
+                 font=('Segoe UI', 9), foreground=self.colors['gray'], wraplength=760).pack(anchor=tk.W, pady=(0, 10))
+        
+        query_frame = ttk.Frame(main_frame)
+        query_frame.pack(fill=tk.X)
+        query_var = tk.StringVar()
+        query_entry = ttk.Entry(query_frame, textvariable=query_var, font=('Segoe UI', 11))
+        query_entry.pack(side=tk.LEFT, fill=tk.X, expand=True, padx=(0, 10))
+        
+        folder_var = tk.StringVar(value=os.path.dirname(self.original_image_path) if self.original_image_path else "")
+        only_folder_var = tk.BooleanVar(value=False)
+        folder_frame = ttk.Frame(main_frame)
+        folder_frame.pack(fill=tk.X, pady=(10, 10))
+        ttk.Checkbutton(folder_frame, text="📁 Tylko folder:", variable=only_folder_var).pack(side=tk.LEFT)
+        ttk.Label(folder_frame, textvariable=folder_var, font=('Segoe UI', 9),
+                 foreground=self.colors['gray']).pack(side=tk.LEFT, padx=(5, 0))
+        
+        def choose_folder():
+            folder = filedialog.askdirectory(parent=window, title="Wybierz folder", initialdir=folder_var.get() or None)
+            if folder:
+                folder_var.set(folder)
+                only_folder_var.set(True)
+        
+        ttk.Button(folder_frame, text="📂 Zmień", command=choose_folder).pack(side=tk.RIGHT)
+        
+        list_frame = ttk.Frame(main_frame)
+        list_frame.pack(fill=tk.BOTH, expand=True)
+        view = VirtualResultsView(list_frame)
+        view.tree.heading('Podobieństwo', text='🎯 Trafność')
+        
+        status_label = ttk.Label(main_frame, text="", font=('Segoe UI', 9), foreground=self.colors['gray'])
+        status_label.pack(anchor=tk.W, pady=(5, 0))
+        
+        def run_search(event=None):
+            query = query_var.get().strip()
+            if not query:
+                return
+            folder = folder_var.get() if only_folder_var.get() and folder_var.get() else None
             try:
-                export_path = filedialog.asksaveasfilename(
-                    title="Zapisz wyniki",
-                    defaultextension=".json",
-                    filetypes=[("JSON files", "*.json"), ("All files", "*.*")]
-                )
-                
-                if export_path:
-                    export_data = {
-                        'reference_image': self.original_image_path,
-                        'search_folder': search_folder,
-                        'timestamp': time.strftime('%Y-%m-%d %H:%M:%S'),
-                        'results_count': len(similar_images),
-                        'results': similar_images
-                    }
-                    
-                    with open(export_path, 'w', encoding='utf-8') as f:
-                        json.dump(export_data, f, ensure_ascii=False, indent=2)
-                    
-                    messagebox.showinfo("✅ Sukces", f"Wyniki zapisane do:\n{export_path}")
-            except Exception as e:
-                messagebox.showerror("❌ Błąd", f"Nie można zapisać pliku:\n{e}")
+                results, elapsed = search_text_index(query, folder)
+            except (sqlite3.Error, OSError) as e:
+                messagebox.showerror("❌ Błąd", f"Błąd indeksu tekstu:\n{e}", parent=window)
+                return
+            view.records = list(results)
+            view.refresh()
+            status_label.config(text=f"🔤 {len(results)} wyników w {elapsed * 1000:.1f} ms")
+        
+        def index_current_folder():
+            folder = folder_var.get() or filedialog.askdirectory(parent=window, title="Folder do zindeksowania")
+            if not folder:
+                return
+            folder_var.set(folder)
+            self.start_progress()
+            status_label.config(text=f"🔤 Indeksowanie {folder}...")
+            
+            def report(done, total):
+                self.root.after(0, lambda: status_label.config(text=f"🔤 Indeksowanie: {done}/{total}"))
+            
+            def index_worker():
+                try:
+                    stats = index_folder(folder, self.lang_var.get().split(' ')[-1], self.deskew_var.get(),
+                                         on_progress=report)
+                    self.root.after(0, lambda: status_label.config(text=f"✅ {format_run_summary(stats)}"))
+                except Exception as e:
+                    error_msg = f"Błąd indeksowania:\n{str(e)}"
+                    self.root.after(0, lambda: messagebox.showerror("❌ Błąd", error_msg))
+                finally:
+                    self.root.after(0, self.stop_progress)
+            
+            thread = threading.Thread(target=index_worker)
+            thread.daemon = True
+            thread.start()
+        
+        def rebuild_similarity_index():
+            self.start_progress()
+            status_label.config(text="🧮 Budowa indeksu podobieństwa...")
+            
+            def report(done, total):
+                self.root.after(0, lambda: status_label.config(text=f"🧮 Budowa indeksu: etap {done}/{total}"))
+            
+            def build_worker():
+                try:
+                    manifest = build_sharded_index(on_progress=report)
+                    summary = f"✅ Indeks podobieństwa: {manifest['documents']} dokumentów, {len(manifest['shards'])} fragmentów"
+                    self.root.after(0, lambda: status_label.config(text=summary))
+                except Exception as e:
+                    error_msg = f"Błąd budowy indeksu:\n{str(e)}"
+                    self.root.after(0, lambda: messagebox.showerror("❌ Błąd", error_msg))
+                finally:
+                    self.root.after(0, self.stop_progress)
+            
+            thread = threading.Thread(target=build_worker)
+            thread.daemon = True
+            thread.start()
+        
+        def similar_to_current():
+            reference_text = self.result_text.get(1.0, tk.END).strip()
+            if not reference_text:
+                messagebox.showwarning("⚠️ Uwaga", "Najpierw rozpoznaj tekst obrazu (OCR)", parent=window)
+                return
+            try:
+                results, elapsed = search_similar_in_index(reference_text, top_k=TEXT_SEARCH_LIMIT)
+            except FileNotFoundError:
+                messagebox.showwarning("⚠️ Uwaga", "Brak indeksu podobieństwa - użyj \"🧮 Przebuduj indeks podobieństwa\"",
+                                       parent=window)
+                return
+            except (sqlite3.Error, OSError, ValueError) as e:
+                messagebox.showerror("❌ Błąd", f"Błąd indeksu podobieństwa:\n{e}", parent=window)
+                return
+            view.records = list(results)
+            view.refresh()
+            status_label.config(text=f"📄 {len(results)} podobnych dokumentów w {elapsed * 1000:.1f} ms")
+        
+        def open_selected():
+            record = view.selected_record()
+            if record is not None:
+                os.startfile(record.path)
         
+        ttk.Button(query_frame, text="🔍 Szukaj", command=run_search, style='Primary.TButton').pack(side=tk.RIGHT)
+        query_entry.bind('<Return>', run_search)
+        query_entry.focus_set()
+        
+        btn_frame = ttk.Frame(main_frame)
+        btn_frame.pack(fill=tk.X, pady=(10, 0))
         ttk.Button(btn_frame, text="📂 Otwórz plik", command=open_selected).pack(side=tk.LEFT, padx=(0, 5))
-        ttk.Button(btn_frame, text="💾 Eksportuj wyniki", command=export_results).pack(side=tk.LEFT, padx=(5, 5))
-        ttk.Button(btn_frame, text="❌ Zamknij", command=results_window.destroy).pack(side=tk.RIGHT)
+        ttk.Button(btn_frame, text="🔤 Zindeksuj folder", command=index_current_folder).pack(side=tk.LEFT, padx=(5, 5))
+        ttk.Button(btn_frame, text="📄 Podobne do bieżącego tekstu", command=similar_to_current).pack(side=tk.LEFT, padx=(5, 5))
+        ttk.Button(btn_frame, text="🧮 Przebuduj indeks podobieństwa", command=rebuild_similarity_index).pack(side=tk.LEFT, padx=(5, 5))
+        ttk.Button(btn_frame, text="❌ Zamknij", command=window.destroy).pack(side=tk.RIGHT)
+    
+    def export_results_thread(self, export_path, results, metadata):
+        self.status_label.config(text="💾 Zapisywanie wyników...")
         
-        self.status_label.config(text=f"✅ Znaleziono {len(similar_images)} podobnych obrazów")
+        def export_worker():
+            try:
+                count = write_results(export_path, results, metadata)
+                self.root.after(0, lambda: messagebox.showinfo("✅ Sukces", f"Zapisano {count} wyników do:\n{export_path}"))
+                self.root.after(0, lambda: self.status_label.config(text=f"✅ Wyniki zapisane: {os.path.basename(export_path)}"))
+            except Exception as e:
+                error_msg = f"Nie można zapisać pliku:\n{e}"
+                self.root.after(0, lambda: messagebox.showerror("❌ Błąd", error_msg))
+        
+        thread = threading.Thread(target=export_worker)
+        thread.daemon = True
+        thread.start()
     
     def start_progress(self):
         self.progress.start(10)
@@ -1074,10 +5195,160 @@ class OCRApp:
     def stop_progress(self):
         self.progress.stop()
 
+def run_cli(argv):
+    global METRICS_FILE
+    parser = argparse.ArgumentParser(prog="main.py", description="OCR Tesseract Pro - tryb bez interfejsu graficznego")
+    parser.add_argument('--log-level', default=LOG_LEVEL, help="DEBUG, INFO, WARNING, ERROR lub OFF")
+    parser.add_argument('--log-format', default=LOG_FORMAT, choices=('text', 'json'))
+    parser.add_argument('--metrics-file', default=METRICS_FILE, help="Plik metryk Prometheusa (textfile collector)")
+    parser.add_argument('--metrics-port', type=int, default=METRICS_PORT, help="Lokalny endpoint /metrics na czas działania")
+    commands = parser.add_subparsers(dest='command', required=True)
+    
+    index_parser = commands.add_parser('index', help="Zindeksuj tekst OCR obrazów z folderu")
+    index_parser.add_argument('folder')
+    index_parser.add_argument('--lang', default="pol+eng")
+    index_parser.add_argument('--deskew', action='store_true')
+    
+    search_parser = commands.add_parser('search', help="Szukaj słów, fraz (\"...\") i prefiksów (słowo*) w indeksie")
+    search_parser.add_argument('query')
+    search_parser.add_argument('--folder', help="Tylko dokumenty z tego folderu")
+    search_parser.add_argument('--limit', type=int, default=TEXT_SEARCH_LIMIT)
+    
+    build_parser = commands.add_parser('build-index', help="Zbuduj fragmentowany indeks TF-IDF z indeksu tekstu")
+    build_parser.add_argument('--shard-size', type=int, default=TFIDF_SHARD_SIZE)
+    build_parser.add_argument('--workers', type=int, help="Liczba procesów (domyślnie liczba rdzeni)")
+    
+    similar_parser = commands.add_parser('similar', help="Znajdź dokumenty podobne do obrazu wzorcowego (lub tekstu z --text)")
+    similar_parser.add_argument('reference')
+    similar_parser.add_argument('--text', action='store_true', help="Argument jest tekstem, nie ścieżką obrazu")
+    similar_parser.add_argument('--top-k', type=int, default=10)
+    similar_parser.add_argument('--lang', default="pol+eng")
+    similar_parser.add_argument('--deskew', action='store_true')
+    
+    template_parser = commands.add_parser('template-add', help="Zarejestruj szablon formularza na podstawie wzorca")
+    template_parser.add_argument('name')
+    template_parser.add_argument('image', help="Przykładowa strona formularza")
+    template_parser.add_argument('--field', action='append', required=True, metavar="NAZWA=x0,y0,x1,y1[:typ]",
+                                 help=f"Obszar pola w pikselach wzorca lub względnie (0-1); typy: {', '.join(FORM_FIELD_TYPES)}")
+    template_parser.add_argument('--keyword', action='append', default=[], help="Słowo z nagłówka formularza")
+    template_parser.add_argument('--deskew', action='store_true')
+    
+    commands.add_parser('template-list', help="Pokaż zarejestrowane szablony formularzy")
+    
+    forms_parser = commands.add_parser('forms', help="Odczytaj pola formularzy z folderu według szablonów")
+    forms_parser.add_argument('folder')
+    forms_parser.add_argument('--output', help="Plik wynikowy .jsonl lub .csv (domyślnie JSON Lines na wyjście)")
+    forms_parser.add_argument('--lang', default="pol+eng")
+    forms_parser.add_argument('--deskew', action='store_true')
+    
+    commands.add_parser('check', help="Sprawdź Tesseract i dostępne modele językowe (test uruchomienia)")
+    
+    args = parser.parse_args(argv)
+    METRICS_FILE = args.metrics_file
+    configure_logging(args.log_level.upper(), args.log_format)
+    if args.metrics_port:
+        serve_metrics(args.metrics_port)
+    
+    if args.command == 'check':
+        try:
+            version = pytesseract.get_tesseract_version()
+            languages = sorted(get_available_languages())
+        except Exception as e:
+            log.error("❌ %s", e)
+            return 1
+        print(f"Tesseract {version}")
+        print(f"Języki: {', '.join(languages)}")
+        
+        session = OCRSession(LANG_DETECTION_MODEL, 6, 1, whitelist=True, preserve_spaces=True, invert=True, tier=None)
+        problems = config_split_problems(session.config, session.variables)
+        for kind in FORM_FIELD_TYPES:
+            field = FormField(kind, [0, 0, 1, 1], kind)
+            problems += config_split_problems(field.config(), field.variables())
+        for problem in problems:
+            log.error("❌ Zmienna Tesseracta nie dotrze do silnika: %s", problem)
+        if problems:
+            return 1
+        print("Zmienne Tesseracta (-c): OK")
+        return 0
+    
+    if args.command == 'template-add':
+        try:
+            fields = []
+            for spec in args.field:
+                name, _, rest = spec.partition('=')
+                coords, _, kind = rest.partition(':')
+                fields.append(FormField(name, [float(v) for v in coords.split(',')], kind or 'line'))
+            template = FormTemplate.from_image(args.name, args.image, fields, args.keyword, args.deskew)
+            register_form_template(template)
+        except (ValueError, OSError) as e:
+            log.error("❌ %s", e)
+            return 1
+        log.info("📋 Zapisano szablon '%s' (pola: %d)", template.name, len(template.fields))
+        return 0
+    
+    if args.command == 'template-list':
+        for template in load_form_templates():
+            fields = ", ".join(f"{field.name} ({field.kind})" for field in template.fields)
+            print(f"{template.name}\t{fields}\t{' '.join(template.keywords)}")
+        return 0
+    
+    if args.command == 'forms':
+        try:
+            records = extract_forms(args.folder, args.lang, args.deskew)
+        except (ValueError, OSError) as e:
+            log.error("❌ %s", e)
+            return 1
+        if args.output:
+            write_form_records(args.output, records)
+        else:
+            for record in records:
+                print(json.dumps(record, ensure_ascii=False))
+        return 0
+    
+    if args.command == 'build-index':
+        try:
+            build_sharded_index(shard_size=args.shard_size, workers=args.workers)
+        except (ValueError, RuntimeError, sqlite3.Error, OSError) as e:
+            log.error("❌ %s", e)
+            return 1
+        return 0
+    
+    if args.command == 'similar':
+        try:
+            reference_text = args.reference if args.text else ocr_image_file(args.reference, args.lang, args.deskew)[0]
+            results, elapsed = search_similar_in_index(reference_text, args.top_k)
+        except (OCRFailure, sqlite3.Error, OSError) as e:
+            log.error("❌ %s", e)
+            return 1
+        for result in results:
+            print(f"{result.similarity:6.1%}\t{result.path}")
+        log.info("🧮 %d wyników w %.1f ms", len(results), elapsed * 1000)
+        return 0
+    
+    if args.command == 'index':
+        try:
+            index_folder(args.folder, args.lang, args.deskew)
+        except (ValueError, OSError) as e:
+            log.error("❌ %s", e)
+            return 1
+        return 0
+    
+    results, elapsed = search_text_index(args.query, args.folder, args.limit)
+    for result in results:
+        print(f"{result.similarity:6.1%}\t{result.path}\t{result.text}")
+    log.info("🔤 %d wyników w %.1f ms", len(results), elapsed * 1000)
+    return 0
+
 def main():
+    if len(sys.argv) > 1:
+        return run_cli(sys.argv[1:])
+    if METRICS_PORT:
+        serve_metrics(METRICS_PORT)
     root = tk.Tk()
     app = OCRApp(root)
     root.mainloop()
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    # W EXE (PyInstaller) procesy potomne ProcessPoolExecutor uruchamiają ten plik ponownie
+    multiprocessing.freeze_support()
+    sys.exit(main())
\ No newline at end of file